@@ -1,74 +1,267 @@
-import os, json, base64, threading, time, sqlite3, urllib.parse
-from datetime import datetime, timezone, timedelta
-from flask import Flask, request, jsonify, Response, g, send_from_directory
-import requests
-from mongo_sink import mongo_enabled, init_mongo, insert_one_sample, clear_collection
+import hmac, os, json, threading, time, urllib.parse, zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from flask import Flask, request, jsonify, Response, send_from_directory, g
+from mongo_sink import mongo_enabled, init_mongo, insert_one_sample, insert_many_samples, clear_collection, INSERT_FAILURES as MONGO_INSERT_FAILURES
+from ingest_queue import IngestQueue
+from storage import Storage
+from schema import ensure_schema, pending_legacy, sample_row, row_to_item, us_to_iso, iso_to_us, parse_device, DEFAULT_DEVICE
+from partitions import PartitionManager
+from dump_format import DUMP_FORMATS, write_dump, manifest_path
+from github_client import GitHubClient, GitHubError
+from compact import compact
+from sinks import SINK_NAMES, LocalFolder, RepoFolder, S3Folder, Outbox, Sink, Sinks
+import exporters
+import downsample
+import columnar
+from live_cache import DataVersion, LiveStats
+from rollups import Rollups, WIDTHS as ROLLUP_WIDTHS
+from stream import EventBroker, encode_event, ticker
+from scheduler import FileLock, Scheduler
+from dump_policy import DumpPolicy
+from jobs import Cancelled, JobRunner
+from metrics import REGISTRY, SLOW_BUCKETS
+from profiler import Busy as ProfilerBusy, Profiler
+import migrate_db
 from dotenv import load_dotenv, find_dotenv
 load_dotenv(find_dotenv())
 
-DB_PATH = os.path.join(os.path.dirname(__file__), "data.sqlite")
+DB_PATH = os.getenv("DB_PATH", os.path.join(os.path.dirname(__file__), "data.sqlite"))
 STATE_PATH = os.path.join(os.path.dirname(__file__), "dump_state.json")
 app = Flask(__name__, static_folder="static", static_url_path="/static")
 
 DUMP_ENABLED = os.getenv("DUMP_ENABLED", "true").lower() == "true"
-DUMP_INTERVAL_SECONDS = int(os.getenv("DUMP_INTERVAL_SECONDS", "60"))
+DUMP_INTERVAL_SECONDS = int(os.getenv("DUMP_INTERVAL_SECONDS", "60"))   # max age: pending rows never wait longer
+DUMP_TRIGGER_ROWS = int(os.getenv("DUMP_TRIGGER_ROWS", "0"))     # dump as soon as this many rows are pending (0 = off)
+DUMP_TRIGGER_BYTES = int(os.getenv("DUMP_TRIGGER_BYTES", "0"))   # ... or the dump would be about this big (0 = off)
+DUMP_MIN_INTERVAL_S = float(os.getenv("DUMP_MIN_INTERVAL_S", "5"))
+DUMP_BACKOFF_S = float(os.getenv("DUMP_BACKOFF_S", "5"))         # after a failed auto dump: full-jitter exponential backoff
+DUMP_BACKOFF_MAX_S = float(os.getenv("DUMP_BACKOFF_MAX_S", "600"))
+DUMP_CHECK_S = float(os.getenv("DUMP_CHECK_S", "2"))             # how often the leader evaluates the triggers
+DUMP_MAX_ROWS_PER_FILE = int(os.getenv("DUMP_MAX_ROWS_PER_FILE", "50000"))
+DUMP_FORMAT = os.getenv("DUMP_FORMAT", "ndjson.gz")   # ndjson.gz (v2, gzip'd NDJSON) | json (v1, the original)
+DUMP_COMMIT_MAX_FILES = int(os.getenv("DUMP_COMMIT_MAX_FILES", "20"))   # files per GitHub commit (one dump may make several)
+DUMP_COMPACT_ENABLED = os.getenv("DUMP_COMPACT_ENABLED", "false").lower() == "true"   # merge closed days into daily archives
+DUMP_COMPACT_INTERVAL_S = float(os.getenv("DUMP_COMPACT_INTERVAL_S", "3600"))
+DUMP_COMPACT_MIN_FILES = int(os.getenv("DUMP_COMPACT_MIN_FILES", "2"))
+DUMP_COMPACT_MAX_FILES = int(os.getenv("DUMP_COMPACT_MAX_FILES", "500"))   # source files per compaction commit
+# Dump destinations (sinks.py): comma list of github, local, s3; rows are pruned once DUMP_QUORUM of them have a batch
+DUMP_SINKS = [s.strip() for s in os.getenv("DUMP_SINKS", "github").split(",") if s.strip()]
+DUMP_QUORUM = int(os.getenv("DUMP_QUORUM", "0")) or len(DUMP_SINKS) // 2 + 1   # default: a majority
+DUMP_OUTBOX_DIR = os.getenv("DUMP_OUTBOX_DIR", os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "outbox"))
+DUMP_SINK_RETRY_S = float(os.getenv("DUMP_SINK_RETRY_S", "30"))
+DUMP_SINK_BACKOFF_MAX_S = float(os.getenv("DUMP_SINK_BACKOFF_MAX_S", "600"))
+DUMP_LOCAL_DIR = os.getenv("DUMP_LOCAL_DIR", os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "dumps"))
+DUMP_LOCAL_KEEP_DAYS = float(os.getenv("DUMP_LOCAL_KEEP_DAYS", "14"))   # 0 keeps everything
+DUMP_S3_ENDPOINT = os.getenv("DUMP_S3_ENDPOINT", "https://s3.amazonaws.com")
+DUMP_S3_BUCKET = os.getenv("DUMP_S3_BUCKET", "")
+DUMP_S3_PREFIX = os.getenv("DUMP_S3_PREFIX", "PSP-Arduino/Data")
+DUMP_S3_REGION = os.getenv("DUMP_S3_REGION", "us-east-1")
+DUMP_S3_ACCESS_KEY = os.getenv("DUMP_S3_ACCESS_KEY", "")
+DUMP_S3_SECRET_KEY = os.getenv("DUMP_S3_SECRET_KEY", "")
+DELETE_PARALLEL = int(os.getenv("DELETE_PARALLEL", "4"))   # concurrent deletes when delete-all falls back to the contents API
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN", "")
 GITHUB_REPO = os.getenv("GITHUB_REPO", "quynhanh726/PSP-Post-Surgery-Pillow-")
 GITHUB_BRANCH = os.getenv("GITHUB_BRANCH", "main")
 GITHUB_PATH = os.getenv("GITHUB_PATH", "PSP-Arduino/Data")
 
 FSR_COUNT = 8
+BATCH_MAX_SAMPLES = int(os.getenv("BATCH_MAX_SAMPLES", "5000"))
 
-LAST_DUMP = {"when": None, "type": None, "ok": None, "message": None, "filename": None, "rows": 0, "deleted": 0}
+# Ingest mode: "sync" commits inside the request; "write_behind" queues samples
+# for a dedicated writer thread that group-commits them
+INGEST_MODE = os.getenv("INGEST_MODE", "sync").lower()
+INGEST_QUEUE_MAX = int(os.getenv("INGEST_QUEUE_MAX", "20000"))
+INGEST_FLUSH_ROWS = int(os.getenv("INGEST_FLUSH_ROWS", "500"))
+INGEST_FLUSH_MS = int(os.getenv("INGEST_FLUSH_MS", "200"))
+INGEST_RETRY_AFTER = int(os.getenv("INGEST_RETRY_AFTER", "1"))
+# Per-device share of the write-behind buffer, so one chatty pillow can't crowd out the ward
+INGEST_DEVICE_QUEUE_MAX = int(os.getenv("INGEST_DEVICE_QUEUE_MAX", str(max(1, INGEST_QUEUE_MAX // 4))))
 
-def get_db():
-    db = getattr(g, "_db", None)
-    if db is None:
-        db = g._db = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
-        db.row_factory = sqlite3.Row
-    return db
+# Live push channel (/api/stream, Server-Sent Events). Under gunicorn -k gthread each stream client holds one of
+# the worker's request threads while connected, so the cap stays below the thread count and leaves room for ingest
+WEB_THREADS = int(os.getenv("WEB_THREADS", "8"))   # set to gunicorn's --threads
+SSE_MAX_CLIENTS = max(1, min(int(os.getenv("SSE_MAX_CLIENTS", str(WEB_THREADS // 2))), WEB_THREADS - 1))
+SSE_CLIENT_BUFFER = int(os.getenv("SSE_CLIENT_BUFFER", "256"))
 
-@app.teardown_appcontext
-def close_db(exception):
-    db = getattr(g, "_db", None)
-    if db is not None:
-        db.close()
+# Continuous aggregates (rollup_30s / rollup_1m), folded in on a background pass
+ROLLUP_INTERVAL_S = float(os.getenv("ROLLUP_INTERVAL_S", "10"))
+ROLLUP_BATCH_ROWS = int(os.getenv("ROLLUP_BATCH_ROWS", "50000"))
+
+# Tiered retention (GET /api/retention): raw rows, then 30 s / 1 min rollups, then hourly and daily summaries
+RETAIN_RAW_S = float(os.getenv("RETAIN_RAW_S", "0"))   # 0: raw rows go as soon as a quorum of sinks has them
+RETAIN_RAW_REQUIRE_DUMP = os.getenv("RETAIN_RAW_REQUIRE_DUMP", "true").lower() == "true"   # false: age out undumped rows too
+RETAIN_ROLLUP_S = {res: float(os.getenv(f"RETAIN_ROLLUP_{res.upper()}_S", default)) for res, default in
+                   (("30s", str(30 * 86400)), ("1m", str(30 * 86400)), ("1h", "0"), ("1d", "0"))}   # 0 keeps forever
+RETAIN_INTERVAL_S = float(os.getenv("RETAIN_INTERVAL_S", "60"))
+RETAIN_BATCH_ROWS = int(os.getenv("RETAIN_BATCH_ROWS", "5000"))   # rollup buckets deleted per transaction
+
+# Multi-worker serving: background jobs run in one elected process; the others catch up from SQLite
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))   # gunicorn reads the same variable for -w
+LOCK_DIR = os.getenv("LOCK_DIR", os.path.dirname(os.path.abspath(DB_PATH)))
+WORKER_SYNC_S = float(os.getenv("WORKER_SYNC_S", "0.5"))
+
+# dump-now and delete-all run as background jobs (GET /api/jobs/<id>)
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(LOCK_DIR, "jobs"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "50"))   # finished jobs kept for /api/jobs
+
+# GET /metrics; with WEB_CONCURRENCY>1 workers share their counts through METRICS_DIR
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(LOCK_DIR, "worker-metrics"))
+METRICS_SHARE_S = float(os.getenv("METRICS_SHARE_S", "5"))
+
+# GET /api/debug/profile: off unless a token is set
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_MAX_S = float(os.getenv("PROFILE_MAX_S", "60"))
+
+DELETE_PROGRESS = {"running": False, "mode": None, "total": 0, "deleted": 0, "errors": 0, "started": None}
+LAST_DUMP = {"when": None, "type": None, "ok": None, "message": None, "filename": None, "rows": 0, "bytes": 0, "deleted": 0, "devices": {}}
+
+# One writer + a pool of read-only connections, kept open for the process lifetime
+STORAGE = Storage(DB_PATH)
+# Samples live in hourly/daily tables; PARTS routes inserts and spans reads
+PARTS = PartitionManager()
+# Newest id + change epoch; drives ETags so unchanged polls skip SQLite entirely
+DATA_VERSION = DataVersion()
+# Newest sample + running counters per partition, so /api/latest and /api/stats never query SQLite
+LIVE = LiveStats(cell=PARTS.cell, span_us=PARTS.span_us)
+# Per-30 s / minute / hour / day aggregates that outlive the raw rows
+ROLLUPS = Rollups()
+# Encodes each live event once and fans it out to every /api/stream client
+BROKER = EventBroker(max_clients=SSE_MAX_CLIENTS, client_buffer=SSE_CLIENT_BUFFER)
+# Dumps, rollups and migration run only in the process holding scheduler.lock
+SCHEDULER = Scheduler(os.path.join(LOCK_DIR, "scheduler.lock"))
+# One dump at a time across all workers (auto and manual); one writer of dump_state.json
+DUMP_LOCK = FileLock(os.path.join(LOCK_DIR, "dump.lock"))
+STATE_LOCK = FileLock(STATE_PATH + ".lock")
+# Pooled, retrying GitHub client; a dump's files go up as blobs and land in one commit
+GITHUB = GitHubClient(GITHUB_TOKEN, GITHUB_REPO, GITHUB_BRANCH)
+
+def make_sink(name):
+    lock = os.path.join(LOCK_DIR, f"sink-{name}.lock")
+    if name == "github":
+        # Built per delivery, so /api/dump-config changes to repo/branch/path apply
+        return Sink(name, lambda: RepoFolder(github(), GITHUB_PATH), lock,
+                    ready=lambda: bool(GITHUB_TOKEN and GITHUB_REPO and GITHUB_PATH), backoff_max_s=DUMP_SINK_BACKOFF_MAX_S)
+    if name == "local":
+        return Sink(name, lambda: LocalFolder(DUMP_LOCAL_DIR, DUMP_LOCAL_KEEP_DAYS), lock, backoff_max_s=DUMP_SINK_BACKOFF_MAX_S)
+    if name == "s3":
+        s3 = S3Folder(DUMP_S3_ENDPOINT, DUMP_S3_BUCKET, DUMP_S3_PREFIX, DUMP_S3_ACCESS_KEY, DUMP_S3_SECRET_KEY, DUMP_S3_REGION)
+        return Sink(name, lambda: s3, lock, ready=lambda: bool(DUMP_S3_BUCKET and DUMP_S3_ACCESS_KEY),
+                    backoff_max_s=DUMP_SINK_BACKOFF_MAX_S)
+    raise ValueError(f"unknown dump sink {name!r} (use {', '.join(SINK_NAMES)})")
+
+OUTBOX = Outbox(DUMP_OUTBOX_DIR)
+SINKS = Sinks(OUTBOX, [make_sink(n) for n in DUMP_SINKS], DUMP_QUORUM)
+PRUNE_LOCK = threading.Lock()
+POLICY = DumpPolicy(DUMP_TRIGGER_ROWS, DUMP_TRIGGER_BYTES, DUMP_INTERVAL_SECONDS, DUMP_MIN_INTERVAL_S,
+                    DUMP_BACKOFF_S, DUMP_BACKOFF_MAX_S)
+# Slow operator actions run here, so request threads stay free for ingest
+JOBS = JobRunner(JOBS_DIR, workers=JOB_WORKERS, history=JOB_HISTORY)
+
+# Hot-path metrics: per-thread preallocated slots, no lock per observation
+INGEST_SECONDS = REGISTRY.histogram("psp_ingest_seconds", "Ingest time per request or write by phase: parse (JSON body), "
+                                    "validate (samples), commit (SQLite transaction), publish (live cache and stream)", ("phase",))
+INGEST_SAMPLES = REGISTRY.counter("psp_ingest_samples_total", "Samples accepted", ("route",))
+INGEST_REJECTED = REGISTRY.counter("psp_ingest_rejected_total", "Ingest requests rejected", ("route", "reason"))
+HTTP_SECONDS = REGISTRY.histogram("psp_http_request_seconds", "Time to build the response (a stream counts until its headers)",
+                                  ("endpoint", "method", "code"))
+DUMP_PHASE_SECONDS = REGISTRY.histogram("psp_dump_phase_seconds", "Dump phases: serialize (one file), upload (one batch to "
+                                        "a quorum of sinks), prune", ("phase",), buckets=SLOW_BUCKETS)
+DUMP_ROWS = REGISTRY.counter("psp_dump_rows_total", "Rows serialized into dump files")
+DUMP_RUNS = REGISTRY.counter("psp_dump_runs_total", "Dumps by outcome", ("result",))
+RETAIN_DELETED = REGISTRY.counter("psp_retention_deleted_total", "Raw rows and rollup buckets aged out", ("tier",))
+# Stack sampler for /api/debug/profile; idle until a profile runs
+PROFILER = Profiler()
+
+MIGRATE_ON_START = os.getenv("MIGRATE_ON_START", "true").lower() == "true"
+MONGO_CLEAR_ON_START = os.getenv("MONGO_CLEAR_ON_START", "false").lower() == "true"
 
 def init_db():
-    db = get_db()
-    db.execute("""
-CREATE TABLE IF NOT EXISTS samples (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  ts TEXT NOT NULL,
-  fsr1 INTEGER NOT NULL,
-  fsr2 INTEGER NOT NULL,
-  fsr3 INTEGER NOT NULL,
-  fsr4 INTEGER NOT NULL,
-  fsr5 INTEGER NOT NULL,
-  fsr6 INTEGER NOT NULL,
-  fsr7 INTEGER NOT NULL,
-  fsr8 INTEGER NOT NULL,
-  t1_c REAL NOT NULL,
-  t2_c REAL NOT NULL,
-  volume INTEGER NOT NULL
-);
-""")
-    db.commit()
-
-with app.app_context():
-    init_db()
-    # Try to init Mongo (safe no-op if MONGO_URI not configured)
-    try:
-        init_mongo()
-    except Exception as e:
-        print(f"[mongo] init failed (non-fatal): {e}", flush=True)
+    with STORAGE.write() as db:
+        ensure_schema(db)
+        PARTS.refresh(db, force=True)
+        ROLLUPS.ensure(db)
+        last_id, epoch = shared_version(db)
+        DATA_VERSION.reset(last_id, epoch)
+        LIVE.seen_through(last_id)
+        reconcile_live(db)
+
+def shared_version(db):
+    """(newest id, data epoch) as every worker sees them."""
+    meta = dict(db.execute("SELECT key, value FROM meta WHERE key IN ('last_id', 'data_epoch')").fetchall())
+    return int(meta.get("last_id", 0)), int(meta.get("data_epoch", 0))
+
+def bump_data_epoch(db):
+    # Rows disappeared or were backfilled; other workers notice the new epoch and reconcile their caches
+    db.execute("INSERT INTO meta (key, value) VALUES ('data_epoch', 1) "
+               "ON CONFLICT(key) DO UPDATE SET value = value + 1")
+    DATA_VERSION.bump(shared_version(db)[1])
+
+def migrate_in_background():
+    migrate_db.migrate(STORAGE, PARTS, log=lambda m: print(m, flush=True), rollups=ROLLUPS)
+    # One epoch bump at the end, not per chunk: each worker then re-reads the partitions the
+    # migration filled (their gen moved) once. Migrated rows keep their old ids, below LIVE.last_id.
+    with STORAGE.write() as db:
+        bump_data_epoch(db)
+        reconcile_live(db)
+
+def reconcile_live(db):
+    """Drop LIVE's counters for vanished partitions and re-read the ones a ranged delete or backfill changed."""
+    if not db.in_transaction:
+        db.execute("BEGIN")   # one snapshot for the catalog and the rows
+    LIVE.reconcile(PARTS.gens(db), lambda name: PARTS.scan_partition(db, name, LIVE.last_id))
+
+def catch_up_live(db, upto):
+    """Fold rows other workers committed (ids after LIVE.last_id, up to upto) into LIVE; returns them as items."""
+    if upto <= LIVE.last_id:
+        return []
+    rows = list(PARTS.scan_ids(db, LIVE.last_id, upto))
+    items = [dict(row_to_item(r), id=int(r["id"])) for r in rows]
+    LIVE.add(items, [int(r["ts_us"]) for r in rows])
+    LIVE.seen_through(upto)
+    return items
+
+def sync_from_other_workers():
+    """
+    Catch this process up with what other workers committed: new rows go into
+    LIVE and out to local stream clients, a new data epoch (prune, clear,
+    retention, migration) reconciles LIVE with the partitions that changed, and
+    a new dump result is pushed as a `dump` event.
+    Ids are allocated inside the write transaction, so they commit in order.
+    """
+    with STORAGE.read() as db:
+        last_id, epoch = shared_version(db)
+    if epoch != DATA_VERSION.epoch:
+        with STORAGE.write() as db:
+            reconcile_live(db)
+            last_id, epoch = shared_version(db)
+            items = catch_up_live(db, last_id)
+        DATA_VERSION.reset(last_id, epoch)
+        if items:
+            BROKER.publish("samples", {"items": items})
+    elif last_id > LIVE.last_id:
+        with STORAGE.write() as db:
+            items = catch_up_live(db, last_id)
+        DATA_VERSION.advance(last_id)
+        if items:
+            BROKER.publish("samples", {"items": items})
+    if BROKER.has_subscribers():
+        when = (load_state().get("last_dump") or {}).get("when")
+        if when != _dump_seen["when"]:
+            _dump_seen["when"] = when
+            BROKER.publish("dump", dump_status_payload())
+
+_dump_seen = {"when": None}
+
+def run_rollups():
+    # Bounded chunks, each in its own short write transaction
+    while True:
+        with STORAGE.write() as db:
+            n = ROLLUPS.run(db, PARTS, max_rows=ROLLUP_BATCH_ROWS)
+        if n < ROLLUP_BATCH_ROWS:
+            return
 
-if os.getenv("MONGO_CLEAR_ON_START", "false").lower() == "true":
-    try:
-        deleted = clear_collection()
-        print(f"[mongo] cleared collection on start: deleted={deleted}", flush=True)
-    except Exception as e:
-        print(f"[mongo] clear on start failed: {e}", flush=True)
 
 def clamp(v, lo, hi): return max(lo, min(hi, v))
 
@@ -81,16 +274,135 @@ def compute_volume_from_fsr(fsr_pct_list):
     p = fsr_to_pct_already(fsr_pct_list)
     return int(round(sum(p) / float(len(p))))
 
-def log_dump(msg): print(f"[dump] {msg}", flush=True)
+def parse_device_ts(v):
+    """Device-side timestamp → UTC ISO string. Accepts ISO strings or epoch seconds/ms."""
+    if isinstance(v, bool) or v is None:
+        raise ValueError("ts is required")
+    if isinstance(v, (int, float)):
+        secs = float(v) / 1000.0 if float(v) >= 1e11 else float(v)
+        return datetime.fromtimestamp(secs, tz=timezone.utc).isoformat(timespec="microseconds")
+    dt = datetime.fromisoformat(str(v).strip().replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).isoformat(timespec="microseconds")
 
-def _gh_headers():
-    if not GITHUB_TOKEN:
-        raise RuntimeError("Missing GITHUB_TOKEN")
-    return {
-        "Authorization": f"token {GITHUB_TOKEN}",
-        "Accept": "application/vnd.github+json",
-        "User-Agent": "psp-arduino-app"
-    }
+def request_device():
+    """Device for samples that don't name one: X-Device-Id header, else DEFAULT_DEVICE."""
+    return parse_device(request.headers.get("X-Device-Id"))
+
+def device_arg():
+    """Optional ?device= filter (None = all devices). Raises ValueError on a bad id."""
+    v = request.args.get("device")
+    return parse_device(v) if v else None
+
+def parse_sample(payload, ts=None, device=DEFAULT_DEVICE):
+    """Validate one sample payload → (ts, fsr, t1_c, t2_c, volume, device). Raises on bad input."""
+    if not isinstance(payload, dict):
+        raise ValueError("sample must be a JSON object")
+    dev = payload.get("device", payload.get("device_id"))
+    dev = parse_device(dev) if dev is not None else device
+    fsr = fsr_to_pct_already(payload.get("fsr", []))
+    t1_c = float(payload["t1_c"]); t2_c = float(payload["t2_c"])
+    vol = payload.get("volume", None)
+    vol = compute_volume_from_fsr(fsr) if vol is None else int(clamp(float(vol), 0, 100))
+    if ts is None:
+        ts = parse_device_ts(payload.get("ts"))
+    return ts, fsr, t1_c, t2_c, vol, dev
+
+def sample_doc(s):
+    ts, fsr, t1_c, t2_c, vol, dev = s
+    return {"ts_iso": ts, "fsr": fsr, "t1_c": float(t1_c), "t2_c": float(t2_c), "volume": int(vol), "device": dev}
+
+def write_samples(samples):
+    """Insert validated samples in one transaction, then hand them to Mongo in one bulk write."""
+    rows = [sample_row(*s) for s in samples]
+    with STORAGE.write() as db:
+        t0 = time.perf_counter()
+        first_id, last_id = PARTS.insert(db, rows)
+        db.commit()
+        t1 = time.perf_counter()
+        INGEST_SECONDS.observe(t1 - t0, "commit")
+        # Rows another worker committed just before ours must reach LIVE first
+        missed = catch_up_live(db, first_id - 1)
+        items = [{"id": first_id + i, "ts": us_to_iso(r[0]), "fsr": list(r[1]), "t1_c": r[2], "t2_c": r[3],
+                  "volume": r[4], "device": r[5]} for i, r in enumerate(rows)]
+        LIVE.add(items, [r[0] for r in rows])
+    DATA_VERSION.advance(last_id)
+    BROKER.publish("samples", {"items": missed + items})
+    INGEST_SECONDS.observe(time.perf_counter() - t1, "publish")
+    try:
+        if len(samples) == 1:
+            insert_one_sample(sample_doc(samples[0]))
+        else:
+            insert_many_samples([sample_doc(s) for s in samples])
+    except Exception as e:
+        # Non-fatal: keep your pipeline up even if Mongo is briefly unavailable
+        MONGO_INSERT_FAILURES.inc(1, "one" if len(samples) == 1 else "many")
+        print(f"[mongo] insert failed for {len(samples)} sample(s): {e}", flush=True)
+
+INGEST_QUEUE = None
+
+def enqueue_or_write(samples):
+    """Queue samples (write-behind) or commit them now. Returns None or a 503 response."""
+    if INGEST_QUEUE is None:
+        write_samples(samples)
+        return None
+    if not INGEST_QUEUE.offer(samples):
+        INGEST_REJECTED.inc(1, "queue", "full")
+        resp = jsonify({"ok": False, "error": "Ingest queue full, retry later", "queue_depth": INGEST_QUEUE.depth()})
+        resp.status_code = 503
+        resp.headers["Retry-After"] = str(INGEST_RETRY_AFTER)
+        return resp
+    return None
+
+def flush_ingest_queue(timeout=10.0):
+    if INGEST_QUEUE is not None and not INGEST_QUEUE.drain(timeout):
+        print(f"[ingest] drain timed out with {INGEST_QUEUE.depth()} sample(s) pending", flush=True)
+
+def not_modified(etag, vary=None):
+    """304 if the client already holds this version, else None."""
+    inm = request.headers.get("If-None-Match", "")
+    if inm and (inm.strip() == "*" or etag in [t.strip() for t in inm.split(",")]):
+        resp = Response(status=304)
+        resp.headers["ETag"] = etag
+        resp.headers["Cache-Control"] = "no-cache"
+        if vary:
+            resp.headers["Vary"] = vary
+        return resp
+    return None
+
+def query_key(*skip):
+    """Stable string of the query args (minus cache-busters) for per-URL ETags."""
+    return "&".join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)) if k not in ("t",) + skip)
+
+def parse_time_arg(name):
+    """Optional ?name= query bound (ISO string or epoch s/ms) → epoch µs."""
+    v = (request.args.get(name) or "").strip()
+    if not v:
+        return None
+    try: v = float(v)
+    except ValueError: pass
+    return iso_to_us(parse_device_ts(v))
+
+def read_batch_payload():
+    """Batch body → list of raw sample dicts. JSON array, {"items": [...]} or NDJSON."""
+    ctype = (request.mimetype or "").lower()
+    if "ndjson" in ctype or "jsonl" in ctype:
+        out = []
+        for n, line in enumerate(request.get_data(as_text=True).splitlines(), start=1):
+            line = line.strip()
+            if not line: continue
+            try: out.append(json.loads(line))
+            except ValueError as e: raise ValueError(f"line {n}: {e}")
+        return out
+    body = request.get_json(force=True, silent=False)
+    if isinstance(body, dict):
+        body = body.get("items", body.get("samples"))
+    if not isinstance(body, list):
+        raise ValueError("expected a JSON array of samples, {\"items\": [...]} or NDJSON")
+    return body
+
+def log_dump(msg): print(f"[dump] {msg}", flush=True)
 
 @app.route("/")
 def index(): return send_from_directory(app.static_folder, "index.html")
@@ -98,39 +410,72 @@ def index(): return send_from_directory(app.static_folder, "index.html")
 @app.route("/api/data", methods=["POST"])
 def api_data():
     try:
+        t0 = time.perf_counter()
         payload = request.get_json(force=True, silent=False)
-        fsr = fsr_to_pct_already(payload.get("fsr", []))
-        t1_c = float(payload["t1_c"]); t2_c = float(payload["t2_c"])
-        vol = payload.get("volume", None)
-        vol = compute_volume_from_fsr(fsr) if vol is None else int(clamp(float(vol), 0, 100))
+        t1 = time.perf_counter()
+        sample = parse_sample(payload, ts=datetime.now(timezone.utc).isoformat(), device=request_device())
+        INGEST_SECONDS.observe(t1 - t0, "parse")
+        INGEST_SECONDS.observe(time.perf_counter() - t1, "validate")
     except Exception as e:
+        INGEST_REJECTED.inc(1, "single", "invalid")
         return jsonify({"ok": False, "error": f"Invalid JSON: {e}"}), 400
 
-    ts = datetime.now(timezone.utc).isoformat()
-
-    # --- SQLite (existing) ---
-    db = get_db()
-    db.execute(
-        "INSERT INTO samples (ts, fsr1, fsr2, fsr3, fsr4, fsr5, fsr6, fsr7, fsr8, t1_c, t2_c, volume) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
-        (ts, *fsr, t1_c, t2_c, vol),
-    )
-    db.commit()
+    busy = enqueue_or_write([sample])
+    if busy is not None:
+        return busy
+    INGEST_SAMPLES.inc(1, "single")
+    return jsonify({"ok": True, "ts": sample[0], "device": sample[5], "queued": INGEST_QUEUE is not None})
 
-    # --- Mongo (new, optional) ---
+@app.route("/api/data/batch", methods=["POST"])
+def api_data_batch():
     try:
-        insert_one_sample({
-            "ts_iso": ts,
-            "fsr": fsr,
-            "t1_c": float(t1_c),
-            "t2_c": float(t2_c),
-            "volume": int(vol),
-            # You can add anything else you want to query later, e.g. device_id
-        })
+        t0 = time.perf_counter()
+        raw = read_batch_payload()
+        INGEST_SECONDS.observe(time.perf_counter() - t0, "parse")
     except Exception as e:
-        # Non-fatal: keep your pipeline up even if Mongo is briefly unavailable
-        print(f"[mongo] insert_one_sample failed: {e}", flush=True)
+        INGEST_REJECTED.inc(1, "batch", "invalid")
+        return jsonify({"ok": False, "error": f"Invalid batch: {e}"}), 400
+    if not raw:
+        INGEST_REJECTED.inc(1, "batch", "invalid")
+        return jsonify({"ok": False, "error": "Empty batch"}), 400
+    if len(raw) > BATCH_MAX_SAMPLES:
+        INGEST_REJECTED.inc(1, "batch", "too_large")
+        return jsonify({"ok": False, "error": f"Batch too large ({len(raw)} > {BATCH_MAX_SAMPLES})"}), 413
 
-    return jsonify({"ok": True, "ts": ts})
+    # Validate everything first so a bad sample rejects the whole batch
+    try:
+        device = request_device()
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    samples, errors = [], []
+    t0 = time.perf_counter()
+    for i, payload in enumerate(raw):
+        try: samples.append(parse_sample(payload, device=device))
+        except Exception as e: errors.append({"index": i, "error": str(e)})
+    INGEST_SECONDS.observe(time.perf_counter() - t0, "validate")
+    if errors:
+        INGEST_REJECTED.inc(1, "batch", "invalid")
+        return jsonify({"ok": False, "error": f"{len(errors)} invalid sample(s)", "errors": errors[:100]}), 400
+
+    # Device clocks drive ordering; keep ids monotonic with ts inside the batch
+    samples.sort(key=lambda s: s[0])
+
+    busy = enqueue_or_write(samples)
+    if busy is not None:
+        return busy
+    INGEST_SAMPLES.inc(len(samples), "batch")
+    return jsonify({"ok": True, "count": len(samples), "first_ts": samples[0][0], "last_ts": samples[-1][0],
+                    "queued": INGEST_QUEUE is not None})
+
+@app.route("/api/ingest-status")
+def api_ingest_status():
+    out = {"mode": INGEST_MODE if INGEST_QUEUE is not None else "sync"}
+    if INGEST_QUEUE is not None:
+        out.update(INGEST_QUEUE.stats())
+    out["stream"] = BROKER.stats()
+    resp = jsonify(out)
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
 
 @app.route("/api/mongo/clear", methods=["POST"])
 def api_mongo_clear():
@@ -139,19 +484,72 @@ def api_mongo_clear():
     deleted = clear_collection()
     return jsonify({"ok": True, "deleted": int(deleted)})
 
+def latest_payload(device=None):
+    item = LIVE.latest(device)
+    if item is None:
+        return {"ready": False, "message": "No data yet"}
+    return {
+        "ready": True, "ts": item["ts"], "device": item["device"],
+        "fsr_pct": item["fsr"],
+        "t1_c": item["t1_c"], "t2_c": item["t2_c"],
+        "volume": item["volume"]
+    }
+
+def stats_payload(device=None):
+    return LIVE.stats(device)
+
+def dump_status_payload():
+    # The leader may be another worker: its last result is shared through dump_state.json
+    state = load_state()
+    apply_dump_config(state)
+    return {"enabled": DUMP_ENABLED, "interval_seconds": DUMP_INTERVAL_SECONDS, "has_token": bool(GITHUB_TOKEN),
+            "policy": POLICY.stats(),
+            "last": state.get("last_dump") or LAST_DUMP, "compact": state.get("last_compact"), **SINKS.stats(), "scheduler": SCHEDULER.stats(), "github": GITHUB.stats()}
+
 @app.route("/api/latest")
 def api_latest():
-    db = get_db()
-    row = db.execute("SELECT * FROM samples ORDER BY id DESC LIMIT 1").fetchone()
-    if not row: return jsonify({"ready": False, "message": "No data yet"})
-    fsr = [row[f"fsr{i}"] for i in range(1, FSR_COUNT+1)]
-    resp = jsonify({
-        "ready": True, "ts": row["ts"],
-        "fsr_pct": fsr_to_pct_already(fsr),
-        "t1_c": float(row["t1_c"]), "t2_c": float(row["t2_c"]),
-        "volume": int(row["volume"])
-    })
-    resp.headers["Cache-Control"] = "no-store"
+    try:
+        device = device_arg()
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    etag = DATA_VERSION.etag(device)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    payload = latest_payload(device)
+    if not payload["ready"]: return jsonify(payload)
+    resp = jsonify(payload)
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+# History bodies are JSON or MessagePack depending on Accept, so caches must key on both
+HISTORY_VARY = "Accept, Accept-Encoding"
+
+def history_response(out, etag, cols=None, idx=None, binary=False):
+    """
+    Finish a history response: `out` holds the metadata, plus `items` for the
+    row layout. When `cols` is given, the rows go out in the columnar layout
+    instead. The body is compressed if the client accepts it.
+    """
+    if cols is not None:
+        payload = columnar.encode(cols, idx, newest_first=True, binary=binary)
+        payload.update(out)
+        body, mimetype = columnar.pack(payload, binary)
+        resp = Response(body, mimetype=mimetype)
+    else:
+        resp = jsonify(out)
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = "no-cache"
+    return compress_response(resp, vary=HISTORY_VARY)
+
+def compress_response(resp, vary="Accept-Encoding"):
+    """gzip/br per Accept-Encoding for bodies worth compressing."""
+    resp.headers["Vary"] = vary
+    enc = columnar.pick_encoding(request.headers.get("Accept-Encoding", ""))
+    if enc and resp.content_length and resp.content_length >= columnar.COMPRESS_MIN_BYTES:
+        resp.set_data(columnar.compress(resp.get_data(), enc))
+        resp.headers["Content-Encoding"] = enc
     return resp
 
 @app.route("/api/history")
@@ -159,247 +557,874 @@ def api_history():
     try: limit = int(request.args.get("limit", "3600"))
     except: limit = 3600
     limit = clamp(limit, 1, 50000)
-    db = get_db()
-    rows = db.execute("SELECT * FROM samples ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
-    items = []
-    for r in rows:
-        fsr = [r[f"fsr{i}"] for i in range(1, FSR_COUNT+1)]
-        items.append({
-            "ts": r["ts"], "fsr": fsr_to_pct_already(fsr),
-            "t1_c": float(r["t1_c"]), "t2_c": float(r["t2_c"]),
-            "volume": int(r["volume"])
-        })
-    from flask import jsonify as _jsonify
-    resp = _jsonify({"count": len(items), "items": items})
-    resp.headers["Cache-Control"] = "no-store"
-    return resp
+    # ?layout=columnar: typed arrays instead of one object per row (JSON+base64, or MessagePack)
+    layout = (request.args.get("layout") or "rows").lower()
+    if layout not in ("rows", "columnar"):
+        return jsonify({"ok": False, "error": "layout must be rows or columnar"}), 400
+    col = layout == "columnar"
+    binary = col and (request.args.get("format") == "msgpack"
+                      or columnar.MSGPACK_MIMETYPE in request.headers.get("Accept", ""))
+    if binary and not columnar.msgpack_available():
+        return jsonify({"ok": False, "error": "MessagePack needs msgpack installed on the server"}), 501
+    # The negotiated representation is part of the tag: JSON and msgpack bodies must not share one
+    key = query_key() + ("|msgpack" if binary else "|json")
+    etag = DATA_VERSION.etag(format(zlib.crc32(key.encode("utf-8")), "x"))
+    cached = not_modified(etag, vary=HISTORY_VARY)
+    if cached is not None:
+        return cached
+    try:
+        device = device_arg()
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    # Incremental mode: only rows newer than the client's cursor
+    try:
+        since_id = int(request.args["since_id"]) if request.args.get("since_id") else None
+        since_us = parse_time_arg("since_ts")
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Invalid since_id/since_ts: {e}"}), 400
+    if since_id is not None or since_us is not None:
+        with STORAGE.read() as db:
+            if since_id is not None:
+                db.execute("BEGIN")
+                upto = PARTS.last_id(db)
+                rows = list(PARTS.scan_ids(db, since_id, upto, limit=limit + 1, device=device))
+            else:
+                rows = list(PARTS.scan(db, after_us=since_us, limit=limit + 1, device=device))
+        more = len(rows) > limit
+        rows = rows[:limit]
+        out = {"more": more}
+        if device is not None:
+            out["device"] = device
+        if since_id is not None:
+            out["cursor"] = {"since_id": rows[-1]["id"] if rows else max(since_id, upto)}
+        else:
+            out["cursor"] = {"since_ts": us_to_iso(rows[-1]["ts_us"]) if rows else request.args.get("since_ts")}
+        if col:
+            return history_response(out, etag, downsample.columns(rows), binary=binary)
+        items = [row_to_item(r) for r in reversed(rows)]
+        out.update({"count": len(items), "items": items})
+        return history_response(out, etag)
+    # Optional server-side downsampling: ?points=N (LTTB) or ?bucket=30s (min/max/mean)
+    try:
+        points = int(request.args["points"]) if request.args.get("points") else None
+        bucket_us = downsample.parse_bucket(request.args["bucket"]) if request.args.get("bucket") else None
+        series = downsample.parse_series(request.args.get("series"))
+    except ValueError as e:
+        return jsonify({"ok": False, "error": f"Invalid points/bucket/series: {e}"}), 400
+    if col and bucket_us is not None:
+        return jsonify({"ok": False, "error": "layout=columnar supports raw rows and points, not bucket"}), 400
+    with STORAGE.read() as db:
+        rows = list(PARTS.scan(db, desc=True, limit=limit, device=device))
+    out = {} if device is None else {"device": device}
+    if bucket_us is not None or points is not None or col:
+        cols = downsample.columns(rows)
+        idx = None
+        if bucket_us is not None:
+            items = downsample.bucket_items(cols, bucket_us)
+            out["downsampled"] = {"method": "bucket", "bucket_s": bucket_us / 1e6, "source_rows": len(rows)}
+        elif points is not None:
+            idx = downsample.lttb_rows(cols, clamp(points, 3, 50000), series)
+            out["downsampled"] = {"method": "lttb", "points": len(idx), "source_rows": len(rows), "series": list(series)}
+            if not col:
+                items = downsample.items_at(cols, idx)
+        if col:
+            return history_response(out, etag, cols, idx, binary=binary)
+        items.reverse()  # newest first, like the raw response
+    else:
+        items = [row_to_item(r) for r in rows]
+    out.update({"count": len(items), "items": items})
+    return history_response(out, etag)
 
-@app.route("/api/export.json")
-def api_export_json():
-    db = get_db()
-    rows = db.execute("SELECT * FROM samples ORDER BY id ASC").fetchall()
-    items = []
-    for r in rows:
-        fsr = [r[f"fsr{i}"] for i in range(1, FSR_COUNT+1)]
-        items.append({
-            "ts": r["ts"], "fsr": fsr_to_pct_already(fsr),
-            "t1_c": float(r["t1_c"]), "t2_c": float(r["t2_c"]),
-            "volume": int(r["volume"])
-        })
-    from flask import json as _flask_json
-    payload = _flask_json.dumps({"count": len(items), "items": items})
-    return Response(payload, mimetype="application/json",
-                    headers={"Content-Disposition": "attachment; filename=fsr_data.json",
-                             "Cache-Control":"no-store"})
+EXPORT_ITERS = {"json": exporters.iter_json, "ndjson": exporters.iter_ndjson,
+                "csv": exporters.iter_csv, "parquet": exporters.iter_parquet}
+
+@app.route("/api/export")
+@app.route("/api/export.<fmt>")
+def api_export(fmt=None):
+    fmt = (request.args.get("format") or fmt or "json").lower()
+    if fmt not in exporters.FORMATS:
+        return jsonify({"ok": False, "error": f"format must be one of {', '.join(exporters.FORMATS)}"}), 400
+    try:
+        from_us, to_us = parse_time_arg("from"), parse_time_arg("to")
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Invalid from/to: {e}"}), 400
+    try:
+        device = device_arg()
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    if fmt == "parquet" and not exporters.parquet_available():
+        return jsonify({"ok": False, "error": "parquet export needs pyarrow installed on the server"}), 501
+    mimetype, ext = exporters.FORMATS[fmt]
+    encode = EXPORT_ITERS[fmt]
+
+    def generate():
+        # Rows go out in fetchmany batches; the reader is returned when the stream ends
+        with STORAGE.read() as db:
+            yield from encode(PARTS.scan(db, from_us=from_us, to_us=to_us, device=device))
+
+    stem = f"fsr_data_{device}" if device else "fsr_data"
+    headers = {"Content-Disposition": f"attachment; filename={stem}.{ext}", "Cache-Control": "no-store",
+               "Vary": "Accept-Encoding"}
+    body = generate()
+    # Text formats compress ~10x; parquet is already zstd inside
+    if fmt != "parquet" and columnar.pick_encoding(request.headers.get("Accept-Encoding", ""), ("gzip",)):
+        body = columnar.gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, mimetype=mimetype, headers=headers)
+
+@app.route("/api/rollups")
+def api_rollups():
+    """
+    Continuous aggregates: one item per bucket with count `n` and mean/min/max/p95
+    per series (FSR as 8-element lists). ?res=30s|1m|1h|1d (default 1m), from/to as
+    in export; res=auto picks the finest tier that still holds `from` in at most
+    ?points= (1000) buckets. Buckets are closed a few seconds after their end, so the
+    newest one lags slightly.
+    """
+    res = (request.args.get("res") or "1m").lower()
+    if res not in ROLLUP_WIDTHS and res != "auto":
+        return jsonify({"ok": False, "error": f"res must be one of {', '.join(ROLLUP_WIDTHS)}, auto"}), 400
+    try:
+        from_us, to_us = parse_time_arg("from"), parse_time_arg("to")
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Invalid from/to: {e}"}), 400
+    if res == "auto":
+        try:
+            points = max(1, int(request.args.get("points", "1000")))
+        except ValueError:
+            points = 1000
+        with STORAGE.read() as db:
+            res = ROLLUPS.pick(db, from_us, to_us, points)
+    try:
+        device = device_arg()
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    try:
+        limit = max(1, min(int(request.args.get("limit", "10000")), 100000))
+    except ValueError:
+        limit = 10000
+    with STORAGE.read() as db:
+        items = ROLLUPS.query(db, res, from_us, to_us, limit, device=device)
+    return jsonify({"res": res, "count": len(items), "items": items})
 
 @app.route("/api/stats")
 def api_stats():
-    db = get_db()
-    row = db.execute("SELECT COUNT(*) AS c, MAX(ts) AS last_ts FROM samples").fetchone()
-    total = int(row["c"]) if row and row["c"] is not None else 0
-    last_ts = row["last_ts"] if row and row["last_ts"] is not None else None
-    resp = jsonify({"total": total, "last_ts": last_ts})
+    try:
+        device = device_arg()
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    resp = jsonify(stats_payload(device))
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+@app.route("/api/devices")
+def api_devices():
+    devices = []
+    for dev in LIVE.devices():
+        st, item = LIVE.stats(dev), LIVE.latest(dev)
+        devices.append({"device": dev, "total": st["total"], "last_ts": st["last_ts"],
+                        "latest": {k: item[k] for k in ("fsr", "t1_c", "t2_c", "volume")} if item else None})
+    resp = jsonify({"count": len(devices), "devices": devices})
     resp.headers["Cache-Control"] = "no-store"
     return resp
 
+@app.route("/api/partitions")
+def api_partitions():
+    with STORAGE.read() as db:
+        parts = PARTS.info(db)
+    for p in parts:
+        p["start"] = us_to_iso(p.pop("start_us")); p["end"] = us_to_iso(p.pop("end_us"))
+    return jsonify({"span": PARTS.span, "count": len(parts), "partitions": parts})
+
+@app.route("/api/retention")
+def api_retention():
+    """Per tier: how long it is kept (keep_s, null = forever), what it holds now, and the oldest data."""
+    with STORAGE.read() as db:
+        parts, tiers = PARTS.info(db), ROLLUPS.info(db)
+    raw = {"tier": "raw", "keep_s": RETAIN_RAW_S or None, "rows": sum(p["rows"] for p in parts),
+           "oldest": us_to_iso(parts[0]["start_us"]) if parts else None, "partitions": len(parts),
+           "require_dump": RETAIN_RAW_REQUIRE_DUMP, "pruned_on_dump": not RETAIN_RAW_S}
+    return jsonify({"interval_s": RETAIN_INTERVAL_S, "tiers": [raw] + [
+        {"tier": res, "keep_s": RETAIN_ROLLUP_S.get(res) or None, **info} for res, info in tiers.items()]})
+
 @app.route("/api/clear", methods=["POST"])
 def api_clear():
-    db = get_db()
-    count = db.execute("SELECT COUNT(*) AS c FROM samples").fetchone()["c"]
-    db.execute("DELETE FROM samples"); db.commit()
-    try: db.execute("VACUUM")
-    except Exception: pass
-    try:
-        with open(STATE_PATH, "w", encoding="utf-8") as f:
-            json.dump({"last_ts": None}, f)
-    except Exception: pass
+    flush_ingest_queue()
+    # Waits out a running dump, whose watermark update would otherwise land after ours
+    with DUMP_LOCK:
+        with STORAGE.write() as db:
+            count = PARTS.drop_all(db)
+            bump_data_epoch(db)
+            LIVE.clear()
+            ROLLUPS.clear(db, PARTS.last_id(db))
+            for table in pending_legacy(db):
+                count += db.execute(f"SELECT COUNT(*) AS c FROM {table}").fetchone()["c"]
+                db.execute(f"DELETE FROM {table}")
+            try: PARTS.reclaim(db)
+            except Exception: pass
+        # Everything up to the current id is gone; the dump cursor can skip past it
+        try:
+            with STORAGE.read() as db:
+                top = PARTS.last_id(db)
+                advance_state(last_id=top, pruned_id=top)
+        except Exception: pass
     return jsonify({"ok": True, "deleted": int(count)})
 
 @app.route("/api/dump-config", methods=["GET","POST"])
 def api_dump_config():
-    global DUMP_ENABLED, DUMP_INTERVAL_SECONDS, GITHUB_PATH, GITHUB_REPO, GITHUB_BRANCH
+    global DUMP_ENABLED, DUMP_INTERVAL_SECONDS, DUMP_TRIGGER_ROWS, DUMP_TRIGGER_BYTES, GITHUB_PATH, GITHUB_REPO, GITHUB_BRANCH
+    apply_dump_config(load_state())
     if request.method == "POST":
         data = request.get_json(silent=True) or {}
         if "enabled" in data:  DUMP_ENABLED = bool(data["enabled"])
         if "interval_seconds" in data:
             try: DUMP_INTERVAL_SECONDS = max(1, int(data["interval_seconds"]))
             except: pass
+        if "max_rows" in data:
+            try: DUMP_TRIGGER_ROWS = max(0, int(data["max_rows"]))
+            except: pass
+        if "max_bytes" in data:
+            try: DUMP_TRIGGER_BYTES = max(0, int(data["max_bytes"]))
+            except: pass
         if "path" in data:     GITHUB_PATH = str(data["path"]).strip().strip("/")
         if "repo" in data:     GITHUB_REPO = str(data["repo"])
         if "branch" in data:   GITHUB_BRANCH = str(data["branch"])
-        log_dump(f"config updated: enabled={DUMP_ENABLED}, interval={DUMP_INTERVAL_SECONDS}s, repo={GITHUB_REPO}, branch={GITHUB_BRANCH}, path={GITHUB_PATH}")
-    return jsonify({"enabled": DUMP_ENABLED, "interval_seconds": DUMP_INTERVAL_SECONDS, "repo": GITHUB_REPO, "branch": GITHUB_BRANCH, "path": GITHUB_PATH, "has_token": bool(GITHUB_TOKEN)})
+        # Saved with the dump state so the scheduler leader (maybe another worker) picks it up
+        update_state(config={"enabled": DUMP_ENABLED, "interval_seconds": DUMP_INTERVAL_SECONDS,
+                             "max_rows": DUMP_TRIGGER_ROWS, "max_bytes": DUMP_TRIGGER_BYTES,
+                             "path": GITHUB_PATH, "repo": GITHUB_REPO, "branch": GITHUB_BRANCH})
+        log_dump(f"config updated: enabled={DUMP_ENABLED}, max age={DUMP_INTERVAL_SECONDS}s, max rows={DUMP_TRIGGER_ROWS}, max bytes={DUMP_TRIGGER_BYTES}, repo={GITHUB_REPO}, branch={GITHUB_BRANCH}, path={GITHUB_PATH}")
+    return jsonify({"enabled": DUMP_ENABLED, "interval_seconds": DUMP_INTERVAL_SECONDS, "max_rows": DUMP_TRIGGER_ROWS,
+                    "max_bytes": DUMP_TRIGGER_BYTES, "repo": GITHUB_REPO, "branch": GITHUB_BRANCH, "path": GITHUB_PATH, "has_token": bool(GITHUB_TOKEN)})
 
 @app.route("/api/dump-status")
 def api_dump_status():
-    return jsonify({"enabled": DUMP_ENABLED, "interval_seconds": DUMP_INTERVAL_SECONDS, "has_token": bool(GITHUB_TOKEN), "last": LAST_DUMP})
+    return jsonify(dump_status_payload())
+
+@app.route("/api/stream")
+def api_stream():
+    """
+    Server-Sent Events: `samples` (new rows of every device, once per commit), `stats` (at most
+    once a second, only when data changed; for ?device= only that device's), `dump` (dump status changes) and
+    `resync` (this client's buffer overflowed; refetch a snapshot).
+    """
+    try:
+        device = device_arg()
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    sub = BROKER.subscribe(device)
+    if sub is None:
+        resp = jsonify({"ok": False, "error": "Too many stream clients"})
+        resp.status_code = 503
+        resp.headers["Retry-After"] = "5"
+        return resp
+    initial = [encode_event("latest", latest_payload(device)), encode_event("stats", stats_payload(device)),
+               encode_event("dump", dump_status_payload())]
+    return Response(BROKER.stream(sub, initial), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def job_accepted(job):
+    resp = jsonify({"ok": True, "job": job.id, "status_url": f"/api/jobs/{job.id}", "message": f"{job.kind} job {job.state}"})
+    resp.status_code = 202
+    resp.headers["Location"] = f"/api/jobs/{job.id}"
+    return resp
+
+def dump_job(job):
+    ok, msg, deleted, filename, rows = perform_dump_once(trigger="manual", job=job)
+    if not ok:
+        raise RuntimeError(msg)
+    return {"message": msg, "deleted": deleted, "filename": filename, "rows": rows}
 
 @app.route("/api/dump-now", methods=["POST"])
 def api_dump_now():
-    try:
-        ok, msg, deleted, filename, rows = perform_dump_once(trigger="manual")
-        code = 200 if ok else 500
-        return jsonify({"ok": ok, "message": msg, "deleted": deleted, "filename": filename, "rows": rows}), code
-    except Exception as e:
-        log_dump(f"manual dump failed: {e}")
-        return jsonify({"ok": False, "message": str(e)}), 500
+    # A second click while this worker's dump job is still queued or running gets the same job
+    return job_accepted(JOBS.submit("dump", dump_job, unique=True, rows=0, files=0, bytes=0, bytes_uploaded=0, batches=0))
+
+def delete_job(job):
+    folder = GITHUB_PATH.strip("/")
+    log_dump(f"[dump-delete] start (repo={GITHUB_REPO}, branch={GITHUB_BRANCH}, path={folder})")
+    deleted, errors, mode = github_delete_all_in_path_recursive(folder, job=job)
+    msg = f"Deleted {deleted} file(s) in {folder}."
+    if errors:
+        log_dump(f"[dump-delete] completed with {len(errors)} error(s)")
+        raise RuntimeError(f"{msg} {len(errors)} error(s), first: {errors[0]['path']}: {errors[0]['error']}")
+    log_dump(f"[dump-delete] success: {msg}")
+    return {"message": msg, "deleted": deleted, "mode": mode}
 
 @app.route("/api/dump-delete-all", methods=["POST"])
 def api_dump_delete_all():
     if not GITHUB_TOKEN:
         return jsonify({"ok": False, "message": "Missing GITHUB_TOKEN (needs classic PAT with 'repo' scope)."}), 400
+    return job_accepted(JOBS.submit("delete", delete_job, unique=True, total=0, deleted=0, errors=0, mode=None))
+
+@app.route("/api/dump-delete-status")
+def api_dump_delete_status():
+    return jsonify(DELETE_PROGRESS)
+
+@app.route("/api/jobs")
+def api_jobs():
+    return jsonify({"jobs": JOBS.list()})
+
+@app.route("/api/jobs/<job_id>")
+def api_job(job_id):
+    snap = JOBS.get(job_id) if job_id.isalnum() else None
+    if snap is None:
+        return jsonify({"ok": False, "error": "No such job"}), 404
+    return jsonify(snap)
+
+@app.route("/api/jobs/<job_id>/cancel", methods=["POST"])
+def api_job_cancel(job_id):
+    snap = JOBS.cancel(job_id) if job_id.isalnum() else None
+    if snap is None:
+        return jsonify({"ok": False, "error": "No such job"}), 404
+    return jsonify(snap)
+
+def sqlite_rows():
+    with STORAGE.read() as db:
+        return PARTS.count_ids(db, 0, PARTS.last_id(db))
+
+def pending_dump_rows():
+    with STORAGE.read() as db:
+        top, watermark = PARTS.last_id(db), dump_watermark(load_state())
+        return PARTS.count_ids(db, watermark, top) if top > watermark else 0
+
+def file_size(path):
+    try: return os.path.getsize(path)
+    except OSError: return 0
+
+# Read at scrape time
+REGISTRY.gauge("psp_sqlite_file_bytes", "SQLite file sizes", lambda: {(f,): file_size(DB_PATH + suffix) for f, suffix
+                                                                     in (("db", ""), ("wal", "-wal"))}, ("file",))
+REGISTRY.gauge("psp_sqlite_rows", "Sample rows held locally", sqlite_rows)
+REGISTRY.gauge("psp_dump_pending_rows", "Rows not yet serialized into a dump", pending_dump_rows)
+REGISTRY.gauge("psp_outbox_batches", "Sealed dump batches some sink still lacks", lambda: len(OUTBOX.names()))
+REGISTRY.gauge("psp_ingest_queue_depth", "Samples waiting in this worker's write-behind queue",
+               lambda: INGEST_QUEUE.depth() if INGEST_QUEUE is not None else 0)
+REGISTRY.gauge("psp_stream_clients", "Open /api/stream connections on this worker", lambda: BROKER.stats()["clients"])
+
+@app.route("/metrics")
+def metrics():
+    return Response(REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8",
+                    headers={"Cache-Control": "no-store"})
+
+@app.route("/api/debug/profile")
+def api_debug_profile():
+    """
+    Sample every thread of this worker for ?seconds=N (default 10) every
+    ?interval_ms= (10). ?idle=0 drops parked threads; ?format=collapsed
+    returns only the flamegraph stack file. Needs `Authorization: Bearer
+    <PROFILE_TOKEN>`; without PROFILE_TOKEN the endpoint does not exist.
+    """
+    if not PROFILE_TOKEN:
+        return jsonify({"ok": False, "error": "Not found"}), 404
+    auth = request.headers.get("Authorization", "")
+    given = auth[7:].strip() if auth.startswith("Bearer ") else request.headers.get("X-Profile-Token", "")
+    if not hmac.compare_digest(given.encode(), PROFILE_TOKEN.encode()):
+        return jsonify({"ok": False, "error": "Unauthorized"}), 401
     try:
-        folder = GITHUB_PATH.strip("/")
-        log_dump(f"[dump-delete] start (repo={GITHUB_REPO}, branch={GITHUB_BRANCH}, path={folder})")
-        deleted, errors = github_delete_all_in_path_recursive(folder)
-        msg = f"Deleted {deleted} file(s) in {folder}."
-        if errors:
-            log_dump(f"[dump-delete] completed with {len(errors)} error(s)")
-            return jsonify({"ok": False, "deleted": deleted, "errors": errors, "message": msg}), 207
-        log_dump(f"[dump-delete] success: {msg}")
-        return jsonify({"ok": True, "deleted": deleted, "message": msg})
-    except Exception as e:
-        log_dump(f"[dump-delete] failed: {e}")
-        return jsonify({"ok": False, "message": str(e)}), 500
+        seconds = float(request.args.get("seconds", "10"))
+        interval_ms = float(request.args.get("interval_ms", "10"))
+    except ValueError:
+        return jsonify({"ok": False, "error": "seconds and interval_ms must be numbers"}), 400
+    if not 0 < seconds <= PROFILE_MAX_S:
+        return jsonify({"ok": False, "error": f"seconds must be in (0, {PROFILE_MAX_S:g}]"}), 400
+    idle = request.args.get("idle", "1").lower() not in ("0", "false", "no")
+    print(f"[profile] sampling for {seconds:g}s every {max(1.0, interval_ms):g}ms", flush=True)
+    try:
+        out = PROFILER.run(seconds, max(1.0, interval_ms) / 1000.0, idle=idle)
+    except ProfilerBusy as e:
+        return jsonify({"ok": False, "error": str(e)}), 409
+    if request.args.get("format") == "collapsed":
+        name = f"profile-{out['pid']}-{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.folded"
+        return Response(out["collapsed"], mimetype="text/plain",
+                        headers={"Content-Disposition": f"attachment; filename={name}"})
+    return jsonify(out)
 
 def load_state():
     try:
         with open(STATE_PATH, "r", encoding="utf-8") as f:
             return json.load(f)
     except Exception:
-        return {"last_ts": None}
+        return {"last_id": 0}
 
-def save_state(state):
-    try:
-        with open(STATE_PATH, "w", encoding="utf-8") as f:
-            json.dump(state, f)
-    except Exception:
-        pass
+def update_state(**changes):
+    """Read-modify-write of dump_state.json, serialised across workers."""
+    with STATE_LOCK:
+        state = load_state()
+        state.update(changes)
+        save_state(state)
+        return state
 
-def fetch_rows_since(ts_iso):
-    db = get_db()
-    if ts_iso:
-        rows = db.execute("SELECT * FROM samples WHERE ts > ? ORDER BY ts ASC", (ts_iso,)).fetchall()
-    else:
-        since = (datetime.now(timezone.utc) - timedelta(seconds=max(1, DUMP_INTERVAL_SECONDS))).isoformat()
-        rows = db.execute("SELECT * FROM samples WHERE ts >= ? ORDER BY ts ASC", (since,)).fetchall()
-    items = []
-    for r in rows:
-        fsr = [r[f"fsr{i}"] for i in range(1, 9)]
-        items.append({"ts": r["ts"], "fsr": fsr_to_pct_already(fsr), "t1_c": float(r["t1_c"]), "t2_c": float(r["t2_c"]), "volume": int(r["volume"])})
-    return items
+def advance_state(**watermarks):
+    """Like update_state, but each watermark only moves forward (workers may finish out of order)."""
+    with STATE_LOCK:
+        state = load_state()
+        state.update({k: max(int(state.get(k) or 0), int(v)) for k, v in watermarks.items()})
+        save_state(state)
+        return state
 
-def github_put_file(path_in_repo, content_bytes, message):
-    if not GITHUB_TOKEN:
-        raise RuntimeError("Missing GITHUB_TOKEN")
-    url = f"https://api.github.com/repos/{GITHUB_REPO}/contents/{urllib.parse.quote(path_in_repo)}"
-    headers = _gh_headers()
-    data = {"message": message, "content": base64.b64encode(content_bytes).decode("utf-8"), "branch": GITHUB_BRANCH}
-    log_dump(f"PUT {path_in_repo} (repo={GITHUB_REPO}, branch={GITHUB_BRANCH}, token={'yes' if GITHUB_TOKEN else 'no'})")
-    r = requests.put(url, headers=headers, json=data, timeout=30)
-    if r.status_code not in (200, 201):
-        raise RuntimeError(f"GitHub upload failed {r.status_code}: {r.text}")
-    return r.json()
-
-def github_get_branch_commit_sha(branch=None):
-    branch = branch or GITHUB_BRANCH
-    url = f"https://api.github.com/repos/{GITHUB_REPO}/git/refs/heads/{branch}"
-    r = requests.get(url, headers=_gh_headers(), timeout=20)
-    if r.status_code != 200:
-        raise RuntimeError(f"Get ref failed {r.status_code}: {r.text}")
-    return r.json()["object"]["sha"]
+def apply_dump_config(state):
+    """Adopt dump settings changed through /api/dump-config in any worker."""
+    global DUMP_ENABLED, DUMP_INTERVAL_SECONDS, DUMP_TRIGGER_ROWS, DUMP_TRIGGER_BYTES, GITHUB_PATH, GITHUB_REPO, GITHUB_BRANCH
+    cfg = state.get("config") or {}
+    DUMP_ENABLED = bool(cfg.get("enabled", DUMP_ENABLED))
+    DUMP_INTERVAL_SECONDS = max(1, int(cfg.get("interval_seconds", DUMP_INTERVAL_SECONDS)))
+    DUMP_TRIGGER_ROWS = max(0, int(cfg.get("max_rows", DUMP_TRIGGER_ROWS)))
+    DUMP_TRIGGER_BYTES = max(0, int(cfg.get("max_bytes", DUMP_TRIGGER_BYTES)))
+    POLICY.configure(DUMP_TRIGGER_ROWS, DUMP_TRIGGER_BYTES, DUMP_INTERVAL_SECONDS)
+    GITHUB_PATH = cfg.get("path", GITHUB_PATH)
+    GITHUB_REPO = cfg.get("repo", GITHUB_REPO)
+    GITHUB_BRANCH = cfg.get("branch", GITHUB_BRANCH)
+
+def save_state(state):
+    # Write-then-rename so a crash never leaves a torn watermark behind
+    tmp = STATE_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, STATE_PATH)
+
+def github():
+    """The shared pooled client, following /api/dump-config changes."""
+    GITHUB.configure(GITHUB_TOKEN, GITHUB_REPO, GITHUB_BRANCH)
+    return GITHUB
 
 def github_list_files_recursive(folder):
     folder = folder.strip("/")
-    commit_sha = github_get_branch_commit_sha()
-    url = f"https://api.github.com/repos/{GITHUB_REPO}/git/trees/{commit_sha}?recursive=1"
-    r = requests.get(url, headers=_gh_headers(), timeout=30)
-    if r.status_code != 200:
-        raise RuntimeError(f"Trees list failed {r.status_code}: {r.text}")
-    data = r.json()
-    tree = data.get("tree", [])
+    gh = github()
     prefix = folder + "/"
-    files = []
-    for entry in tree:
-        if entry.get("type") == "blob" and entry.get("path", "").startswith(prefix):
-            files.append({"path": entry["path"], "sha": entry["sha"]})
-    return files
+    return [{"path": e["path"], "sha": e["sha"]} for e in gh.tree(gh.commit_tree(gh.head()))
+            if e.get("type") == "blob" and e.get("path", "").startswith(prefix)]
 
 def github_delete_file_via_contents(path_in_repo, sha, message):
-    url = f"https://api.github.com/repos/{GITHUB_REPO}/contents/{urllib.parse.quote(path_in_repo)}"
-    data = {"message": message, "sha": sha, "branch": GITHUB_BRANCH}
-    r = requests.delete(url, headers=_gh_headers(), json=data, timeout=30)
-    if r.status_code not in (200, 204):
-        raise RuntimeError(f"Delete {path_in_repo} failed {r.status_code}: {r.text}")
+    github().request("DELETE", f"contents/{urllib.parse.quote(path_in_repo)}", f"Delete {path_in_repo}",
+                     ok=(200, 204), json={"message": message, "sha": sha, "branch": GITHUB_BRANCH})
 
-def github_delete_all_in_path_recursive(folder):
+def github_delete_all_in_path_recursive(folder, job=None):
+    """
+    Delete every file under folder. Normally this is one tree rewrite: the
+    head tree minus those paths, published as one commit and one ref update.
+    That makes it atomic and costs the same handful of API calls for 10 or
+    10,000 files. If the rewrite fails, fall back to bounded-parallel
+    contents-API deletes, tracked in DELETE_PROGRESS (and job.progress).
+    A cancelled job stops before the commit, or between files in the fallback.
+    Returns (deleted, errors, mode).
+    """
     files = github_list_files_recursive(folder)
-    deleted = 0
-    errors = []
-    if not files:
-        return deleted, errors
-    log_dump(f"[dump-delete] found {len(files)} file(s) under {folder}")
-    for f in files:
+    DELETE_PROGRESS.update({"running": True, "mode": "tree", "total": len(files), "deleted": 0, "errors": 0,
+                            "started": datetime.now(timezone.utc).isoformat()})
+    if job:
+        job.update(total=len(files), mode="tree")
+    try:
+        if not files:
+            return 0, [], "tree"
+        log_dump(f"[dump-delete] found {len(files)} file(s) under {folder}")
+        if job:
+            job.check()
         try:
-            log_dump(f"[dump-delete] DELETE {f['path']}")
-            github_delete_file_via_contents(f["path"], f["sha"], f"Delete {os.path.basename(f['path'])}")
-            deleted += 1
+            sha = github().commit_changes([(f["path"], None) for f in files],
+                                          f"Delete {len(files)} file(s) under {folder}")
+            DELETE_PROGRESS["deleted"] = len(files)
+            if job:
+                job.update(deleted=len(files))
+            log_dump(f"[dump-delete] commit {sha[:7]} removed {len(files)} file(s)")
+            return len(files), [], "tree"
         except Exception as e:
-            errors.append({"path": f["path"], "error": str(e)})
-    return deleted, errors
+            log_dump(f"[dump-delete] tree rewrite failed ({e}); deleting file by file")
+        DELETE_PROGRESS["mode"] = "contents"
+        if job:
+            job.update(mode="contents")
+        errors = []
+        with ThreadPoolExecutor(max_workers=max(1, DELETE_PARALLEL)) as pool:
+            futures = {pool.submit(delete_with_retry, f): f for f in files}
+            for fut in as_completed(futures):
+                if job and job.cancelled():
+                    for f in futures:
+                        f.cancel()   # queued deletes never start; the ones in flight finish
+                    log_dump(f"[dump-delete] cancelled after {DELETE_PROGRESS['deleted']}/{len(files)} file(s)")
+                    job.check()
+                try:
+                    fut.result()
+                    DELETE_PROGRESS["deleted"] += 1
+                    if job:
+                        job.add(deleted=1)
+                except Exception as e:
+                    DELETE_PROGRESS["errors"] += 1
+                    if job:
+                        job.add(errors=1)
+                    errors.append({"path": futures[fut]["path"], "error": str(e)})
+                done = DELETE_PROGRESS["deleted"] + DELETE_PROGRESS["errors"]
+                if done % 25 == 0 or done == len(files):
+                    log_dump(f"[dump-delete] {done}/{len(files)} processed ({len(errors)} error(s))")
+        return DELETE_PROGRESS["deleted"], errors, "contents"
+    finally:
+        DELETE_PROGRESS["running"] = False
+
+def delete_with_retry(f, attempts=3):
+    # Parallel contents-API deletes race for the branch head; GitHub answers 409 and a retry succeeds
+    for attempt in range(attempts):
+        try:
+            return github_delete_file_via_contents(f["path"], f["sha"], f"Delete {os.path.basename(f['path'])}")
+        except GitHubError as e:
+            if e.status != 409 or attempt == attempts - 1:
+                raise
+            time.sleep(0.5 * (attempt + 1))
+
+def record_last_dump(dump_type, ok, message, filename=None, rows=0, deleted=0, devices=None, nbytes=0):
+    LAST_DUMP.update({"when": datetime.now(timezone.utc).isoformat(), "type": dump_type, "ok": bool(ok), "message": message, "filename": filename, "rows": int(rows), "bytes": int(nbytes), "deleted": int(deleted), "devices": devices or {}})
+    update_state(last_dump=dict(LAST_DUMP))
+    BROKER.publish("dump", dump_status_payload())
 
-def record_last_dump(dump_type, ok, message, filename=None, rows=0, deleted=0):
-    LAST_DUMP.update({"when": datetime.now(timezone.utc).isoformat(), "type": dump_type, "ok": bool(ok), "message": message, "filename": filename, "rows": int(rows), "deleted": int(deleted)})
+def dump_watermark(state):
+    # Rows up to here are serialized; sealed batches count even if the state write was lost
+    return max(int(state.get("last_id") or 0), OUTBOX.last_upto())
 
-def perform_dump_once(trigger="auto"):
+def pruned_watermark(state):
+    # States written before sinks existed pruned everything they had uploaded
+    return int(state.get("pruned_id", state.get("last_id") or 0))
+
+def dump_path(device, label, suffix="", ext=".json"):
+    # Relative to the dump folder. The default device keeps the original layout; other pillows get a subfolder each
+    sub = "" if device == DEFAULT_DEVICE else f"{device}/"
+    return f"{sub}dump_{label}{suffix}{ext}"
+
+def perform_dump_once(trigger="auto", join=True, job=None):
+    """
+    Serialize every row above the dump watermark into outbox batches, at
+    most DUMP_MAX_ROWS_PER_FILE rows per round as one file per device and up
+    to DUMP_COMMIT_MAX_FILES files per batch. Each batch goes to every sink
+    in parallel, and the rows are pruned once DUMP_QUORUM sinks have it.
+    Single flight across workers (DUMP_LOCK): if a dump is already running,
+    join=True waits for it and returns its result, join=False returns None.
+    A job gets progress (rows, files, bytes, bytes_uploaded, batches) and is
+    cancellable between rounds: batches already sealed still reach the sinks,
+    rows serialized but not sealed are left for the next dump.
+    """
+    if not DUMP_LOCK.acquire(blocking=False):
+        if not join:
+            return None
+        with DUMP_LOCK:
+            pass
+        last = load_state().get("last_dump") or LAST_DUMP
+        log_dump(f"{trigger} joined the dump already in progress")
+        return (bool(last.get("ok")), f"Joined a dump already in progress: {last.get('message')}",
+                int(last.get("deleted") or 0), last.get("filename"), int(last.get("rows") or 0))
+    try:
+        result = dump_rounds(trigger, job)
+    except Cancelled:
+        OUTBOX.discard_unsealed()
+        DUMP_RUNS.inc(1, "cancelled")
+        log_dump(f"{trigger} dump cancelled")
+        raise
+    except Exception:
+        DUMP_RUNS.inc(1, "error")
+        POLICY.failed()
+        raise
+    finally:
+        DUMP_LOCK.release()
+    DUMP_RUNS.inc(1, "ok" if result[0] else "failed")
+    if result[0]:
+        POLICY.succeeded(result[4], LAST_DUMP["bytes"])
+    else:
+        POLICY.failed()
+    return result
+
+def dump_rounds(trigger, job=None):
+    flush_ingest_queue()
     state = load_state()
-    log_dump(f"{trigger} attempt (enabled={DUMP_ENABLED}, interval={DUMP_INTERVAL_SECONDS}s, repo={GITHUB_REPO}, branch={GITHUB_BRANCH}, path={GITHUB_PATH}, token={'yes' if GITHUB_TOKEN else 'no'})")
-    with app.app_context():
-        items = fetch_rows_since(state.get("last_ts"))
-    rows = len(items)
-    log_dump(f"fetched {rows} rows since last_ts={state.get('last_ts')}")
-    if rows == 0:
+    apply_dump_config(state)
+    OUTBOX.discard_unsealed()
+    if "pruned_id" not in state:
+        update_state(pruned_id=pruned_watermark(state))
+    watermark = dump_watermark(state)
+    log_dump(f"{trigger} attempt (enabled={DUMP_ENABLED}, sinks={','.join(SINKS.names)}, quorum={SINKS.quorum}, repo={GITHUB_REPO}, branch={GITHUB_BRANCH}, path={GITHUB_PATH}, token={'yes' if GITHUB_TOKEN else 'no'})")
+    ts_label = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+    folder = GITHUB_PATH.strip("/")
+    total_rows, total_deleted, total_bytes, files, devices, rounds, short = 0, 0, 0, [], {}, 0, []
+    fmt = DUMP_FORMAT if DUMP_FORMAT in DUMP_FORMATS else "ndjson.gz"
+    batch, entries, staged_rows, batch_from, cursor = None, {}, 0, watermark, watermark
+    while True:
+        if job:
+            job.check()
+        with STORAGE.read() as db:
+            db.execute("BEGIN")  # one snapshot for the bound, the counts and the rows
+            upto = PARTS.last_id(db)
+            # Cap the round in id order, then split it by device
+            hi = min(PARTS.id_at(db, cursor, max(1, DUMP_MAX_ROWS_PER_FILE)) or upto, upto)
+            counts = PARTS.device_counts(db, cursor, hi)
+            if not counts:
+                break
+            rounds += 1
+            # The round's last id makes the name unique: two dumps in one second must never share a path
+            suffix = f"_{hi:012d}"
+            batch = batch or OUTBOX.begin()
+            for dev in sorted(counts):
+                rel = dump_path(dev, ts_label, suffix, DUMP_FORMATS[fmt][0])
+                t0 = time.perf_counter()
+                with OUTBOX.create(batch, rel) as out:
+                    entries[rel] = write_dump(fmt, PARTS.scan_ids(db, cursor, hi, device=dev), counts[dev], out, dev)
+                DUMP_PHASE_SECONDS.observe(time.perf_counter() - t0, "serialize")
+                DUMP_ROWS.inc(entries[rel]["count"])
+                total_bytes += entries[rel]["bytes"]
+                if job:
+                    job.add(rows=entries[rel]["count"], files=1, bytes=entries[rel]["bytes"])
+                log_dump(f"serialized {entries[rel]['count']} rows for {dev} as {fmt} → {rel} (ids {cursor + 1}..{hi}, {entries[rel]['bytes']} bytes)")
+                files.append(f"{folder}/{rel}")
+                prev = devices.get(dev, {"rows": 0})
+                devices[dev] = {"rows": prev["rows"] + counts[dev], "filename": files[-1]}
+        staged_rows += sum(counts.values())
+        cursor = hi
+        if len(entries) >= DUMP_COMMIT_MAX_FILES:
+            acks, deleted = publish_batch(batch, entries, batch_from, cursor, staged_rows, ts_label, job)
+            total_deleted += deleted
+            total_rows += staged_rows
+            if acks < SINKS.quorum:
+                short.append(acks)
+            batch, entries, staged_rows, batch_from = None, {}, 0, cursor
+    if entries:
+        acks, deleted = publish_batch(batch, entries, batch_from, cursor, staged_rows, ts_label, job)
+        total_deleted += deleted
+        total_rows += staged_rows
+        if acks < SINKS.quorum:
+            short.append(acks)
+
+    if not files:
         msg = "No new rows to dump."
         record_last_dump(trigger, True, msg, filename=None, rows=0, deleted=0)
         return True, msg, 0, None, 0
+    where = files[0] if len(files) == 1 else f"{len(files)} files ({files[0]} … {files[-1]})"
+    msg = f"Uploaded {total_rows} rows from {len(devices)} device(s) to {where}. Pruned {total_deleted} rows locally."
+    if short:
+        msg += (f" Only {min(short)} of {len(SINKS.sinks)} sink(s) acknowledged (quorum {SINKS.quorum}); the rows stay"
+                f" in the database and the outbox keeps retrying.")
+    record_last_dump(trigger, not short, msg, filename=files[-1], rows=total_rows, deleted=total_deleted, devices=devices,
+                     nbytes=total_bytes)
+    return not short, msg, total_deleted, files[-1], total_rows
 
-    payload = json.dumps({"count": rows, "items": items}, separators=(",", ":")).encode("utf-8")
-    ts_label = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
-    folder = GITHUB_PATH.strip("/")
-    filename = f"{folder}/dump_{ts_label}.json"
-    github_put_file(filename, payload, f"Automated dump {ts_label} ({rows} rows)")
-    log_dump(f"upload success → {filename}")
-
-    last_ts_uploaded = items[-1]["ts"]
-    with app.app_context():
-        db = get_db()
-        row = db.execute("SELECT COUNT(*) AS c FROM samples WHERE ts <= ?", (last_ts_uploaded,)).fetchone()
-        deleted = int(row["c"]) if row and row["c"] is not None else 0
-        db.execute("DELETE FROM samples WHERE ts <= ?", (last_ts_uploaded,))
-        db.commit()
-        try: db.execute("VACUUM")
-        except Exception: pass
+def publish_batch(batch, entries, from_id, upto, rows, ts_label, job=None):
+    """
+    Seal a serialized batch in the outbox (the dump watermark moves past it),
+    send it to every sink in parallel and prune what a quorum has.
+    Returns (acknowledgements, rows pruned).
+    """
+    name = OUTBOX.seal(batch, {"from_id": from_id, "upto": upto, "rows": rows, "label": ts_label,
+                               "manifest": manifest_path(ts_label[:8]), "files": entries,
+                               "message": f"Automated dump {ts_label} ({rows} rows, {len(entries)} file(s))"})
+    advance_state(last_id=upto)
+    t0 = time.perf_counter()
+    acks = SINKS.publish(name)
+    DUMP_PHASE_SECONDS.observe(time.perf_counter() - t0, "upload")
+    if job:
+        job.add(batches=1, bytes_uploaded=sum(e["bytes"] for e in entries.values()) if acks else 0)
+    log_dump(f"batch {name}: {acks}/{len(SINKS.sinks)} sink(s) acknowledged (quorum {SINKS.quorum})")
+    return acks, prune_acked()
 
-    log_dump(f"pruned {deleted} rows locally (<= {last_ts_uploaded})")
-    state["last_ts"] = None
-    save_state(state)
-    msg = f"Uploaded {rows} rows to {filename}. Pruned {deleted} rows locally."
-    record_last_dump(trigger, True, msg, filename=filename, rows=rows, deleted=deleted)
-    return True, msg, deleted, filename, rows
+def prune_acked():
+    """Prune every row a quorum of sinks has (Outbox.quorum_id); returns rows deleted."""
+    if RETAIN_RAW_S > 0:
+        return 0   # raw rows stay for RETAIN_RAW_S; run_retention ages them out
+    with PRUNE_LOCK:
+        state = load_state()
+        upto = OUTBOX.quorum_id(SINKS.names, SINKS.quorum, dump_watermark(state))
+        if upto <= pruned_watermark(state):
+            return 0
+        t0 = time.perf_counter()
+        with STORAGE.write() as db:
+            # Fold everything about to be pruned into the rollups first (open buckets are merged later)
+            while ROLLUPS.run(db, PARTS, upto_id=upto, force=True, max_rows=ROLLUP_BATCH_ROWS) >= ROLLUP_BATCH_ROWS:
+                pass
+            # Whole uploaded partitions are dropped; only partially covered ones see a ranged DELETE
+            deleted = PARTS.prune_through_id(db, upto)
+            bump_data_epoch(db)
+            # Only the dropped and partially pruned partitions change in LIVE
+            reconcile_live(db)
+            try: PARTS.reclaim(db)
+            except Exception: pass
+        advance_state(pruned_id=upto)
+    DUMP_PHASE_SECONDS.observe(time.perf_counter() - t0, "prune")
+    log_dump(f"pruned {deleted} rows locally (id <= {upto})")
+    return deleted
 
-def dump_loop():
-    if os.environ.get("WERKZEUG_RUN_MAIN") != "true":
+def retry_sinks():
+    # Lagging sinks catch up from the outbox; each late acknowledgement may free rows to prune
+    if SINKS.retry(on_ack=prune_acked):
+        log_dump(f"outbox: retrying {', '.join(n for n, s in SINKS.stats()['sinks'].items() if s['pending'])}")
+
+def run_retention():
+    """
+    Leader tick (every RETAIN_INTERVAL_S): age out raw partitions, then old
+    rollup buckets. Every step is its own short write transaction, so ingest
+    never waits behind a long delete.
+    """
+    now_us = int(time.time() * 1_000_000)
+    dropped = 0
+    while RETAIN_RAW_S > 0:
+        state = load_state()
+        with STORAGE.write() as db:
+            # Only rows already folded into the rollups, and (by default) safely in a quorum of sinks
+            upto = ROLLUPS.watermark(db)
+            if RETAIN_RAW_REQUIRE_DUMP:
+                upto = min(upto, OUTBOX.quorum_id(SINKS.names, SINKS.quorum, dump_watermark(state)))
+            hit = PARTS.drop_expired(db, now_us - int(RETAIN_RAW_S * 1_000_000), upto)
+            if hit:
+                bump_data_epoch(db)
+                reconcile_live(db)   # drops that partition's counters; nothing is re-read
+        if not hit:
+            break
+        dropped += hit[1]
+        RETAIN_DELETED.inc(hit[1], "raw")
+        print(f"[retention] dropped {hit[0]} ({hit[1]} rows)", flush=True)
+    if dropped:
+        with STORAGE.write() as db:
+            try: PARTS.reclaim(db)
+            except Exception: pass
+    for res, keep_s in RETAIN_ROLLUP_S.items():
+        if keep_s <= 0:
+            continue
+        before = now_us - int(keep_s * 1_000_000)
+        total = 0
+        while True:
+            with STORAGE.write() as db:
+                n = ROLLUPS.expire(db, res, before, RETAIN_BATCH_ROWS)
+            total += n
+            if n < RETAIN_BATCH_ROWS:
+                break
+        if total:
+            RETAIN_DELETED.inc(total, res)
+            print(f"[retention] expired {total} {res} buckets before {us_to_iso(before)}", flush=True)
+
+def auto_dump():
+    """Leader tick (every DUMP_CHECK_S): dump when a POLICY trigger fires."""
+    state = load_state()
+    apply_dump_config(state)
+    if not (DUMP_ENABLED and SINKS.ready()):
         return
-    while True:
+    # POLICY is per process; dumps run by other workers only show up in the shared state
+    last = state.get("last_dump") or {}
+    if last.get("when"):
+        POLICY.observe(datetime.fromisoformat(last["when"]).timestamp(), bool(last.get("ok")))
+    with STORAGE.read() as db:
+        top, watermark = PARTS.last_id(db), dump_watermark(state)
+        pending = PARTS.count_ids(db, watermark, top) if top > watermark else 0
+    reason = POLICY.due(pending)
+    if reason is None:
+        return
+    POLICY.last_reason = reason
+    try:
+        if perform_dump_once(trigger=f"auto:{reason}", join=False) is None:
+            log_dump("auto dump skipped: another dump is in flight")
+        elif POLICY.failures:
+            log_dump(f"auto dump failed; next try in {POLICY.retry_at - time.time():.0f}s")
+    except Exception as e:
+        log_dump(f"auto dump failed: {e}; next try in {POLICY.retry_at - time.time():.0f}s")
+        record_last_dump(f"auto:{reason}", False, str(e))
+
+def auto_compact():
+    apply_dump_config(load_state())
+    if not (DUMP_COMPACT_ENABLED and GITHUB_TOKEN and GITHUB_REPO and GITHUB_PATH):
+        return
+    # Under the GitHub sink's lock: deliveries there also move the branch and rewrite day manifests
+    with FileLock(os.path.join(LOCK_DIR, "sink-github.lock")):
+        result = compact(RepoFolder(github(), GITHUB_PATH), min_files=DUMP_COMPACT_MIN_FILES,
+                         max_files=DUMP_COMPACT_MAX_FILES, log=lambda m: print(f"[compact] {m}", flush=True))
+    if result["days"]:
+        update_state(last_compact={"when": datetime.now(timezone.utc).isoformat(), **result})
+
+def on_elected(first_try):
+    # Once per server start, not again when a worker takes over from a dead leader
+    if MONGO_CLEAR_ON_START and first_try:
         try:
-            if DUMP_ENABLED and GITHUB_TOKEN and GITHUB_REPO and GITHUB_PATH:
-                perform_dump_once(trigger="auto")
+            deleted = clear_collection()
+            print(f"[mongo] cleared collection on start: deleted={deleted}", flush=True)
         except Exception as e:
-            log_dump(f"auto dump failed: {e}")
-            record_last_dump("auto", False, str(e))
-        time.sleep(max(1, int(DUMP_INTERVAL_SECONDS)))
+            print(f"[mongo] clear on start failed: {e}", flush=True)
+    with STORAGE.read() as db:
+        legacy = pending_legacy(db)
+    if legacy and MIGRATE_ON_START:
+        # Copy old rows across in the background; ingest already uses the partitions
+        threading.Thread(target=migrate_in_background, name="migrate", daemon=True).start()
+    elif legacy:
+        print(f"[schema] {', '.join(legacy)} pending; run `python migrate_db.py` to migrate", flush=True)
 
-threading.Thread(target=dump_loop, daemon=True).start()
+SCHEDULER.on_elected(on_elected)
+SCHEDULER.every("dump", DUMP_CHECK_S, auto_dump)
+SCHEDULER.every("rollups", ROLLUP_INTERVAL_S, run_rollups)
+SCHEDULER.every("retention", RETAIN_INTERVAL_S, run_retention)
+SCHEDULER.every("compact", DUMP_COMPACT_INTERVAL_S, auto_compact)
+SCHEDULER.every("sinks", DUMP_SINK_RETRY_S, retry_sinks)
+
+_stats_seen = {"etag": None}
+
+def publish_stats_if_changed():
+    # One stats query per second for all stream clients, and only when data moved
+    if not BROKER.has_subscribers():
+        return
+    etag = DATA_VERSION.etag()
+    if etag != _stats_seen["etag"]:
+        _stats_seen["etag"] = etag
+        # ?device= streams get that pillow's counters, like their initial snapshot
+        BROKER.publish_each("stats", stats_payload)
+
+_started = {"done": False}
+_start_lock = threading.Lock()
+
+def create_app():
+    """
+    Open the database and start this process's background work; returns the
+    Flask app. Call it once per serving process, after any fork:
+    `gunicorn -w 4 'app:create_app()'` (without --preload) or
+    `flask --app 'app:create_app()' run`. Every worker serves ingest and
+    reads; SCHEDULER elects one of them to run dumps, rollups and migration.
+    """
+    global INGEST_QUEUE
+    with _start_lock:
+        if _started["done"]:
+            return app
+        init_db()
+        # Try to init Mongo (safe no-op if MONGO_URI not configured)
+        try:
+            init_mongo()
+        except Exception as e:
+            print(f"[mongo] init failed (non-fatal): {e}", flush=True)
+        if INGEST_MODE == "write_behind":
+            INGEST_QUEUE = IngestQueue(write_samples, maxsize=INGEST_QUEUE_MAX,
+                                       flush_rows=INGEST_FLUSH_ROWS, flush_ms=INGEST_FLUSH_MS,
+                                       key_fn=lambda s: s[5], lane_max=INGEST_DEVICE_QUEUE_MAX)
+            INGEST_QUEUE.start()
+            print(f"[ingest] write-behind enabled (max={INGEST_QUEUE_MAX}, per-device={INGEST_DEVICE_QUEUE_MAX}, flush_rows={INGEST_FLUSH_ROWS}, flush_ms={INGEST_FLUSH_MS})", flush=True)
+        ticker(1.0, publish_stats_if_changed, name="stats-ticker")
+        if WEB_CONCURRENCY > 1:
+            ticker(WORKER_SYNC_S, sync_from_other_workers, name="worker-sync")
+            REGISTRY.share(METRICS_DIR)
+            ticker(METRICS_SHARE_S, lambda: REGISTRY.share(METRICS_DIR), name="metrics-share")
+        SCHEDULER.start()
+        _started["done"] = True
+    return app
+
+@app.before_request
+def before_request():
+    g.t0 = time.perf_counter()
+    if PROFILER.active is not None:
+        g.prof = PROFILER.request_started()
+    # Servers pointed at `app:app` instead of the factory still get a started process
+    if not _started["done"]:
+        create_app()
+    # Other workers may have written since this one last looked; answer reads from current state
+    if WEB_CONCURRENCY > 1 and request.method == "GET" and request.path.startswith("/api/") \
+            and request.endpoint != "api_stream":
+        sync_from_other_workers()
+
+@app.after_request
+def after_request(resp):
+    if "t0" in g:
+        HTTP_SECONDS.observe(time.perf_counter() - g.t0, request.endpoint or "none", request.method, str(resp.status_code))
+    if "prof" in g:
+        PROFILER.request_finished(request.endpoint or "none", g.prof)
+    return resp
 
 if __name__ == "__main__":
+    # With the reloader, only the child process that serves requests starts the app
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        create_app()
     app.run(host="0.0.0.0", port=5000, debug=True)
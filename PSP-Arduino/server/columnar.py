@@ -0,0 +1,118 @@
+# server/columnar.py
+import base64
+import gzip
+import json
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from schema import FSR_COUNT
+
+MSGPACK_MIMETYPE = "application/msgpack"
+COMPRESS_MIN_BYTES = 1024
+_ENC = json.JSONEncoder(separators=(",", ":"))
+
+
+def _arr(a: np.ndarray, dtype: str, binary: bool, **meta) -> Dict[str, Any]:
+    # Little-endian raw bytes, so browsers can wrap them in a typed array directly
+    raw = np.ascontiguousarray(a, dtype=np.dtype(dtype).newbyteorder("<")).tobytes()
+    return {"dtype": dtype, **meta, "data": raw if binary else base64.b64encode(raw).decode("ascii")}
+
+
+def encode(cols: Dict[str, np.ndarray], idx: Optional[np.ndarray] = None, newest_first: bool = True,
+           binary: bool = False) -> Dict[str, Any]:
+    """
+    Column arrays (downsample.columns) → columnar payload:
+      ts      int64 base_us + int32 (or int64) deltas from the previous row
+      id      same base + delta scheme
+      fsr     uint8, shape [count, FSR_COUNT], row-major
+      t1_c/t2_c float32, volume uint8
+      device  dictionary + uint16 codes (omitted when all rows share one device)
+    Arrays are base64 strings for JSON, raw bytes for MessagePack (binary=True).
+    """
+    if idx is not None:
+        cols = {k: v[idx] for k, v in cols.items()}
+    if newest_first:
+        cols = {k: v[::-1] for k, v in cols.items()}
+    n = len(cols["ts_us"])
+    out: Dict[str, Any] = {"layout": "columnar", "count": n, "order": "desc" if newest_first else "asc",
+                           "encoding": "binary" if binary else "base64", "columns": {}}
+    c = out["columns"]
+    for key, src in (("ts", "ts_us"), ("id", "id")):
+        v = cols[src]
+        base = int(v[0]) if n else 0
+        delta = np.diff(v, prepend=base)
+        wide = n and (delta.min() < np.iinfo(np.int32).min or delta.max() > np.iinfo(np.int32).max)
+        c[key] = _arr(delta, "int64" if wide else "int32", binary, base=base, delta=True)
+    c["fsr"] = _arr(cols["fsr"], "uint8", binary, shape=[n, FSR_COUNT])
+    c["t1_c"] = _arr(cols["t1_c"], "float32", binary)
+    c["t2_c"] = _arr(cols["t2_c"], "float32", binary)
+    c["volume"] = _arr(cols["volume"], "uint8", binary)
+    if "device" in cols and n:
+        names, codes = np.unique(cols["device"], return_inverse=True)
+        if len(names) == 1:
+            out["device"] = str(names[0])
+        else:
+            c["device"] = _arr(codes, "uint16", binary, values=[str(x) for x in names])
+    return out
+
+
+def msgpack_available() -> bool:
+    try:
+        import msgpack  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def pack(payload: Dict[str, Any], binary: bool) -> Tuple[bytes, str]:
+    """(body, mimetype): MessagePack when binary, else compact JSON."""
+    if binary:
+        import msgpack
+        return msgpack.packb(payload, use_bin_type=True), MSGPACK_MIMETYPE
+    return _ENC.encode(payload).encode("utf-8"), "application/json"
+
+
+def _brotli():
+    try:
+        import brotli
+        return brotli
+    except ImportError:
+        return None
+
+
+def pick_encoding(accept_encoding: str, allowed: Tuple[str, ...] = ("br", "gzip")) -> Optional[str]:
+    """br (if the brotli module is installed) > gzip > none, as offered by Accept-Encoding."""
+    offered = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try: q = float(params.strip()[2:])
+            except ValueError: q = 0.0
+        if name:
+            offered[name.lower()] = q
+    if "br" in allowed and offered.get("br", 0) > 0 and _brotli() is not None:
+        return "br"
+    if "gzip" in allowed and offered.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == "br":
+        return _brotli().compress(body, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=5, mtime=0)
+    return body
+
+
+def gzip_stream(chunks, level: int = 5):
+    """Incrementally gzip an iterator of byte chunks (streamed exports)."""
+    z = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        piece = z.compress(chunk)
+        if piece:
+            yield piece
+    yield z.flush()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Compaction of small dump files into one archive per device per day.
+
+The server uploads a dump every DUMP_INTERVAL_SECONDS, so a day leaves
+hundreds of files of a few dozen rows each. For every closed UTC day (by the
+dump file's name) with at least --min-files files, this merges them, plus an
+earlier archive of that day, into
+
+  <folder>/[<device>/]daily_YYYYMMDD.ndjson.gz
+
+a v2 dump (see dump_format.py) sorted by ts with duplicate rows dropped.
+Its entry in manifests/YYYY-MM-DD.json is the index: count, sha256, ts and
+id range, and the names of the files it replaced. The archives, the manifest
+updates and the removal of the originals are one commit, so a reader sees
+either the old files or the archive, never both or neither.
+
+Usage:
+  python compact.py [--before YYYY-MM-DD] [--min-files 2] [--dry-run]   # the GITHUB_* repo
+  python compact.py --local ../Data [--before YYYY-MM-DD]              # a checkout of the dump folder
+"""
+
+import argparse
+import json
+import os
+import re
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from dump_format import file_sha256, manifest_path, merge_manifest, read_dump, spool, write_ndjson_gz_dump
+from schema import DEFAULT_DEVICE, iso_to_us
+from sinks import LocalFolder, RepoFolder
+
+DUMP_RE = re.compile(r"^(?:(?P<device>[^/]+)/)?dump_(?P<day>\d{8})_\d{6}(?:_\d+)?\.(?:json|ndjson\.gz)$")
+ARCHIVE_RE = re.compile(r"^(?:(?P<device>[^/]+)/)?daily_(?P<day>\d{8})\.ndjson\.gz$")
+_KEY = json.JSONEncoder(sort_keys=True, separators=(",", ":")).encode
+
+
+def archive_path(device: str, day: str) -> str:
+    return f"{'' if device == DEFAULT_DEVICE else device + '/'}daily_{day}.ndjson.gz"
+
+
+def plan(paths: Sequence[str], before: str, min_files: int = 2) -> Dict[Tuple[str, str], List[str]]:
+    """(device, YYYYMMDD) → files to merge, for days before `before` with at least one dump and min_files files."""
+    groups: Dict[Tuple[str, str], List[str]] = {}
+    for p in paths:
+        m = DUMP_RE.match(p) or ARCHIVE_RE.match(p)
+        if m and m.group("day") < before:
+            groups.setdefault((m.group("device") or DEFAULT_DEVICE, m.group("day")), []).append(p)
+    return {k: sorted(v) for k, v in sorted(groups.items())
+            if len(v) >= max(1, min_files) and any(DUMP_RE.match(p) for p in v)}
+
+
+def merge(sources: Sequence[Tuple[str, bytes]], device: str) -> List[Dict[str, Any]]:
+    """All items of the source files, sorted by ts; exact duplicates (a re-uploaded dump) are kept once."""
+    seen, items = set(), []
+    for _, data in sources:
+        for it in read_dump(data)[1]:
+            it.setdefault("device", device)   # v1 items carry no device
+            key = _KEY(it)
+            if key not in seen:
+                seen.add(key)
+                items.append(it)
+    items.sort(key=lambda it: iso_to_us(it["ts"]))
+    return items
+
+
+def compact(store, before: Optional[str] = None, min_files: int = 2, max_files: int = 500,
+            dry_run: bool = False, log=print) -> Dict[str, Any]:
+    """
+    Compact every eligible day in store (LocalFolder or RepoFolder), at most
+    max_files source files per call; a later call picks up the rest.
+    before is YYYY-MM-DD or YYYYMMDD (default: today, UTC).
+    """
+    before = (before or datetime.now(timezone.utc).strftime("%Y%m%d")).replace("-", "")
+    groups = plan(store.list(), before, min_files)
+    result = {"days": 0, "files": 0, "rows": 0, "archives": [], "commit": None, "pending": 0}
+    writes: Dict[str, Any] = {}
+    manifests: Dict[str, Optional[bytes]] = {}
+    drops: List[str] = []
+    try:
+        for (device, day), paths in groups.items():
+            if result["files"] and result["files"] + len(paths) > max_files:
+                result["pending"] += len(paths)
+                continue
+            arel, mrel = archive_path(device, day), manifest_path(day)
+            result["days"] += 1
+            result["files"] += len(paths)
+            result["archives"].append(arel)
+            if dry_run:
+                log(f"would merge {len(paths)} file(s) into {arel}")
+                continue
+            if mrel not in manifests:
+                manifests[mrel] = store.read(mrel)
+            listed = json.loads(manifests[mrel])["files"] if manifests[mrel] else {}
+            items = merge([(p, store.read(p)) for p in paths], device)
+            out = spool()
+            names = [n for p in paths for n in ((listed.get(p, {}).get("sources") or []) if p == arel
+                                                  else [os.path.basename(p)])]
+            n, nbytes = write_ndjson_gz_dump(items, len(items), out, device, to_item=lambda it: it,
+                                             header={"day": f"{day[:4]}-{day[4:6]}-{day[6:]}", "sources": len(names)})
+            ids = [v for p in paths for v in (listed.get(p, {}).get("id_from"), listed.get(p, {}).get("id_to")) if v is not None]
+            entry = {"format": "ndjson.gz", "version": 2, "device": device, "count": n, "bytes": nbytes,
+                     "sha256": file_sha256(out), "ts_from": items[0]["ts"] if n else None,
+                     "ts_to": items[-1]["ts"] if n else None, "id_from": min(ids) if ids else None,
+                     "id_to": max(ids) if ids else None, "sources": names}
+            writes[arel] = out
+            drops += [p for p in paths if p != arel]
+            manifests[mrel] = merge_manifest(manifests[mrel], {arel: entry}, drop=paths)
+            result["rows"] += n
+            log(f"{day} {device}: {len(paths)} file(s) → {arel} ({n} rows, {nbytes} bytes)")
+        if result["days"] and not dry_run:
+            writes.update(manifests)
+            result["commit"] = store.replace(writes, drops, f"Compact {len(drops)} dump file(s) into "
+                                                            f"{result['days']} daily archive(s)")
+            log(f"replaced {len(drops)} file(s) with {result['days']} archive(s)"
+                + (f" in commit {result['commit'][:7]}" if result["commit"] else ""))
+    finally:
+        for body in writes.values():
+            if hasattr(body, "close"):
+                body.close()
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Merge the small dump files of closed days into daily archives.")
+    ap.add_argument("--local", metavar="DIR", help="compact a checkout of the dump folder instead of the GitHub repo")
+    ap.add_argument("--before", help="only days before this one, YYYY-MM-DD (default: today, UTC)")
+    ap.add_argument("--min-files", type=int, default=2, help="leave days with fewer files alone")
+    ap.add_argument("--max-files", type=int, default=100000, help="source files per run (GitHub: per commit)")
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args()
+    if args.local:
+        store = LocalFolder(args.local)
+    else:
+        from github_client import GitHubClient
+        token = os.getenv("GITHUB_TOKEN", "")
+        if not token:
+            ap.error("GITHUB_TOKEN is not set (or use --local DIR)")
+        store = RepoFolder(GitHubClient(token, os.getenv("GITHUB_REPO", "quynhanh726/PSP-Post-Surgery-Pillow-"),
+                                        os.getenv("GITHUB_BRANCH", "main")), os.getenv("GITHUB_PATH", "PSP-Arduino/Data"))
+    result = compact(store, before=args.before, min_files=args.min_files, max_files=args.max_files,
+                     dry_run=args.dry_run, log=lambda m: print(f"[compact] {m}", flush=True))
+    if not result["days"]:
+        print("[compact] nothing to compact", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# server/downsample.py
+import re
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from schema import FSR_COUNT, us_to_iso
+
+SERIES = ("t1_c", "t2_c", "volume")
+SHAPE_SERIES = SERIES + ("fsr",)   # ?points= keeps the peaks of these by default
+
+
+def columns(rows: Sequence) -> Dict[str, np.ndarray]:
+    """
+    Fetched rows → column arrays (ascending ts). One zip() transposes the
+    rows (id, ts_us, fsr, t1_c, t2_c, volume, device) in C; FSR blobs become
+    one (n, 8) uint8 matrix.
+    """
+    n = len(rows)
+    ids, ts, fsr, t1, t2, vol, dev = zip(*rows) if n else ((),) * 7
+    cols = {
+        "id": np.array(ids, dtype=np.int64),
+        "ts_us": np.array(ts, dtype=np.int64),
+        "t1_c": np.array(t1, dtype=np.float64),
+        "t2_c": np.array(t2, dtype=np.float64),
+        "volume": np.array(vol, dtype=np.float64),
+        "fsr": np.frombuffer(b"".join(fsr), dtype=np.uint8).reshape(n, FSR_COUNT),
+        "device": np.array(dev, dtype=object),
+    }
+    order = np.argsort(cols["ts_us"], kind="stable")
+    if n and np.any(order != np.arange(n)):
+        cols = {k: v[order] for k, v in cols.items()}
+    return cols
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets. Returns the indices of the n_out points
+    that best keep the visual shape of (x, y). Exact LTTB anchors each bucket
+    on the point picked in the one before, a sequential walk; here every
+    bucket's triangle areas are computed at once, first anchored on the
+    previous bucket's centroid, then once more on the points that picked.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x, y = x.astype(np.float64), y.astype(np.float64)
+    # n_out - 2 buckets over the points between the fixed first and last one (never empty while n_out < n)
+    starts = np.linspace(1, n - 1, n_out - 1).astype(np.int64)[:-1] - 1
+    counts = np.diff(np.r_[starts, n - 2])
+    bucket = np.repeat(np.arange(len(starts)), counts)
+    xm, ym = x[1:-1], y[1:-1]
+    cx, cy = np.add.reduceat(xm, starts) / counts, np.add.reduceat(ym, starts) / counts
+    # Third corner: the next bucket's centroid, or the last point after the final bucket
+    nx, ny = np.r_[cx[1:], x[-1]][bucket], np.r_[cy[1:], y[-1]][bucket]
+    ax, ay = np.r_[x[0], cx[:-1]], np.r_[y[0], cy[:-1]]
+    for _ in range(2):
+        pax, pay = ax[bucket], ay[bucket]
+        area = np.abs((pax - nx) * (ym - pay) - (pax - xm) * (ny - pay))
+        hit = np.flatnonzero(area == np.maximum.reduceat(area, starts)[bucket])
+        pick = hit[np.unique(bucket[hit], return_index=True)[1]] + 1
+        ax, ay = np.r_[x[0], x[pick[:-1]]], np.r_[y[0], y[pick[:-1]]]
+    return np.r_[0, pick, n - 1]
+
+
+def by_device(cols: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Device → indices of its rows (still ascending ts); downsampling never mixes pillows."""
+    names, inv = np.unique(cols["device"].astype(str), return_inverse=True)
+    return {str(name): np.flatnonzero(inv == i) for i, name in enumerate(names)}
+
+
+def parse_series(v: str) -> Tuple[str, ...]:
+    """'t1_c,t2_c' → the series LTTB keeps the shape of; empty → all of SHAPE_SERIES."""
+    keys = tuple(k.strip() for k in str(v or "").split(",") if k.strip()) or SHAPE_SERIES
+    bad = [k for k in keys if k not in SHAPE_SERIES]
+    if bad:
+        raise ValueError(f"unknown series {', '.join(bad)} (use {', '.join(SHAPE_SERIES)})")
+    return keys
+
+
+def _series(cols: Dict[str, np.ndarray], keys: Sequence[str]) -> List[np.ndarray]:
+    # "fsr" stands for all FSR_COUNT channels, each one a line of its own
+    return [ch for k in keys for ch in (cols["fsr"].T if k == "fsr" else (cols[k],))]
+
+
+def lttb_rows(cols: Dict[str, np.ndarray], points: int, keys: Sequence[str] = SHAPE_SERIES) -> np.ndarray:
+    """
+    Union of per-series LTTB selections so every line named in `keys` keeps
+    its peaks, up to `points` per device. Returns ascending indices into cols.
+    """
+    picks = []
+    for sel in by_device(cols).values():
+        if points >= len(sel):
+            picks.append(sel)
+            continue
+        ts, series = cols["ts_us"][sel], _series({k: v[sel] for k, v in cols.items()}, keys)
+        per = max(3, points // len(series))
+        got = np.unique(np.concatenate([lttb_indices(ts, v, per) for v in series]))
+        # Series that peak on the same rows leave budget unused: widen each share while the union still fits
+        while len(got) < points and per < len(sel):
+            per *= 2
+            wider = np.unique(np.concatenate([lttb_indices(ts, v, per) for v in series]))
+            if len(wider) > points:
+                break
+            got = wider
+        picks.append(sel[got])
+    return np.unique(np.concatenate(picks)) if picks else np.arange(0)
+
+
+def items_at(cols: Dict[str, np.ndarray], idx: np.ndarray) -> List[Dict[str, Any]]:
+    ts, t1, t2, vol, fsr, dev = (cols["ts_us"][idx], cols["t1_c"][idx], cols["t2_c"][idx],
+                                 cols["volume"][idx].astype(np.int64), cols["fsr"][idx], cols["device"][idx])
+    return [{"ts": us_to_iso(ts[i]), "fsr": fsr[i].tolist(), "t1_c": float(t1[i]),
+             "t2_c": float(t2[i]), "volume": int(vol[i]), "device": str(dev[i])} for i in range(len(idx))]
+
+
+_BUCKET_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(ms|s|m|h)?\s*$", re.I)
+_UNIT_S = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_bucket(v: str) -> int:
+    """'30', '30s', '1m', '500ms' → bucket width in µs."""
+    m = _BUCKET_RE.match(str(v))
+    if not m:
+        raise ValueError(f"bad bucket {v!r} (use e.g. 30s, 1m, 5m)")
+    us = int(float(m.group(1)) * _UNIT_S[(m.group(2) or "s").lower()] * 1_000_000)
+    if us <= 0:
+        raise ValueError("bucket must be > 0")
+    return us
+
+
+def bucket_items(cols: Dict[str, np.ndarray], bucket_us: int) -> List[Dict[str, Any]]:
+    """
+    Fixed-width time buckets per device with count, mean and min/max per
+    series, all via ufunc.reduceat over the (sorted) bucket boundaries.
+    Ascending by bucket, then device.
+    """
+    items = []
+    for dev, sel in by_device(cols).items():
+        items.extend(_buckets({k: v[sel] for k, v in cols.items()}, bucket_us, dev))
+    items.sort(key=lambda it: (it["ts"], it["device"]))
+    return items
+
+
+def _buckets(cols: Dict[str, np.ndarray], bucket_us: int, device: str) -> List[Dict[str, Any]]:
+    ts = cols["ts_us"]
+    if not len(ts):
+        return []
+    key = ts // bucket_us
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    counts = np.diff(np.r_[starts, len(ts)])
+    out = {"n": counts}
+    for k in SERIES:
+        v = cols[k]
+        out[k] = np.add.reduceat(v, starts) / counts
+        out[k + "_min"] = np.minimum.reduceat(v, starts)
+        out[k + "_max"] = np.maximum.reduceat(v, starts)
+    fsr_mean = np.add.reduceat(cols["fsr"].astype(np.float64), starts, axis=0) / counts[:, None]
+    fsr_min = np.minimum.reduceat(cols["fsr"], starts, axis=0)
+    fsr_max = np.maximum.reduceat(cols["fsr"], starts, axis=0)
+    bstart = key[starts] * bucket_us
+    items = []
+    for i in range(len(starts)):
+        items.append({
+            "ts": us_to_iso(bstart[i]), "device": device, "n": int(counts[i]),
+            "fsr": np.rint(fsr_mean[i]).astype(int).tolist(),
+            "t1_c": round(float(out["t1_c"][i]), 3), "t2_c": round(float(out["t2_c"][i]), 3),
+            "volume": int(round(float(out["volume"][i]))),
+            "min": {k: float(out[k + "_min"][i]) for k in SERIES} | {"fsr": fsr_min[i].tolist()},
+            "max": {k: float(out[k + "_max"][i]) for k in SERIES} | {"fsr": fsr_max[i].tolist()},
+        })
+    return items
@@ -0,0 +1,163 @@
+# server/dump_format.py
+import base64
+import gzip
+import hashlib
+import json
+import tempfile
+import zlib
+from typing import Any, BinaryIO, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from schema import row_to_item, us_to_iso
+
+SPOOL_MAX_BYTES = 4 * 1024 * 1024     # spill to disk beyond this
+_B64_CHUNK = 3 * 64 * 1024            # multiple of 3 so chunks concatenate cleanly
+_ENC = json.JSONEncoder(separators=(",", ":"))
+
+# format → (file extension, format version); "json" is the original {"count","items"} layout
+DUMP_FORMATS = {"json": (".json", 1), "ndjson.gz": (".ndjson.gz", 2)}
+
+
+def write_json_dump(rows: Iterable, count: int, out: BinaryIO, chunk_rows: int = 1000,
+                    on_row: Callable[[object], None] = None) -> Tuple[int, int]:
+    """
+    Stream rows into the dump payload `{"count":N,"items":[...]}` without
+    building the list in memory. `count` must be the number of rows the
+    iterable will yield (it is written first, as in the original format).
+    Returns (rows_written, bytes_written).
+    """
+    head = b'{"count":%d,"items":[' % int(count)
+    out.write(head)
+    written, nbytes, buf = 0, len(head), []
+    for r in rows:
+        buf.append(_ENC.encode(row_to_item(r)))
+        written += 1
+        if on_row is not None:
+            on_row(r)
+        if len(buf) >= chunk_rows:
+            piece = ((b"," if written > len(buf) else b"") + ",".join(buf).encode("utf-8"))
+            out.write(piece); nbytes += len(piece); buf = []
+    if buf:
+        piece = ((b"," if written > len(buf) else b"") + ",".join(buf).encode("utf-8"))
+        out.write(piece); nbytes += len(piece)
+    out.write(b"]}")
+    nbytes += 2
+    if written != count:
+        raise RuntimeError(f"dump row count changed while streaming ({written} != {count})")
+    return written, nbytes
+
+
+def spool() -> BinaryIO:
+    return tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, mode="w+b")
+
+
+def b64_stream(src: BinaryIO, out: BinaryIO):
+    """base64-encode src into out chunk by chunk."""
+    src.seek(0)
+    while True:
+        chunk = src.read(_B64_CHUNK)
+        if not chunk:
+            break
+        out.write(base64.b64encode(chunk))
+
+
+def write_ndjson_gz_dump(rows: Iterable, count: int, out: BinaryIO, device: Optional[str] = None,
+                         chunk_rows: int = 1000, on_row: Callable[[object], None] = None,
+                         to_item: Callable[[object], Dict[str, Any]] = row_to_item,
+                         header: Optional[Dict[str, Any]] = None) -> Tuple[int, int]:
+    """
+    Version 2 dump: gzip'd NDJSON. The first line is a header
+    `{"format":"psp-dump","version":2,"count":N,"device":...}` (plus any
+    `header` fields), then one item per line, the same shape as the version 1
+    items. Streamed through one compressobj, so memory stays flat.
+    Returns (rows_written, compressed_bytes).
+    """
+    z = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    nbytes = 0
+
+    def emit(data: bytes):
+        nonlocal nbytes
+        piece = z.compress(data)
+        if piece:
+            out.write(piece); nbytes += len(piece)
+
+    head = {"format": "psp-dump", "version": 2, "count": int(count), "device": device, **(header or {})}
+    emit(_ENC.encode(head).encode("utf-8") + b"\n")
+    written, buf = 0, []
+    for r in rows:
+        buf.append(_ENC.encode(to_item(r)))
+        written += 1
+        if on_row is not None:
+            on_row(r)
+        if len(buf) >= chunk_rows:
+            emit(("\n".join(buf) + "\n").encode("utf-8")); buf = []
+    if buf:
+        emit(("\n".join(buf) + "\n").encode("utf-8"))
+    tail = z.flush()
+    out.write(tail); nbytes += len(tail)
+    if written != count:
+        raise RuntimeError(f"dump row count changed while streaming ({written} != {count})")
+    return written, nbytes
+
+
+def write_dump(fmt: str, rows: Iterable, count: int, out: BinaryIO, device: Optional[str] = None) -> Dict[str, Any]:
+    """Write one dump file in fmt (see DUMP_FORMATS); returns its manifest entry."""
+    if fmt not in DUMP_FORMATS:
+        raise ValueError(f"DUMP_FORMAT must be one of {', '.join(DUMP_FORMATS)}")
+    span = {"ts": [None, None], "id": [None, None]}
+
+    def seen(r):
+        for key, v in (("ts", r["ts_us"]), ("id", r["id"])):
+            lo, hi = span[key]
+            span[key] = [v if lo is None or v < lo else lo, v if hi is None or v > hi else hi]
+
+    if fmt == "json":
+        n, nbytes = write_json_dump(rows, count, out, on_row=seen)
+    else:
+        n, nbytes = write_ndjson_gz_dump(rows, count, out, device, on_row=seen)
+    lo, hi = span["ts"]
+    return {"format": fmt, "version": DUMP_FORMATS[fmt][1], "device": device, "count": n, "bytes": nbytes,
+            "sha256": file_sha256(out), "ts_from": us_to_iso(lo) if n else None, "ts_to": us_to_iso(hi) if n else None,
+            "id_from": span["id"][0], "id_to": span["id"][1]}
+
+
+def file_sha256(f: BinaryIO) -> str:
+    f.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: f.read(1 << 16), b""):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_dump(data: bytes) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Any dump file's bytes (v1 JSON, or v2 gzip'd NDJSON) → (v2 header or None, items)."""
+    if data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    text = data.decode("utf-8")
+    first, _, rest = text.lstrip().partition("\n")
+    head = json.loads(first)
+    if isinstance(head, dict) and head.get("format") == "psp-dump":
+        items = [json.loads(line) for line in rest.splitlines() if line.strip()]
+        if head.get("count") is not None and head["count"] != len(items):
+            raise ValueError(f"dump header says {head['count']} rows, file has {len(items)}")
+        return head, items
+    obj = head if not rest.strip() else json.loads(text)
+    return None, (obj["items"] if isinstance(obj, dict) else obj)
+
+
+def manifest_path(day: str) -> str:
+    """Manifest of the dumps labelled YYYYMMDD, relative to the dump folder."""
+    return f"manifests/{day[:4]}-{day[4:6]}-{day[6:8]}.json"
+
+
+def merge_manifest(current: Optional[bytes], entries: Dict[str, Dict[str, Any]], drop: Sequence[str] = ()) -> bytes:
+    """
+    Add entries ({path: manifest entry}) to a manifest file's bytes and
+    remove the paths in drop. The manifest is `{"version":1,"files":{path: entry}}`,
+    written one file per line so each commit's diff shows just the new dumps.
+    """
+    files = dict(json.loads(current)["files"]) if current else {}
+    for path in drop:
+        files.pop(path, None)
+    files.update(entries)
+    lines = [f"{json.dumps(k)}:{_ENC.encode(v)}" for k, v in sorted(files.items())]
+    return ('{"version":1,"files":{\n' + ",\n".join(lines) + "\n}}\n").encode("utf-8")
@@ -0,0 +1,86 @@
+# server/dump_policy.py
+import random
+import time
+from typing import Any, Dict, Optional
+
+
+class DumpPolicy:
+    """
+    When the leader's auto-dump should fire: on whichever comes first of
+      rows      pending rows >= max_rows
+      bytes     estimated payload >= max_bytes (pending rows × the bytes per
+                row the recent dumps actually produced)
+      age       rows have been waiting for max_age_s
+    but never sooner than min_interval_s after the previous dump. After a
+    failure it waits a full-jitter exponential backoff (uniform in
+    [0, min(backoff_max_s, backoff_s · 2^failures)]) so retries from a
+    restarted fleet do not arrive in lockstep. A 0 threshold is off.
+    """
+
+    def __init__(self, max_rows: int = 0, max_bytes: int = 0, max_age_s: float = 60, min_interval_s: float = 5,
+                 backoff_s: float = 5, backoff_max_s: float = 600, bytes_per_row: float = 40):
+        self.max_rows, self.max_bytes, self.max_age_s = int(max_rows), int(max_bytes), float(max_age_s)
+        self.min_interval_s, self.backoff_s, self.backoff_max_s = float(min_interval_s), float(backoff_s), float(backoff_max_s)
+        self.bytes_per_row = float(bytes_per_row)
+        self.pending_since: Optional[float] = None
+        self.last_dump: Optional[float] = None
+        self.failures = 0
+        self.retry_at = 0.0
+        self.last_reason: Optional[str] = None
+
+    def configure(self, max_rows: Optional[int] = None, max_bytes: Optional[int] = None, max_age_s: Optional[float] = None):
+        if max_rows is not None: self.max_rows = max(0, int(max_rows))
+        if max_bytes is not None: self.max_bytes = max(0, int(max_bytes))
+        if max_age_s is not None: self.max_age_s = max(1.0, float(max_age_s))
+
+    def due(self, pending_rows: int, now: Optional[float] = None) -> Optional[str]:
+        """The trigger that fires now ('rows', 'bytes' or 'age'), or None."""
+        now = time.time() if now is None else now
+        if pending_rows <= 0:
+            self.pending_since = None
+            return None
+        if self.pending_since is None:
+            self.pending_since = now
+        if now < self.retry_at or (self.last_dump is not None and now - self.last_dump < self.min_interval_s):
+            return None
+        if self.max_rows and pending_rows >= self.max_rows:
+            return "rows"
+        if self.max_bytes and pending_rows * self.bytes_per_row >= self.max_bytes:
+            return "bytes"
+        if now - self.pending_since >= self.max_age_s:
+            return "age"
+        return None
+
+    def succeeded(self, rows: int = 0, nbytes: int = 0, now: Optional[float] = None):
+        self.last_dump = time.time() if now is None else now
+        self.failures, self.retry_at, self.pending_since = 0, 0.0, None
+        if rows > 0 and nbytes > 0:
+            # Moving average, so the byte trigger follows the format and compressibility in use
+            self.bytes_per_row = 0.7 * self.bytes_per_row + 0.3 * (nbytes / rows)
+
+    def observe(self, when: float, ok: bool):
+        """
+        Fold in a dump some other worker ran (a manual /api/dump-now, say),
+        read from the shared state: its rows are gone from the pending count,
+        so the age clock restarts, and a success clears any backoff.
+        """
+        if self.last_dump is not None and when <= self.last_dump:
+            return
+        self.last_dump = when
+        if ok:
+            self.failures, self.retry_at, self.pending_since = 0, 0.0, None
+
+    def failed(self, now: Optional[float] = None) -> float:
+        """Record a failure; returns the backoff chosen (seconds)."""
+        now = time.time() if now is None else now
+        self.failures += 1
+        wait = random.uniform(0, min(self.backoff_max_s, self.backoff_s * 2 ** self.failures))
+        self.last_dump, self.retry_at = now, now + wait
+        return wait
+
+    def stats(self) -> Dict[str, Any]:
+        return {"max_rows": self.max_rows, "max_bytes": self.max_bytes, "max_age_s": self.max_age_s,
+                "min_interval_s": self.min_interval_s, "bytes_per_row": round(self.bytes_per_row, 1),
+                "failures": self.failures, "retry_in_s": round(max(0.0, self.retry_at - time.time()), 1),
+                "pending_for_s": round(time.time() - self.pending_since, 1) if self.pending_since else 0,
+                "last_reason": self.last_reason}
@@ -0,0 +1,105 @@
+# server/exporters.py
+import csv
+import io
+import json
+from typing import Iterable, Iterator
+
+from dump_format import spool
+from schema import FSR_COUNT, row_to_item, us_to_iso
+
+_ENC = json.JSONEncoder(separators=(",", ":"))
+CSV_HEADER = ["ts"] + [f"fsr{i}" for i in range(1, FSR_COUNT + 1)] + ["t1_c", "t2_c", "volume", "device"]
+
+# format → (mimetype, file extension)
+FORMATS = {
+    "json": ("application/json", "json"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def _chunks(rows: Iterable, size: int) -> Iterator[list]:
+    buf = []
+    for r in rows:
+        buf.append(r)
+        if len(buf) >= size:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+
+def iter_json(rows: Iterable, batch: int = 1000) -> Iterator[bytes]:
+    """`{"items":[...],"count":N}`: same keys as before, count last so nothing is buffered."""
+    yield b'{"items":['
+    n = 0
+    for chunk in _chunks(rows, batch):
+        body = ",".join(_ENC.encode(row_to_item(r)) for r in chunk).encode("utf-8")
+        yield (b"," + body) if n else body
+        n += len(chunk)
+    yield b'],"count":%d}' % n
+
+
+def iter_ndjson(rows: Iterable, batch: int = 1000) -> Iterator[bytes]:
+    for chunk in _chunks(rows, batch):
+        yield "".join(_ENC.encode(row_to_item(r)) + "\n" for r in chunk).encode("utf-8")
+
+
+def iter_csv(rows: Iterable, batch: int = 1000) -> Iterator[bytes]:
+    buf = io.StringIO()
+    w = csv.writer(buf, lineterminator="\n")
+    w.writerow(CSV_HEADER)
+    for chunk in _chunks(rows, batch):
+        for r in chunk:
+            w.writerow([us_to_iso(r["ts_us"]), *r["fsr"], r["t1_c"], r["t2_c"], r["volume"], r["device"]])
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0); buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def iter_parquet(rows: Iterable, batch: int = 50000) -> Iterator[bytes]:
+    """
+    Parquet needs its footer written last, so row groups go to a spooled temp
+    file first and the file is streamed out afterwards. ts is kept as a UTC
+    microsecond timestamp, each FSR channel as uint8 and the device id
+    dictionary-encoded.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([("ts", pa.timestamp("us", tz="UTC"))]
+                       + [(f"fsr{i}", pa.uint8()) for i in range(1, FSR_COUNT + 1)]
+                       + [("t1_c", pa.float32()), ("t2_c", pa.float32()), ("volume", pa.uint8()),
+                          ("device", pa.dictionary(pa.int16(), pa.string()))])
+    with spool() as out:
+        writer = pq.ParquetWriter(out, schema, compression="zstd")
+        try:
+            for chunk in _chunks(rows, batch):
+                fsr = [bytes(r["fsr"]) for r in chunk]
+                cols = [pa.array([r["ts_us"] for r in chunk], type=pa.timestamp("us", tz="UTC"))]
+                cols += [pa.array([b[i] for b in fsr], type=pa.uint8()) for i in range(FSR_COUNT)]
+                cols += [pa.array([r["t1_c"] for r in chunk], type=pa.float32()),
+                         pa.array([r["t2_c"] for r in chunk], type=pa.float32()),
+                         pa.array([r["volume"] for r in chunk], type=pa.uint8()),
+                         pa.array([r["device"] for r in chunk], type=pa.string()).dictionary_encode().cast(
+                             pa.dictionary(pa.int16(), pa.string()))]
+                writer.write_table(pa.Table.from_arrays(cols, schema=schema))
+        finally:
+            writer.close()
+        out.seek(0)
+        while True:
+            piece = out.read(256 * 1024)
+            if not piece:
+                break
+            yield piece
@@ -0,0 +1,309 @@
+# server/fake_github.py
+"""
+In-memory stand-in for the slice of the GitHub REST API the server uses
+(git refs/commits/trees/blobs and the contents API), for testing dumps
+without a token or network:
+
+    python fake_github.py --port 8765 [--fail-every 7] [--rate-limit 100]
+    GITHUB_API_URL=http://127.0.0.1:8765 GITHUB_TOKEN=x python app.py
+
+`--fail-every N` answers every Nth call with 502 and `--rate-limit N` allows
+N calls per 2 s window (then 403 with X-RateLimit-Remaining: 0), so retry and
+backoff paths can be exercised. GET /_fake/stats reports calls per route,
+commits and distinct client connections.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+
+def _sha(kind: str, data: bytes) -> str:
+    return hashlib.sha1(b"%s %d\0" % (kind.encode(), len(data)) + data).hexdigest()
+
+
+class FakeRepo:
+    """Objects and refs of one repository. Trees are kept flat: {path: blob_sha}."""
+
+    def __init__(self, branch: str = "main"):
+        self.lock = threading.Lock()
+        self.blobs: Dict[str, bytes] = {}
+        self.trees: Dict[str, Dict[str, str]] = {}
+        self.commits: Dict[str, dict] = {}
+        root = self.put_tree({})
+        self.refs = {branch: self.put_commit("initial", root, [])}
+
+    def put_blob(self, data: bytes) -> str:
+        sha = _sha("blob", data)
+        self.blobs[sha] = data
+        return sha
+
+    def put_tree(self, flat: Dict[str, str]) -> str:
+        sha = _sha("tree", json.dumps(sorted(flat.items())).encode())
+        self.trees[sha] = dict(flat)
+        return sha
+
+    def put_commit(self, message: str, tree: str, parents: list) -> str:
+        sha = _sha("commit", json.dumps([message, tree, parents, time.time()]).encode())
+        self.commits[sha] = {"message": message, "tree": tree, "parents": list(parents)}
+        return sha
+
+    def head_tree(self, branch: str) -> Dict[str, str]:
+        return self.trees[self.commits[self.refs[branch]]["tree"]]
+
+    def commit_files(self, branch: str, message: str, changes: Dict[str, Optional[str]]) -> str:
+        flat = dict(self.head_tree(branch))
+        for path, sha in changes.items():
+            if sha is None:
+                flat.pop(path, None)
+            else:
+                flat[path] = sha
+        sha = self.put_commit(message, self.put_tree(flat), [self.refs[branch]])
+        self.refs[branch] = sha
+        return sha
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, so connection pooling is visible in /_fake/stats
+    server: "FakeGitHub"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code: int, body=None, headers: Optional[dict] = None, raw: Optional[bytes] = None):
+        ctype = "application/octet-stream" if raw is not None else "application/json"
+        raw = raw if raw is not None else json.dumps(body if body is not None else {}).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(raw)))
+        for k, v in {**self.server.rate_headers(), **(headers or {})}.items():
+            self.send_header(k, str(v))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _body(self) -> dict:
+        n = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(n) or b"{}") if n else {}
+
+    def _dispatch(self, method: str):
+        fake = self.server
+        path, _, query = self.path.partition("?")
+        body = self._body() if method in ("POST", "PATCH", "PUT", "DELETE") else {}
+        if path == "/_fake/stats":
+            return self._send(200, fake.stats())
+        route = re.sub(r"^/repos/[^/]+/[^/]+/", "", path)
+        fault = fake.fault(method, route)
+        if fault:
+            return self._send(*fault)
+        repo = fake.repo
+        with repo.lock:
+            m = re.fullmatch(r"git/refs?/heads/(.+)", route)
+            if m:
+                branch = m.group(1)
+                if branch not in repo.refs:
+                    return self._send(404, {"message": "Not Found"})
+                if method == "GET":
+                    return self._send(200, {"ref": f"refs/heads/{branch}", "object": {"sha": repo.refs[branch], "type": "commit"}})
+                if method == "PATCH":
+                    new = body.get("sha")
+                    if new not in repo.commits:
+                        return self._send(422, {"message": "Object does not exist"})
+                    if not body.get("force") and repo.refs[branch] not in repo.commits[new]["parents"]:
+                        return self._send(422, {"message": "Update is not a fast forward"})
+                    repo.refs[branch] = new
+                    fake.commits += 1
+                    return self._send(200, {"ref": f"refs/heads/{branch}", "object": {"sha": new, "type": "commit"}})
+            m = re.fullmatch(r"git/commits(?:/([0-9a-f]+))?", route)
+            if m and method == "GET" and m.group(1) in repo.commits:
+                c = repo.commits[m.group(1)]
+                return self._send(200, {"sha": m.group(1), "message": c["message"], "tree": {"sha": c["tree"]},
+                                        "parents": [{"sha": p} for p in c["parents"]]})
+            if m and method == "POST":
+                if body.get("tree") not in repo.trees:
+                    return self._send(422, {"message": "Tree does not exist"})
+                return self._send(201, {"sha": repo.put_commit(body.get("message", ""), body["tree"], body.get("parents", []))})
+            if route == "git/blobs" and method == "POST":
+                data = base64.b64decode(body["content"]) if body.get("encoding") == "base64" else body["content"].encode()
+                return self._send(201, {"sha": repo.put_blob(data)})
+            m = re.fullmatch(r"git/blobs/([0-9a-f]+)", route)
+            if m and method == "GET" and m.group(1) in repo.blobs:
+                data = repo.blobs[m.group(1)]
+                if "raw" in (self.headers.get("Accept") or ""):
+                    return self._send(200, raw=data)
+                return self._send(200, {"sha": m.group(1), "size": len(data), "encoding": "base64",
+                                        "content": base64.b64encode(data).decode()})
+            if route == "git/trees" and method == "POST":
+                return self._post_tree(repo, body)
+            m = re.fullmatch(r"git/trees/([0-9a-f]+)", route)
+            if m and method == "GET" and m.group(1) in repo.trees:
+                flat = repo.trees[m.group(1)]
+                listing = self._listing(flat) if "recursive" in query else self._children(repo, flat)
+                return self._send(200, {"sha": m.group(1), "tree": listing, "truncated": False})
+            m = re.fullmatch(r"contents/(.+)", route)
+            if m:
+                return self._contents(repo, method, m.group(1), body, query)
+        return self._send(404, {"message": "Not Found"})
+
+    def _post_tree(self, repo: FakeRepo, body: dict):
+        base = body.get("base_tree")
+        if base is not None and base not in repo.trees:
+            return self._send(422, {"message": "base_tree does not exist"})
+        flat = dict(repo.trees[base]) if base else {}
+        for e in body.get("tree", []):
+            p = e["path"].strip("/")
+            if "content" in e:
+                flat[p] = repo.put_blob(e["content"].encode())
+            elif e.get("sha") is None:
+                # Deleting a file, or a whole folder when the entry is a tree
+                for k in [k for k in flat if k == p or k.startswith(p + "/")]:
+                    del flat[k]
+            elif e.get("type") == "tree":
+                for k, v in repo.trees[e["sha"]].items():
+                    flat[f"{p}/{k}"] = v
+            else:
+                if e["sha"] not in repo.blobs:
+                    return self._send(422, {"message": f"blob {e['sha']} does not exist"})
+                flat[p] = e["sha"]
+        sha = repo.put_tree(flat)
+        return self._send(201, {"sha": sha, "tree": self._listing(flat)})
+
+    @staticmethod
+    def _listing(flat: Dict[str, str]) -> list:
+        dirs = sorted({"/".join(p.split("/")[:i]) for p in flat for i in range(1, p.count("/") + 1)})
+        return ([{"path": d, "mode": "040000", "type": "tree"} for d in dirs]
+                + [{"path": p, "mode": "100644", "type": "blob", "sha": s} for p, s in sorted(flat.items())])
+
+    @staticmethod
+    def _children(repo: FakeRepo, flat: Dict[str, str]) -> list:
+        # One level, with each folder stored as a tree of its own so it can be listed next
+        subs: Dict[str, Dict[str, str]] = {}
+        out = []
+        for p, s in sorted(flat.items()):
+            head, sep, rest = p.partition("/")
+            if sep:
+                subs.setdefault(head, {})[rest] = s
+            else:
+                out.append({"path": p, "mode": "100644", "type": "blob", "sha": s})
+        return out + [{"path": d, "mode": "040000", "type": "tree", "sha": repo.put_tree(sub)} for d, sub in sorted(subs.items())]
+
+    def _contents(self, repo: FakeRepo, method: str, path: str, body: dict, query: str):
+        branch = body.get("branch") or dict(q.split("=", 1) for q in query.split("&") if "=" in q).get("ref") or next(iter(repo.refs))
+        flat = repo.head_tree(branch)
+        if method == "GET":
+            if path in flat and "raw" in (self.headers.get("Accept") or ""):
+                return self._send(200, raw=repo.blobs[flat[path]])
+            if path in flat:
+                data = repo.blobs[flat[path]]
+                return self._send(200, {"type": "file", "path": path, "sha": flat[path], "size": len(data),
+                                        "encoding": "base64", "content": base64.b64encode(data).decode()})
+            kids = sorted({path + "/" + k[len(path) + 1:].split("/")[0] for k in flat if k.startswith(path + "/")})
+            if not kids:
+                return self._send(404, {"message": "Not Found"})
+            return self._send(200, [{"type": "file" if k in flat else "dir", "path": k, "sha": flat.get(k)} for k in kids])
+        if method == "PUT":
+            if path in flat and body.get("sha") != flat[path]:
+                return self._send(422, {"message": "sha wasn't supplied or does not match"})
+            sha = repo.put_blob(base64.b64decode(body["content"]))
+            commit = repo.commit_files(branch, body.get("message", ""), {path: sha})
+            self.server.commits += 1
+            return self._send(201, {"content": {"path": path, "sha": sha}, "commit": {"sha": commit}})
+        if method == "DELETE":
+            if flat.get(path) != body.get("sha"):
+                return self._send(409 if path in flat else 404, {"message": "sha does not match"})
+            commit = repo.commit_files(branch, body.get("message", ""), {path: None})
+            self.server.commits += 1
+            return self._send(200, {"commit": {"sha": commit}})
+        return self._send(405, {"message": "Method not allowed"})
+
+    def _count_connection(self):
+        self.server.connections.add(self.client_address)
+
+    def do_GET(self):
+        self._count_connection(); self._dispatch("GET")
+
+    def do_POST(self):
+        self._count_connection(); self._dispatch("POST")
+
+    def do_PATCH(self):
+        self._count_connection(); self._dispatch("PATCH")
+
+    def do_PUT(self):
+        self._count_connection(); self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._count_connection(); self._dispatch("DELETE")
+
+
+class FakeGitHub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr: Tuple[str, int], branch: str = "main", fail_every: int = 0, rate_limit: int = 0,
+                 rate_window_s: float = 2.0):
+        super().__init__(addr, Handler)
+        self.repo = FakeRepo(branch)
+        self.fail_every, self.rate_limit, self.rate_window_s = int(fail_every), int(rate_limit), float(rate_window_s)
+        self._lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+        self.total = 0
+        self.commits = 0
+        self.connections: set = set()
+        self._window = (time.time(), 0)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def rate_headers(self) -> dict:
+        start, used = self._window
+        if not self.rate_limit:
+            return {"X-RateLimit-Limit": 5000, "X-RateLimit-Remaining": 4999, "X-RateLimit-Reset": int(time.time()) + 3600}
+        return {"X-RateLimit-Limit": self.rate_limit, "X-RateLimit-Remaining": max(0, self.rate_limit - used),
+                "X-RateLimit-Reset": round(start + self.rate_window_s, 3)}
+
+    def fault(self, method: str, route: str) -> Optional[tuple]:
+        key = f"{method} " + re.sub(r"[0-9a-f]{40}", ":sha", route)
+        with self._lock:
+            self.total += 1
+            self.calls[key] = self.calls.get(key, 0) + 1
+            if self.fail_every and self.total % self.fail_every == 0:
+                return 502, {"message": "Server Error (injected)"}
+            if self.rate_limit:
+                start, used = self._window
+                if time.time() - start >= self.rate_window_s:
+                    start, used = time.time(), 0
+                self._window = (start, used + 1)
+                if used >= self.rate_limit:
+                    return 403, {"message": "API rate limit exceeded"}
+        return None
+
+    def stats(self) -> dict:
+        return {"calls": self.total, "by_route": self.calls, "commits": self.commits,
+                "connections": len(self.connections), "files": len(self.repo.head_tree(next(iter(self.repo.refs))))}
+
+
+def start(port: int = 0, **kw) -> FakeGitHub:
+    """Serve on a background thread (port 0 picks a free one); use .url and .shutdown()."""
+    srv = FakeGitHub(("127.0.0.1", port), **kw)
+    threading.Thread(target=srv.serve_forever, name="fake-github", daemon=True).start()
+    return srv
+
+
+def main():
+    ap = argparse.ArgumentParser(description="In-memory fake of the GitHub git data + contents API")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--branch", default="main")
+    ap.add_argument("--fail-every", type=int, default=0, help="answer every Nth call with 502")
+    ap.add_argument("--rate-limit", type=int, default=0, help="calls allowed per 2 s window")
+    args = ap.parse_args()
+    srv = FakeGitHub(("127.0.0.1", args.port), branch=args.branch, fail_every=args.fail_every, rate_limit=args.rate_limit)
+    print(f"[fake-github] serving {srv.url}", flush=True)
+    srv.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# server/fake_s3.py
+"""
+In-memory stand-in for an S3-compatible object store (path-style
+GET/PUT/HEAD/DELETE of /<bucket>/<key>, SigV4-checked), for testing the s3
+dump sink without MinIO or AWS:
+
+    python fake_s3.py --port 9000 [--delay-ms 2000] [--fail-every 5]
+    DUMP_SINKS=github,s3 DUMP_S3_ENDPOINT=http://127.0.0.1:9000 DUMP_S3_BUCKET=psp \
+    DUMP_S3_ACCESS_KEY=fake DUMP_S3_SECRET_KEY=fake python app.py
+
+Requests must be signed with the --access-key/--secret-key pair and carry a
+body matching x-amz-content-sha256. `--delay-ms` makes every call slow and
+`--fail-every N` answers every Nth call with 503, so a lagging or failing
+remote can be exercised. GET /_fake/stats reports calls and stored objects.
+"""
+import argparse
+import hashlib
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+from sinks import sigv4_headers
+
+
+def _error(code: str, message: str) -> bytes:
+    return f"<?xml version=\"1.0\"?><Error><Code>{code}</Code><Message>{message}</Message></Error>".encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "FakeS3"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code: int, body: bytes = b"", ctype: str = "application/xml"):
+        self.send_response(code)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _authorized(self, body: bytes) -> bool:
+        auth = self.headers.get("Authorization") or ""
+        sha = self.headers.get("x-amz-content-sha256") or ""
+        if not auth.startswith("AWS4-HMAC-SHA256 ") or sha != hashlib.sha256(body).hexdigest():
+            return False
+        try:
+            fields = dict(p.strip().split("=", 1) for p in auth[len("AWS4-HMAC-SHA256 "):].split(","))
+            _, day, region, _, _ = fields["Credential"].split("/")
+            now = time.strptime(self.headers["x-amz-date"], "%Y%m%dT%H%M%SZ")
+        except (KeyError, ValueError):
+            return False
+        signed = {k: self.headers[k] for k in fields["SignedHeaders"].split(";") if k not in ("host", "x-amz-date", "x-amz-content-sha256")}
+        expect = sigv4_headers(self.command, f"http://{self.headers['Host']}{self.path}", signed, sha,
+                               self.server.access_key, self.server.secret_key, region,
+                               now=datetime(*now[:6], tzinfo=timezone.utc))
+        return expect["Authorization"] == auth
+
+    def _handle(self):
+        fake = self.server
+        path = urllib.parse.urlsplit(self.path).path
+        n = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(n) if n else b""
+        if path == "/_fake/stats":
+            return self._send(200, repr(fake.stats()).encode(), "text/plain")
+        if fake.delay_s:
+            time.sleep(fake.delay_s)
+        with fake.lock:
+            fake.total += 1
+            fake.calls[self.command] = fake.calls.get(self.command, 0) + 1
+            if fake.fail_every and fake.total % fake.fail_every == 0:
+                return self._send(503, _error("SlowDown", "injected failure"))
+        if not self._authorized(body):
+            return self._send(403, _error("SignatureDoesNotMatch", "bad or missing SigV4 signature"))
+        key = urllib.parse.unquote(path.lstrip("/"))
+        with fake.lock:
+            if self.command == "PUT":
+                fake.objects[key] = body
+                return self._send(200)
+            if self.command in ("GET", "HEAD"):
+                if key not in fake.objects:
+                    return self._send(404, _error("NoSuchKey", key))
+                return self._send(200, fake.objects[key], "application/octet-stream")
+            if self.command == "DELETE":
+                fake.objects.pop(key, None)
+                return self._send(204)
+        return self._send(405, _error("MethodNotAllowed", self.command))
+
+    do_GET = do_PUT = do_HEAD = do_DELETE = _handle
+
+
+class FakeS3(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr: Tuple[str, int], access_key: str = "fake", secret_key: str = "fake",
+                 delay_ms: int = 0, fail_every: int = 0):
+        super().__init__(addr, Handler)
+        self.access_key, self.secret_key = access_key, secret_key
+        self.delay_s, self.fail_every = delay_ms / 1000.0, int(fail_every)
+        self.lock = threading.Lock()
+        self.objects: Dict[str, bytes] = {}   # "<bucket>/<key>" → bytes
+        self.calls: Dict[str, int] = {}
+        self.total = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def stats(self) -> dict:
+        return {"calls": self.total, "by_method": self.calls, "objects": len(self.objects)}
+
+
+def start(port: int = 0, **kw) -> FakeS3:
+    """Serve on a background thread (port 0 picks a free one); use .url and .shutdown()."""
+    srv = FakeS3(("127.0.0.1", port), **kw)
+    threading.Thread(target=srv.serve_forever, name="fake-s3", daemon=True).start()
+    return srv
+
+
+def main():
+    ap = argparse.ArgumentParser(description="In-memory fake of an S3-compatible object store")
+    ap.add_argument("--port", type=int, default=9000)
+    ap.add_argument("--access-key", default="fake")
+    ap.add_argument("--secret-key", default="fake")
+    ap.add_argument("--delay-ms", type=int, default=0, help="sleep this long before every answer")
+    ap.add_argument("--fail-every", type=int, default=0, help="answer every Nth call with 503")
+    args = ap.parse_args()
+    srv = FakeS3(("127.0.0.1", args.port), access_key=args.access_key, secret_key=args.secret_key,
+                 delay_ms=args.delay_ms, fail_every=args.fail_every)
+    print(f"[fake-s3] serving {srv.url}", flush=True)
+    srv.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
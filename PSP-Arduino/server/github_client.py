@@ -0,0 +1,229 @@
+# server/github_client.py
+import base64
+import os
+import threading
+import time
+import urllib.parse
+from typing import Any, BinaryIO, Dict, List, Optional, Sequence, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from dump_format import b64_stream, spool
+
+# --- Configuration via environment variables ---
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com").rstrip("/")   # point at fake_github.py to test
+GITHUB_RETRIES = int(os.getenv("GITHUB_RETRIES", "4"))
+GITHUB_BACKOFF_S = float(os.getenv("GITHUB_BACKOFF_S", "1"))
+GITHUB_MAX_WAIT_S = float(os.getenv("GITHUB_MAX_WAIT_S", "60"))   # longest rate-limit sleep before failing
+GITHUB_POOL = int(os.getenv("GITHUB_POOL", "8"))
+GITHUB_TIMEOUT_S = float(os.getenv("GITHUB_TIMEOUT_S", "30"))
+
+_RETRY_STATUS = (500, 502, 503, 504)
+
+
+class GitHubError(RuntimeError):
+    def __init__(self, what: str, resp: requests.Response):
+        self.status = resp.status_code
+        super().__init__(f"{what} failed {resp.status_code}: {resp.text[:300]}")
+
+
+class GitHubClient:
+    """
+    GitHub REST client on one pooled requests.Session (keep-alive, so a dump
+    does not pay a TLS handshake per call). Connection errors and 5xx are
+    retried with exponential backoff. When the rate limit is spent, or GitHub
+    answers 403/429 with Retry-After, it sleeps until the reset (up to
+    max_wait_s) instead of failing.
+
+    Uploads use the Git Data API: one blob per file, then a single
+    tree + commit + ref update for any number of files (commit_changes).
+    The contents API needs one commit per file.
+    """
+
+    def __init__(self, token: str, repo: str, branch: str, api: str = GITHUB_API_URL,
+                 retries: int = GITHUB_RETRIES, backoff_s: float = GITHUB_BACKOFF_S,
+                 max_wait_s: float = GITHUB_MAX_WAIT_S, pool: int = GITHUB_POOL, timeout_s: float = GITHUB_TIMEOUT_S):
+        self.token, self.repo, self.branch, self.api = token, repo, branch, api.rstrip("/")
+        self.retries, self.backoff_s, self.max_wait_s, self.timeout_s = int(retries), float(backoff_s), float(max_wait_s), float(timeout_s)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(1, int(pool)))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retried = 0
+        self.rate_remaining: Optional[int] = None
+        self.rate_reset: Optional[float] = None
+
+    def configure(self, token: str, repo: str, branch: str):
+        """Follow runtime changes from /api/dump-config."""
+        self.token, self.repo, self.branch = token, repo, branch
+
+    # ---------- transport ----------
+    def _headers(self) -> Dict[str, str]:
+        if not self.token:
+            raise RuntimeError("Missing GITHUB_TOKEN")
+        return {"Authorization": f"token {self.token}", "Accept": "application/vnd.github+json",
+                "User-Agent": "psp-arduino-app"}
+
+    def _track(self, r: requests.Response):
+        with self._lock:
+            self.calls += 1
+            if "X-RateLimit-Remaining" in r.headers:
+                try:
+                    self.rate_remaining = int(r.headers["X-RateLimit-Remaining"])
+                    self.rate_reset = float(r.headers.get("X-RateLimit-Reset") or 0) or None
+                except ValueError:
+                    pass
+
+    def _rate_wait(self, r: Optional[requests.Response] = None) -> float:
+        """Seconds until the rate limit allows another call (0 if it already does)."""
+        if r is not None and r.headers.get("Retry-After"):
+            try:
+                return float(r.headers["Retry-After"])
+            except ValueError:
+                pass
+        if self.rate_remaining == 0 and self.rate_reset:
+            return max(0.0, self.rate_reset - time.time() + 1)
+        return 0.0
+
+    def _retry_wait(self, r: requests.Response, attempt: int) -> Optional[float]:
+        if r.status_code == 429 or (r.status_code == 403 and (r.headers.get("Retry-After") or self.rate_remaining == 0
+                                                             or "rate limit" in r.text.lower())):
+            wait = self._rate_wait(r) or self.backoff_s * 2 ** attempt
+            return wait if wait <= self.max_wait_s else None
+        if r.status_code in _RETRY_STATUS:
+            return self.backoff_s * 2 ** attempt
+        return None
+
+    def request(self, method: str, path: str, what: str, ok: Sequence[int] = (200, 201), **kw) -> requests.Response:
+        """One API call under /repos/<repo>/, with retries; raises GitHubError unless the status is in ok."""
+        url = f"{self.api}/repos/{self.repo}/{path}"
+        headers = {**self._headers(), **kw.pop("headers", {})}
+        body = kw.get("data")
+        for attempt in range(self.retries + 1):
+            wait = self._rate_wait()
+            if wait:
+                if wait > self.max_wait_s:
+                    raise RuntimeError(f"{what}: GitHub rate limit exhausted for {int(wait)}s")
+                time.sleep(wait)
+            if hasattr(body, "seek"):
+                body.seek(0)
+            try:
+                r = self.session.request(method, url, headers=headers, timeout=self.timeout_s, **kw)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                self.retried += 1
+                time.sleep(self.backoff_s * 2 ** attempt)
+                continue
+            self._track(r)
+            if r.status_code in ok:
+                return r
+            wait = self._retry_wait(r, attempt)
+            if wait is None or attempt == self.retries:
+                raise GitHubError(what, r)
+            self.retried += 1
+            time.sleep(wait)
+        raise RuntimeError(f"{what}: retries exhausted")
+
+    # ---------- git data ----------
+    def head(self) -> str:
+        """Commit sha the branch points at."""
+        ref = urllib.parse.quote(self.branch)
+        return self.request("GET", f"git/ref/heads/{ref}", "Get ref", ok=(200,)).json()["object"]["sha"]
+
+    def commit_tree(self, commit_sha: str) -> str:
+        return self.request("GET", f"git/commits/{commit_sha}", "Get commit", ok=(200,)).json()["tree"]["sha"]
+
+    def tree(self, sha: str, recursive: bool = True) -> List[Dict[str, Any]]:
+        r = self.request("GET", f"git/trees/{sha}" + ("?recursive=1" if recursive else ""), "Get tree", ok=(200,)).json()
+        if r.get("truncated"):
+            raise RuntimeError("GitHub tree listing truncated; too many files for one recursive call")
+        return r.get("tree", [])
+
+    def read_file(self, path: str) -> Optional[bytes]:
+        """File bytes at the branch head (raw media type, so up to 100 MB), or None if it does not exist."""
+        r = self.request("GET", f"contents/{urllib.parse.quote(path)}?ref={urllib.parse.quote(self.branch)}",
+                         f"Read {path}", ok=(200, 404), headers={"Accept": "application/vnd.github.raw"})
+        return r.content if r.status_code == 200 else None
+
+    def read_blob(self, sha: str) -> bytes:
+        """Blob bytes by sha (e.g. from tree()), raw media type."""
+        return self.request("GET", f"git/blobs/{sha}", "Get blob", ok=(200,),
+                            headers={"Accept": "application/vnd.github.raw"}).content
+
+    def blob(self, content: Union[bytes, bytearray, BinaryIO]) -> str:
+        """Upload bytes or a readable binary file as a blob; file bodies are base64-streamed, not held in memory."""
+        with spool() as body:
+            body.write(b'{"encoding":"base64","content":"')
+            if isinstance(content, (bytes, bytearray)):
+                body.write(base64.b64encode(bytes(content)))
+            else:
+                b64_stream(content, body)
+            body.write(b'"}')
+            r = self.request("POST", "git/blobs", "Create blob", ok=(201,), data=body,
+                             headers={"Content-Type": "application/json"})
+        return r.json()["sha"]
+
+    def blob_shas(self, tree_sha: str, paths: Sequence[str]) -> Dict[str, str]:
+        """Blob sha of each path that exists in the tree, listing only the folders on the way (not recursively)."""
+        listings: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        found = {}
+        for path in paths:
+            sha, parts = tree_sha, path.strip("/").split("/")
+            for i, name in enumerate(parts):
+                if sha not in listings:
+                    listings[sha] = {e["path"]: e for e in self.tree(sha, recursive=False)}
+                e = listings[sha].get(name)
+                if e is None:
+                    break
+                if i == len(parts) - 1:
+                    if e.get("type") == "blob":
+                        found[path] = e["sha"]
+                elif e.get("type") == "tree":
+                    sha = e["sha"]
+                else:
+                    break
+        return found
+
+    def commit_changes(self, changes: Sequence[Tuple[str, Optional[str]]], message: str, attempts: int = 3,
+                       fresh: Sequence[str] = ()) -> str:
+        """
+        One commit for many paths: (path, blob_sha) adds or replaces a file,
+        (path, None) deletes it. Paths in `fresh` are new files: if one already
+        exists with other content the commit is refused (RuntimeError) rather
+        than silently replacing it; the same content is a re-delivery and fine.
+        If the branch moved meanwhile, the tree and commit are rebuilt on the
+        new head (blobs are reused). Returns the new commit sha.
+        """
+        entries = [{"path": p, "mode": "100644", "type": "blob", "sha": s} for p, s in changes]
+        want = {p: s for p, s in changes if p in set(fresh)}
+        for attempt in range(attempts):
+            parent = self.head()
+            base = self.commit_tree(parent)
+            clash = sorted(p for p, s in self.blob_shas(base, list(want)).items() if s != want[p])
+            if clash:
+                raise RuntimeError(f"refusing to overwrite {', '.join(clash)}: already on {self.branch} with other content")
+            tree = self.request("POST", "git/trees", "Create tree", ok=(201,),
+                                json={"base_tree": base, "tree": entries}).json()["sha"]
+            commit = self.request("POST", "git/commits", "Create commit", ok=(201,),
+                                  json={"message": message, "tree": tree, "parents": [parent]}).json()["sha"]
+            try:
+                self.request("PATCH", f"git/refs/heads/{urllib.parse.quote(self.branch)}", "Update ref", ok=(200,),
+                             json={"sha": commit, "force": False})
+                return commit
+            except GitHubError as e:
+                # 422: not a fast-forward (someone else committed); rebuild on the new head
+                if e.status != 422 or attempt == attempts - 1:
+                    raise
+        raise RuntimeError("commit retries exhausted")
+
+    def put_files(self, files: Sequence[Tuple[str, Union[bytes, BinaryIO]]], message: str) -> str:
+        """Upload several files as a single commit."""
+        return self.commit_changes([(path, self.blob(content)) for path, content in files], message)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"calls": self.calls, "retried": self.retried, "rate_remaining": self.rate_remaining,
+                "rate_reset": self.rate_reset}
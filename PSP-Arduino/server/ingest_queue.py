@@ -0,0 +1,199 @@
+# server/ingest_queue.py
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, List, Optional
+
+
+class IngestQueue:
+    """
+    Bounded write-behind buffer for samples.
+
+    Request threads call offer(); a single writer thread drains the buffer in
+    group commits, flushing when `flush_rows` samples are pending or when the
+    oldest pending sample has waited `flush_ms`. A full buffer rejects the
+    offer (the caller answers 503) instead of letting latency grow.
+
+    With `key_fn` the buffer is split into one lane per key (device). Each
+    lane is capped at `lane_max`, and a flush takes rows from the lanes
+    round-robin. A chatty device fills and is refused only its own lane, and
+    every other device still gets its share of each group commit.
+    """
+
+    def __init__(self, write_fn: Callable[[List[Any]], None], *, maxsize: int = 10000,
+                 flush_rows: int = 500, flush_ms: int = 200, name: str = "ingest-writer",
+                 key_fn: Optional[Callable[[Any], Any]] = None, lane_max: Optional[int] = None):
+        self.write_fn = write_fn
+        self.maxsize = max(1, int(maxsize))
+        self.flush_rows = max(1, int(flush_rows))
+        self.flush_s = max(1, int(flush_ms)) / 1000.0
+        self.name = name
+        self.key_fn = key_fn or (lambda item: None)
+        self.lane_max = max(1, int(lane_max)) if lane_max else self.maxsize
+
+        self._lanes: "OrderedDict[Any, deque]" = OrderedDict()
+        self._size = 0
+        self._cond = threading.Condition()
+        self._oldest: Optional[float] = None
+        self._inflight = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = False
+
+        self.accepted = 0
+        self.rejected = 0
+        self.written = 0
+        self.flushes = 0
+        self.errors = 0
+        self.high_water = 0
+        self.last_flush_rows = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self.last_error: Optional[str] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def offer(self, items: List[Any]) -> bool:
+        """Enqueue all items or none. Returns False when the buffer is full."""
+        if not items:
+            return True
+        groups: Dict[Any, List[Any]] = {}
+        for it in items:
+            groups.setdefault(self.key_fn(it), []).append(it)
+        with self._cond:
+            if self._size + len(items) > self.maxsize or any(
+                    len(self._lanes.get(k, ())) + len(g) > self.lane_max for k, g in groups.items()):
+                self.rejected += len(items)
+                return False
+            if not self._size:
+                self._oldest = time.monotonic()
+            for k, g in groups.items():
+                lane = self._lanes.get(k)
+                if lane is None:
+                    lane = self._lanes[k] = deque()
+                lane.extend(g)
+            self._size += len(items)
+            self.accepted += len(items)
+            self.high_water = max(self.high_water, self._size)
+            if self._size >= self.flush_rows:
+                self._cond.notify()
+            return True
+
+    def drain(self, timeout: float = 10.0) -> bool:
+        """Block until everything offered so far is committed (or timeout)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._size or self._inflight:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._cond.wait(min(left, self.flush_s))
+        return True
+
+    def depth(self) -> int:
+        return self._size + self._inflight
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            busiest = sorted(((len(q), k) for k, q in self._lanes.items()), reverse=True)[:10]
+            return {
+                "depth": self._size,
+                "lanes": len(self._lanes),
+                "lane_max": self.lane_max,
+                "busiest_lanes": {str(k): n for n, k in busiest},
+                "inflight": self._inflight,
+                "capacity": self.maxsize,
+                "high_water": self.high_water,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "written": self.written,
+                "flushes": self.flushes,
+                "errors": self.errors,
+                "last_error": self.last_error,
+                "flush_rows": self.flush_rows,
+                "flush_ms": int(self.flush_s * 1000),
+                "last_flush_rows": self.last_flush_rows,
+                "last_flush_ms": round(self.last_flush_ms, 3),
+                "max_flush_ms": round(self.max_flush_ms, 3),
+                "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+            }
+
+    def _take(self) -> List[Any]:
+        # Called with the condition held; waits for a size or age trigger
+        while not self._stop:
+            if self._size >= self.flush_rows:
+                break
+            if self._size and time.monotonic() - self._oldest >= self.flush_s:
+                break
+            wait = self.flush_s if not self._size else max(0.0, self.flush_s - (time.monotonic() - self._oldest))
+            self._cond.wait(wait)
+        # Round-robin over the lanes: equal shares first, leftovers to whoever still has rows
+        batch: List[Any] = []
+        while self._lanes and len(batch) < self.flush_rows:
+            share = max(1, (self.flush_rows - len(batch)) // len(self._lanes))
+            for k in list(self._lanes):
+                lane = self._lanes[k]
+                for _ in range(min(share, len(lane), self.flush_rows - len(batch))):
+                    batch.append(lane.popleft())
+                if lane:
+                    self._lanes.move_to_end(k)
+                else:
+                    del self._lanes[k]
+                if len(batch) >= self.flush_rows:
+                    break
+        self._size -= len(batch)
+        self._oldest = time.monotonic() if self._size else None
+        self._inflight = len(batch)
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stop and not self._size:
+                    return
+                batch = self._take()
+            if not batch:
+                continue
+            t0 = time.perf_counter()
+            try:
+                self.write_fn(batch)
+            except Exception as e:
+                # Put the batch back in front and retry; nothing is dropped
+                with self._cond:
+                    self.errors += 1
+                    self.last_error = str(e)
+                    for it in reversed(batch):
+                        k = self.key_fn(it)
+                        if k not in self._lanes:
+                            self._lanes[k] = deque()
+                            self._lanes.move_to_end(k, last=False)
+                        self._lanes[k].appendleft(it)
+                    self._size += len(batch)
+                    self._oldest = time.monotonic()
+                    self._inflight = 0
+                    self._cond.notify_all()
+                print(f"[ingest] flush of {len(batch)} sample(s) failed: {e}", flush=True)
+                time.sleep(min(5.0, self.flush_s * 5))
+                continue
+            dt_ms = (time.perf_counter() - t0) * 1000.0
+            with self._cond:
+                self._inflight = 0
+                self.written += len(batch)
+                self.flushes += 1
+                self.last_flush_rows = len(batch)
+                self.last_flush_ms = dt_ms
+                self.max_flush_ms = max(self.max_flush_ms, dt_ms)
+                self.total_flush_ms += dt_ms
+                self._cond.notify_all()
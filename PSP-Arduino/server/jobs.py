@@ -0,0 +1,195 @@
+# server/jobs.py
+"""
+Background jobs for slow operator actions (dump-now, delete-all): the request
+handler submits one and answers 202 with its id right away, so no request
+thread waits on GitHub.
+
+A job's state is a small JSON file under the jobs directory, rewritten on
+every state change and at most every `flush_s` while progress moves. Any
+worker can therefore answer GET /api/jobs/<id>, and cancelling one writes
+`<id>.cancel` next to it, which the running job notices at its next check().
+Only the last `history` finished jobs are kept, in memory and on disk.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+FINAL = ("done", "failed", "cancelled")
+
+
+class Cancelled(Exception):
+    """Raised by Job.check() once the job was asked to stop."""
+
+
+def _iso(t: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(t, timezone.utc).isoformat() if t else None
+
+
+def _alive(pid: Optional[int]) -> bool:
+    try:
+        os.kill(int(pid), 0)
+    except (TypeError, ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Job:
+    def __init__(self, runner: "JobRunner", kind: str, progress: Dict[str, Any]):
+        self.runner, self.kind = runner, kind
+        self.id = uuid.uuid4().hex[:12]
+        self.state = "queued"
+        self.created, self.started, self.finished = time.time(), None, None
+        self.progress: Dict[str, Any] = dict(progress)
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.cancel_requested = False
+        self._flushed = 0.0
+
+    def update(self, **progress):
+        """Set progress fields (e.g. mode='tree')."""
+        self.progress.update(progress)
+        self._maybe_flush()
+
+    def add(self, **deltas):
+        """Increment progress counters (e.g. rows=500, bytes=12000)."""
+        for k, v in deltas.items():
+            self.progress[k] = self.progress.get(k, 0) + v
+        self._maybe_flush()
+
+    def cancelled(self) -> bool:
+        if not self.cancel_requested and os.path.exists(self.runner.path(self.id, ".cancel")):
+            self.cancel_requested = True
+        return self.cancel_requested
+
+    def check(self):
+        """Raise Cancelled if a cancel was requested; call between units of work."""
+        if self.cancelled():
+            raise Cancelled(f"{self.kind} job {self.id} cancelled")
+
+    def _maybe_flush(self):
+        if time.time() - self._flushed >= self.runner.flush_s:
+            self.runner.save(self)
+
+    def snapshot(self) -> Dict[str, Any]:
+        end = self.finished or time.time()
+        return {"id": self.id, "kind": self.kind, "state": self.state, "created": _iso(self.created),
+                "started": _iso(self.started), "finished": _iso(self.finished),
+                "elapsed_s": round(end - self.started, 3) if self.started else 0,
+                "progress": dict(self.progress), "result": self.result, "error": self.error,
+                "cancel_requested": self.cancel_requested, "pid": os.getpid()}
+
+
+class JobRunner:
+    def __init__(self, root: str, workers: int = 2, history: int = 50, flush_s: float = 0.5):
+        self.root, self.history, self.flush_s = root, max(1, int(history)), float(flush_s)
+        os.makedirs(root, exist_ok=True)
+        self.pool = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="job")
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, job_id: str, ext: str = ".json") -> str:
+        return os.path.join(self.root, job_id + ext)
+
+    def save(self, job: Job):
+        job._flushed = time.time()
+        tmp = self.path(job.id, f".json.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(job.snapshot(), f)
+        os.replace(tmp, self.path(job.id))
+
+    def submit(self, kind: str, fn: Callable[[Job], Any], unique: bool = False, **progress) -> Job:
+        """
+        Run fn(job) on the pool; its return value becomes the job's result.
+        unique=True hands back this process's queued or running job of the
+        same kind instead of starting a second one.
+        """
+        with self._lock:
+            if unique:
+                for job in self.jobs.values():
+                    if job.kind == kind and job.state not in FINAL:
+                        return job
+            job = Job(self, kind, progress)
+            self.jobs[job.id] = job
+        self.save(job)
+        self.pool.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job: Job, fn: Callable[[Job], Any]):
+        job.started = time.time()
+        try:
+            job.check()
+            job.state = "running"
+            self.save(job)
+            job.result = fn(job)
+            job.state = "done"
+        except Cancelled:
+            job.state = "cancelled"
+        except Exception as e:
+            job.state, job.error = "failed", str(e)
+            print(f"[jobs] {job.kind} {job.id} failed: {e}", flush=True)
+        job.finished = time.time()
+        self.save(job)
+        self._trim()
+
+    def _trim(self):
+        with self._lock:
+            done = [j for j in self.jobs.values() if j.state in FINAL]
+            for job in done[:max(0, len(done) - self.history)]:
+                del self.jobs[job.id]
+        # Other workers' records count too: keep the newest `history` finished files
+        records = [r for r in self._records() if r.get("state") in FINAL]
+        for r in records[:max(0, len(records) - self.history)]:
+            for ext in (".json", ".cancel"):
+                try:
+                    os.remove(self.path(r["id"], ext))
+                except OSError:
+                    pass
+
+    def _load(self, name: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.root, name), "r", encoding="utf-8") as f:
+                rec = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if rec.get("state") not in FINAL and rec.get("pid") != os.getpid() and not _alive(rec.get("pid")):
+            rec.update(state="failed", error="worker exited before the job finished")
+        return rec
+
+    def _records(self) -> List[Dict[str, Any]]:
+        out = [r for r in (self._load(n) for n in os.listdir(self.root) if n.endswith(".json")) if r]
+        return sorted(out, key=lambda r: r.get("created") or "")
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """This process's live view, else the last snapshot any worker wrote."""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.snapshot()
+        return self._load(job_id + ".json")
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Every known job, newest first."""
+        return [self.get(r["id"]) or r for r in reversed(self._records())]
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Ask a job to stop at its next check(); None if there is no such job."""
+        snap = self.get(job_id)
+        if snap is None:
+            return None
+        if snap["state"] not in FINAL:
+            with open(self.path(job_id, ".cancel"), "w", encoding="utf-8") as f:
+                f.write(_iso(time.time()))
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job.cancel_requested = True
+                self.save(job)
+                return job.snapshot()
+            snap["cancel_requested"] = True
+        return snap
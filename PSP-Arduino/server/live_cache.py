@@ -0,0 +1,250 @@
+# server/live_cache.py
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from schema import FSR_COUNT, row_to_item, us_to_iso
+
+
+class DataVersion:
+    """
+    Process-level version of the sample data: the newest row id plus an epoch
+    that moves whenever rows disappear (prune, clear, retention) or old rows
+    are backfilled. Read endpoints derive their ETag from it, so an unchanged
+    poll is answered with 304 before any SQLite work. Passing the epoch kept
+    in SQLite (meta.data_epoch) keeps the ETags of several workers in step.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.last_id = 0
+        self.epoch = 0
+
+    def reset(self, last_id: int, epoch: Optional[int] = None):
+        with self._lock:
+            self.last_id = int(last_id)
+            self.epoch = self.epoch + 1 if epoch is None else int(epoch)
+
+    def advance(self, last_id: int):
+        with self._lock:
+            if last_id > self.last_id:
+                self.last_id = int(last_id)
+
+    def bump(self, epoch: Optional[int] = None):
+        with self._lock:
+            self.epoch = self.epoch + 1 if epoch is None else int(epoch)
+
+    def etag(self, extra: Optional[str] = None) -> str:
+        with self._lock:
+            tag = f"{self.last_id}-{self.epoch}"
+        return f'W/"{tag}-{extra}"' if extra else f'W/"{tag}"'
+
+
+# Running per-series stats: temperatures, volume, then the FSR channels
+_SERIES = ("t1_c", "t2_c", "volume")
+_WIDTH = 3 + FSR_COUNT
+
+
+def _matrix(rows: Iterable[Sequence]) -> np.ndarray:
+    return np.array([(t1, t2, vol, *fsr) for t1, t2, vol, fsr in rows], dtype=np.float64).reshape(-1, _WIDTH)
+
+
+class _Acc:
+    """Counters for one device in one partition, or (merged) for one device."""
+
+    def __init__(self):
+        self.latest: Optional[Dict[str, Any]] = None
+        self.total = 0
+        self.last_us: Optional[int] = None
+        self.sum = np.zeros(_WIDTH)
+        self.min = np.full(_WIDTH, np.inf)
+        self.max = np.full(_WIDTH, -np.inf)
+
+    def fold(self, m: np.ndarray):
+        if len(m):
+            self.sum += m.sum(axis=0)
+            np.minimum(self.min, m.min(axis=0), out=self.min)
+            np.maximum(self.max, m.max(axis=0), out=self.max)
+            self.total += len(m)
+
+    def see(self, item: Dict[str, Any], ts_us: int):
+        if self.last_us is None or ts_us >= self.last_us:
+            self.last_us = int(ts_us)
+            self.latest = item
+
+    def merge(self, other: "_Acc"):
+        self.total += other.total
+        self.sum += other.sum
+        np.minimum(self.min, other.min, out=self.min)
+        np.maximum(self.max, other.max, out=self.max)
+        if other.latest is not None:
+            self.see(other.latest, other.last_us)
+
+
+class _Device(_Acc):
+    """A device's merged counters plus one _Acc per partition, so dropping a partition is a subtraction."""
+
+    def __init__(self):
+        super().__init__()
+        self.cells: Dict[str, _Acc] = {}
+
+    def recount(self):
+        _Acc.__init__(self)
+        for cell in self.cells.values():
+            self.merge(cell)
+
+
+def _stats(n: int, s: np.ndarray, lo: np.ndarray, hi: np.ndarray, last_us: Optional[int]) -> Dict[str, Any]:
+    out = {"total": n, "last_ts": us_to_iso(last_us) if last_us is not None else None}
+    if n:
+        mean = s / n
+        series = {k: {"min": float(lo[i]), "max": float(hi[i]), "mean": round(float(mean[i]), 3)}
+                  for i, k in enumerate(_SERIES)}
+        series["fsr"] = {"min": lo[3:].astype(int).tolist(), "max": hi[3:].astype(int).tolist(),
+                         "mean": np.round(mean[3:], 2).tolist()}
+        out["series"] = series
+    return out
+
+
+class LiveStats:
+    """
+    Newest sample plus running counters (rows, last ts, per-series min/max/mean)
+    per device, for the rows currently held locally. Ingest folds each
+    committed batch in, so /api/latest and /api/stats answer from memory
+    without touching SQLite. last_id is the newest row id accounted for; add()
+    ignores anything at or below it.
+
+    Counters are kept per partition (cell(ts_us) → (partition, generation))
+    as well. When rows disappear, reconcile() drops the cells of partitions
+    that are gone and re-reads only those whose generation moved (a ranged
+    delete or a backfill), never the whole table.
+    """
+
+    def __init__(self, cell: Callable[[int], Tuple[str, int]] = lambda ts_us: ("", 0), span_us: int = 3600 * 1_000_000):
+        self._lock = threading.Lock()
+        self._devices: Dict[str, _Device] = {}
+        self._gens: Dict[str, int] = {}   # partition → generation the cells reflect
+        self.cell, self.span_us = cell, int(span_us)
+        self.last_id = 0
+
+    def clear(self):
+        with self._lock:
+            self._devices = {}
+            self._gens = {}
+
+    def add(self, items: Sequence[Dict[str, Any]], ts_us: Sequence[int]):
+        """Fold freshly committed items (row_to_item shape plus `id`) in; ts_us matches items."""
+        if not items:
+            return
+        windows: Dict[int, Tuple[str, int]] = {}
+        with self._lock:
+            groups: Dict[Tuple[str, str], List[int]] = {}
+            for i, it in enumerate(items):
+                if it["id"] > self.last_id:
+                    w = ts_us[i] // self.span_us
+                    if w not in windows:
+                        windows[w] = self.cell(ts_us[i])
+                    groups.setdefault((it["device"], windows[w][0]), []).append(i)
+            for (dev, part), idx in groups.items():
+                acc = self._devices.get(dev)
+                if acc is None:
+                    acc = self._devices[dev] = _Device()
+                cell = acc.cells.get(part)
+                if cell is None:
+                    cell = acc.cells[part] = _Acc()
+                m = _matrix((items[i]["t1_c"], items[i]["t2_c"], items[i]["volume"], items[i]["fsr"]) for i in idx)
+                newest = max(idx, key=lambda i: (ts_us[i], items[i]["id"]))
+                for a in (acc, cell):
+                    a.fold(m)
+                    a.see(dict(items[newest]), ts_us[newest])
+            for part, gen in windows.values():
+                self._gens.setdefault(part, gen)
+            self.last_id = max(self.last_id, max(it["id"] for it in items))
+
+    def seen_through(self, last_id: int):
+        """Ids up to last_id are accounted for (rows that no longer exist leave gaps)."""
+        with self._lock:
+            self.last_id = max(self.last_id, int(last_id))
+
+    def reconcile(self, gens: Dict[str, int], load: Callable[[str], Iterable], batch: int = 5000) -> List[str]:
+        """
+        Match the partition catalog (partition → generation): cells of
+        partitions no longer listed are dropped, and partitions whose
+        generation differs from the one counted (or that were never seen) are
+        re-read with load(partition), their stored rows up to last_id. Call
+        with writes excluded, so nothing lands between the read and the swap.
+        Returns the partitions re-read.
+        """
+        with self._lock:
+            gone = [p for p in self._gens if p not in gens]
+            stale = [p for p, g in gens.items() if self._gens.get(p) != g]
+        fresh: Dict[str, Dict[str, _Acc]] = {}
+        for part in stale:
+            chunk: Dict[str, list] = {}
+            cells = fresh[part] = {}
+
+            def flush(dev):
+                rows = chunk.pop(dev)
+                cell = cells.setdefault(dev, _Acc())
+                cell.fold(_matrix((r["t1_c"], r["t2_c"], r["volume"], r["fsr"]) for r in rows))
+                last = max(rows, key=lambda r: (r["ts_us"], r["id"]))
+                cell.see(dict(row_to_item(last), id=int(last["id"])), int(last["ts_us"]))
+
+            for r in load(part):
+                chunk.setdefault(r["device"], []).append(r)
+                if len(chunk[r["device"]]) >= batch:
+                    flush(r["device"])
+            for dev in list(chunk):
+                flush(dev)
+        with self._lock:
+            touched = set()
+            for dev, acc in self._devices.items():
+                for part in gone + stale:
+                    if acc.cells.pop(part, None) is not None:
+                        touched.add(dev)
+            for part, cells in fresh.items():
+                for dev, cell in cells.items():
+                    self._devices.setdefault(dev, _Device()).cells[part] = cell
+                    touched.add(dev)
+            for dev in touched:
+                acc = self._devices[dev]
+                if acc.cells:
+                    acc.recount()
+                else:
+                    del self._devices[dev]
+            for part in gone:
+                self._gens.pop(part, None)
+            self._gens.update({p: gens[p] for p in stale})
+        return stale
+
+    def devices(self) -> List[str]:
+        with self._lock:
+            return sorted(self._devices)
+
+    def latest(self, device: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Newest item for device, or across all devices when device is None."""
+        with self._lock:
+            if device is not None:
+                acc = self._devices.get(device)
+                return dict(acc.latest) if acc and acc.latest else None
+            best = max((a for a in self._devices.values() if a.latest), key=lambda a: a.last_us, default=None)
+            return dict(best.latest) if best else None
+
+    def stats(self, device: Optional[str] = None) -> Dict[str, Any]:
+        """Counters for one device, or merged over all devices (with a per-device summary)."""
+        with self._lock:
+            if device is not None:
+                acc = self._devices.get(device) or _Acc()
+                return dict(_stats(acc.total, acc.sum, acc.min, acc.max, acc.last_us), device=device)
+            accs = list(self._devices.items())
+            n = sum(a.total for _, a in accs)
+            s = np.sum([a.sum for _, a in accs], axis=0) if accs else np.zeros(_WIDTH)
+            lo = np.min([a.min for _, a in accs], axis=0) if accs else np.full(_WIDTH, np.inf)
+            hi = np.max([a.max for _, a in accs], axis=0) if accs else np.full(_WIDTH, -np.inf)
+            lasts = [a.last_us for _, a in accs if a.last_us is not None]
+            per = {dev: {"total": a.total, "last_ts": us_to_iso(a.last_us) if a.last_us is not None else None}
+                   for dev, a in accs}
+        out = _stats(n, s, lo, hi, max(lasts) if lasts else None)
+        out["devices"] = per
+        return out
@@ -0,0 +1,241 @@
+# server/metrics.py
+"""
+Counters, histograms and gauges for GET /metrics, in the Prometheus text
+format (0.0.4), without a client library.
+
+The hot path takes no lock: every thread writes its own preallocated slot
+list per label set (held in a threading.local), so no two threads ever
+increment the same slot. A scrape sums the shards and folds those of
+threads that have exited into a running total. An observation is one
+bisect and two list increments (about a microsecond).
+
+Values are per process. With several workers, each one writes a snapshot
+to a shared directory (share()) and /metrics adds the other live workers'
+snapshots to its own, so a scrape through the load balancer sees the sum.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+# Seconds; from a single-sample parse (tens of µs) to a slow GitHub call
+LATENCY_BUCKETS = (0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+class _Sharded:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), width: int = 1):
+        self.name, self.help, self.labels, self.width = name, help, tuple(labels), width
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, Dict[Labels, list]]] = []
+        self._retired: Dict[Labels, list] = {}
+        self._lock = threading.Lock()   # only for shard registration and scrapes
+
+    def _slots(self, labels: Labels) -> list:
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        s = shard.get(labels)
+        if s is None:
+            s = shard[labels] = [0] * self.width
+        return s
+
+    def collect(self) -> Dict[Labels, list]:
+        """Label values → summed slots of every thread, live and exited."""
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    _add(self._retired, shard)
+            self._shards = live
+            total = {k: list(v) for k, v in self._retired.items()}
+        for _, shard in live:
+            _add(total, dict(shard))
+        return total
+
+    def render(self, values: Dict[Labels, list]) -> Iterable[str]:
+        raise NotImplementedError
+
+
+def _add(into: Dict[Labels, list], shard: Dict[Labels, list]):
+    for k, v in shard.items():
+        cur = into.get(k)
+        if cur is None:
+            into[k] = list(v)
+        else:
+            for i, x in enumerate(v):
+                cur[i] += x
+
+
+class Counter(_Sharded):
+    kind = "counter"
+
+    def inc(self, n: float = 1, *labels: str):
+        self._slots(labels)[0] += n
+
+    def render(self, values):
+        for lv, (v,) in sorted(values.items()):
+            yield f"{self.name}{_fmt_labels(self.labels, lv)} {_num(v)}"
+
+
+class Histogram(_Sharded):
+    """Per-bucket counts (not cumulative until rendered), then +Inf, then the sum."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labels, width=len(self.buckets) + 2)
+
+    def observe(self, value: float, *labels: str):
+        s = self._slots(labels)
+        s[bisect_left(self.buckets, value)] += 1
+        s[-1] += value
+
+    def time(self, *labels: str) -> "_Timer":
+        """with H.time("label"): ... observes the block's duration."""
+        return _Timer(self, labels)
+
+    def render(self, values):
+        for lv, slots in sorted(values.items()):
+            acc = 0
+            for le, n in zip(self.buckets, slots):
+                acc += n
+                yield self.name + "_bucket" + _fmt_labels(self.labels, lv, 'le="%s"' % _num(le)) + f" {_num(acc)}"
+            acc += slots[len(self.buckets)]
+            yield self.name + "_bucket" + _fmt_labels(self.labels, lv, 'le="+Inf"') + f" {_num(acc)}"
+            yield f"{self.name}_sum{_fmt_labels(self.labels, lv)} {_num(slots[-1])}"
+            yield f"{self.name}_count{_fmt_labels(self.labels, lv)} {_num(acc)}"
+
+
+class _Timer:
+    __slots__ = ("h", "labels", "t0")
+
+    def __init__(self, h: Histogram, labels: Labels):
+        self.h, self.labels = h, labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.h.observe(time.perf_counter() - self.t0, *self.labels)
+
+
+class Gauge:
+    """Read at scrape time: fn() returns a number or {label values tuple: number}."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Union[float, Dict[Labels, float]]],
+                 labels: Sequence[str] = ()):
+        self.name, self.help, self.fn, self.labels = name, help, fn, tuple(labels)
+
+    def render(self) -> Iterable[str]:
+        v = self.fn()
+        for lv, x in sorted(v.items() if isinstance(v, dict) else [((), v)]):
+            if x is not None:
+                yield f"{self.name}{_fmt_labels(self.labels, lv)} {_num(x)}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Union[_Sharded, Gauge]] = {}
+        self.share_dir: Optional[str] = None
+
+    def _add(self, m):
+        if m.name in self.metrics:
+            raise ValueError(f"metric {m.name} registered twice")
+        self.metrics[m.name] = m
+        return m
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, fn, labels: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, fn, labels))
+
+    def share(self, directory: str):
+        """Write this process's counters and histograms to directory/<pid>.json (call periodically)."""
+        self.share_dir = directory
+        os.makedirs(directory, exist_ok=True)
+        snap = {name: [[list(k), v] for k, v in m.collect().items()]
+                for name, m in self.metrics.items() if isinstance(m, _Sharded)}
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(snap, f)
+        os.replace(path + ".tmp", path)
+
+    def _others(self) -> List[dict]:
+        out = []
+        if not self.share_dir:
+            return out
+        for name in os.listdir(self.share_dir):
+            pid = name[:-5] if name.endswith(".json") else ""
+            if not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                # An exited worker's counts go with it, like any process restart
+                try: os.remove(os.path.join(self.share_dir, name))
+                except OSError: pass
+                continue
+            except PermissionError:
+                pass
+            try:
+                with open(os.path.join(self.share_dir, name), "r", encoding="utf-8") as f:
+                    out.append(json.load(f))
+            except (OSError, ValueError):
+                pass
+        return out
+
+    def render(self) -> str:
+        others = self._others()
+        lines = []
+        for name, m in self.metrics.items():
+            lines.append(f"# HELP {name} {m.help}")
+            lines.append(f"# TYPE {name} {m.kind}")
+            try:
+                if isinstance(m, Gauge):
+                    lines.extend(m.render())
+                    continue
+                values = m.collect()
+                for snap in others:
+                    _add(values, {tuple(k): v for k, v in snap.get(name, [])
+                                  if len(v) == m.width and len(k) == len(m.labels)})
+                lines.extend(m.render(values))
+            except Exception as e:
+                lines.append(f"# {name} unavailable: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Online migration of data.sqlite into time-partitioned storage.
+
+Handles both older layouts:
+  samples_v1  ISO TEXT ts, fsr1..fsr8 INTEGER columns
+  samples_v2  single `samples` table with ts_us + packed FSR blob
+
+The server renames the old table on startup and keeps ingesting into the
+partitions; this tool copies the old rows across in small chunks so the
+writer lock is only held briefly. Each chunk is copied and removed from the
+legacy table in the same transaction, so an interrupted run simply resumes.
+Each chunk is folded into the rollup tables in that transaction too.
+
+Usage:
+  python migrate_db.py [path/to/data.sqlite] [--chunk 5000] [--pause-ms 20] [--vacuum]
+"""
+
+import argparse
+import os
+import time
+
+from partitions import PartitionManager
+from rollups import Rollups
+from schema import ensure_schema, legacy_rows, pending_legacy
+from storage import Storage
+
+
+def migrate(storage: Storage, parts: PartitionManager, chunk: int = 5000, pause_s: float = 0.02, log=print,
+            on_chunk=None, rollups: Rollups = None) -> int:
+    """Copy legacy tables → partitions in chunks; drop each legacy table when empty. Returns rows migrated."""
+    with storage.write() as db:
+        tables = ensure_schema(db)
+        if rollups is not None and tables:
+            # Legacy ids are folded here, chunk by chunk; keep Rollups.run() off them
+            top = max(db.execute(f"SELECT COALESCE(MAX(id), 0) FROM {t}").fetchone()[0] for t in tables)
+            rollups.skip_to(db, top)
+    moved = 0
+    for table in tables:
+        while True:
+            with storage.write() as db:
+                rows = legacy_rows(db, table, 0, int(chunk))
+                if not rows:
+                    db.execute(f"DROP TABLE IF EXISTS {table}")
+                    break
+                parts.insert_with_ids(db, rows)
+                if rollups is not None:
+                    rollups.fold(db, rows)
+                db.execute(f"DELETE FROM {table} WHERE id <= ?", (rows[-1][0],))
+            moved += len(rows)
+            if on_chunk is not None:
+                on_chunk()
+            log(f"[migrate] {table}: copied {moved} row(s) (up to id {rows[-1][0]})")
+            if pause_s:
+                time.sleep(pause_s)
+        log(f"[migrate] {table} migrated and dropped")
+    return moved
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Migrate data.sqlite samples into time partitions in chunks.")
+    ap.add_argument("db", nargs="?", default=os.getenv("DB_PATH", os.path.join(os.path.dirname(__file__), "data.sqlite")))
+    ap.add_argument("--chunk", type=int, default=5000)
+    ap.add_argument("--pause-ms", type=int, default=20)
+    ap.add_argument("--vacuum", action="store_true",
+                    help="afterwards switch to auto_vacuum=INCREMENTAL with one full VACUUM (blocks writers)")
+    args = ap.parse_args()
+    storage = Storage(args.db)
+    try:
+        with storage.write() as db:
+            before = pending_legacy(db)
+        migrate(storage, PartitionManager(), chunk=args.chunk, pause_s=args.pause_ms / 1000.0,
+                log=lambda m: print(m, flush=True), rollups=Rollups())
+        if not before:
+            print(f"[migrate] {args.db} is already partitioned")
+        if args.vacuum:
+            with storage.write() as db:
+                db.commit()
+                db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                db.execute("VACUUM")
+            print("[migrate] auto_vacuum=INCREMENTAL enabled", flush=True)
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 # server/mongo_sink.py
 import os
 import threading
+import time
 from datetime import datetime
 from typing import Dict, Any, List, Optional
 
@@ -10,6 +11,8 @@ from pymongo.errors import PyMongoError
 from dotenv import load_dotenv
 load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
 
+from metrics import REGISTRY
+
 # --- Configuration via environment variables ---
 MONGO_URI = os.getenv("MONGO_URI", "").strip()   # leave default = ""
 MONGO_DB  = os.getenv("MONGO_DB", "psp")
@@ -22,6 +25,9 @@ _coll = None
 _init_lock = threading.Lock()
 _initialized = False
 
+INSERT_SECONDS = REGISTRY.histogram("psp_mongo_insert_seconds", "Mongo insert round-trip, successful or not", ("op",))
+INSERT_FAILURES = REGISTRY.counter("psp_mongo_insert_failures_total", "Mongo inserts that raised", ("op",))
+
 
 def mongo_enabled() -> bool:
     return MONGO_ENABLED
@@ -33,6 +39,7 @@ def _ensure_indexes():
     # Optional helper indexes
     _coll.create_index([("volume", ASCENDING)], background=True)
     _coll.create_index([("ts_iso", ASCENDING)], background=True)
+    _coll.create_index([("device", ASCENDING), ("ts_iso", ASCENDING)], background=True)
 
 
 def init_mongo():
@@ -91,9 +98,14 @@ def insert_one_sample(doc: Dict[str, Any]) -> bool:
             ts_dt = _as_dt(d["ts_iso"])
             if ts_dt:
                 d["ts"] = ts_dt
-        _coll.insert_one(d)
+        t0 = time.perf_counter()
+        try:
+            _coll.insert_one(d)
+        finally:
+            INSERT_SECONDS.observe(time.perf_counter() - t0, "one")
         return True
     except PyMongoError as e:
+        INSERT_FAILURES.inc(1, "one")
         print(f"[mongo] insert error: {e}", flush=True)
         return False
 
@@ -113,9 +125,13 @@ def insert_many_samples(docs: List[Dict[str, Any]]) -> int:
             if ts_dt:
                 d["ts"] = ts_dt
         prepared.append(d)
+    t0 = time.perf_counter()
     try:
         res = _coll.insert_many(prepared, ordered=False)
         return len(res.inserted_ids)
     except PyMongoError as e:
+        INSERT_FAILURES.inc(1, "many")
         print(f"[mongo] bulk insert error: {e}", flush=True)
         return 0
+    finally:
+        INSERT_SECONDS.observe(time.perf_counter() - t0, "many")
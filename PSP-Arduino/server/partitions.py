@@ -0,0 +1,370 @@
+# server/partitions.py
+import bisect
+import heapq
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from schema import PARTITION_DDL, INSERT_SQL, INSERT_OR_IGNORE_SQL, us_to_dt
+
+# --- Configuration via environment variables ---
+PARTITION_SPAN = os.getenv("PARTITION_SPAN", "hour").lower()   # "hour" | "day"
+
+_SPANS_US = {"hour": 3600 * 1_000_000, "day": 86400 * 1_000_000}
+
+
+def _execute_if_exists(db, sql: str, params: Sequence = ()):
+    # A partition can be dropped by the writer between catalog load and query
+    try:
+        return db.execute(sql, params)
+    except sqlite3.OperationalError as e:
+        if "no such table" in str(e):
+            return None
+        raise
+
+
+class PartitionManager:
+    """
+    Time-partitioned sample storage. Each window (hour or day, UTC) is its own
+    table `samples_<window>`, listed in the `partitions` catalog. Ids come from
+    meta.last_id inside the write transaction, so they stay globally monotonic
+    across partitions (and across processes sharing the file).
+
+    Callers never name partitions: inserts are routed by ts_us, and reads go
+    through scan()/latest()/count(), which walk only the partitions that
+    overlap the requested window. Pruning drops whole sealed partitions
+    instead of DELETE + VACUUM over the entire file.
+
+    Each partition carries a generation, drawn from meta.partition_gen when
+    it is created and again whenever rows in it are deleted by range. A cache
+    of per-partition counters (LiveStats) re-reads only the partitions whose
+    generation moved.
+    """
+
+    def __init__(self, span: str = PARTITION_SPAN):
+        if span not in _SPANS_US:
+            raise ValueError(f"PARTITION_SPAN must be one of {sorted(_SPANS_US)}")
+        self.span = span
+        self.span_us = _SPANS_US[span]
+        self._lock = threading.Lock()
+        self._schema_version = None
+        self._starts: List[int] = []
+        self._parts: List[Tuple[int, int, str]] = []   # sorted (start_us, end_us, name)
+        self._gens: Dict[str, int] = {}   # generation when the catalog was loaded
+
+    # ---------- catalog ----------
+    def refresh(self, db, force: bool = False):
+        """Reload the catalog if any process changed the schema since last look."""
+        ver = db.execute("PRAGMA schema_version").fetchone()[0]
+        if not force and ver == self._schema_version:
+            return
+        rows = db.execute("SELECT start_us, end_us, name, gen FROM partitions ORDER BY start_us").fetchall()
+        with self._lock:
+            self._parts = [(int(r[0]), int(r[1]), r[2]) for r in rows]
+            self._gens = {r[2]: int(r[3]) for r in rows}
+            self._starts = [p[0] for p in self._parts]
+            self._schema_version = ver
+
+    def partitions(self, from_us: Optional[int] = None, to_us: Optional[int] = None) -> List[Tuple[int, int, str]]:
+        """Partitions overlapping [from_us, to_us], oldest first."""
+        with self._lock:
+            parts = list(self._parts)
+        return [p for p in parts
+                if (from_us is None or p[1] > from_us) and (to_us is None or p[0] <= to_us)]
+
+    def gens(self, db) -> Dict[str, int]:
+        """Current generation of every partition."""
+        return {r[0]: int(r[1]) for r in db.execute("SELECT name, gen FROM partitions").fetchall()}
+
+    def cell(self, ts_us: int) -> Tuple[str, int]:
+        """(partition, generation as last loaded) holding ts_us, from the cached catalog."""
+        with self._lock:
+            hit = self._find(ts_us)
+            if hit:
+                return hit[2], self._gens.get(hit[2], 0)
+        return self._window(ts_us)[2], 0
+
+    def _bump(self, db, name: str):
+        db.execute("UPDATE meta SET value = value + 1 WHERE key='partition_gen'")
+        db.execute("UPDATE partitions SET gen = (SELECT value FROM meta WHERE key='partition_gen') WHERE name=?", (name,))
+
+    def _window(self, ts_us: int) -> Tuple[int, int, str]:
+        start = (ts_us // self.span_us) * self.span_us
+        fmt = "%Y%m%d%H" if self.span == "hour" else "%Y%m%d"
+        return start, start + self.span_us, "samples_" + us_to_dt(start).strftime(fmt)
+
+    def _find(self, ts_us: int) -> Optional[Tuple[int, int, str]]:
+        i = bisect.bisect_right(self._starts, ts_us) - 1
+        if i >= 0 and self._parts[i][0] <= ts_us < self._parts[i][1]:
+            return self._parts[i]
+        return None
+
+    def ensure(self, db, ts_us: int) -> str:
+        """Partition table for ts_us, created on first use. Call inside a write transaction."""
+        self.refresh(db)
+        with self._lock:
+            hit = self._find(ts_us)
+        if hit:
+            return hit[2]
+        start, end, name = self._window(ts_us)
+        for stmt in PARTITION_DDL:
+            db.execute(stmt.format(name=name))
+        db.execute("INSERT OR IGNORE INTO partitions (name, start_us, end_us) VALUES (?,?,?)", (name, start, end))
+        self._bump(db, name)
+        self.refresh(db, force=True)
+        return name
+
+    # ---------- writes (call inside STORAGE.write()) ----------
+    def allocate_ids(self, db, n: int) -> int:
+        """Reserve n ids; returns the first one."""
+        db.execute("UPDATE meta SET value = value + ? WHERE key='last_id'", (int(n),))
+        last = db.execute("SELECT value FROM meta WHERE key='last_id'").fetchone()[0]
+        return int(last) - int(n) + 1
+
+    def insert(self, db, rows: Sequence[tuple]) -> Tuple[int, int]:
+        """Insert (ts_us, fsr, t1_c, t2_c, volume, device) rows; returns (first_id, last_id)."""
+        if not rows:
+            return 0, 0
+        first = self.allocate_ids(db, len(rows))
+        self._route(db, [(first + i, *r) for i, r in enumerate(rows)], INSERT_SQL)
+        return first, first + len(rows) - 1
+
+    def insert_with_ids(self, db, rows: Sequence[tuple]):
+        """Insert (id, ts_us, ...) rows that already carry ids (migration/backfill)."""
+        if not rows:
+            return
+        # Ids below what caches have seen: move the generation of every partition touched
+        for name in self._route(db, rows, INSERT_OR_IGNORE_SQL):
+            self._bump(db, name)
+        db.execute("UPDATE meta SET value = MAX(value, ?) WHERE key='last_id'", (max(r[0] for r in rows),))
+
+    def _route(self, db, rows: Sequence[tuple], sql: str):
+        groups = {}
+        for r in rows:
+            groups.setdefault(self.ensure(db, r[1]), []).append(r)
+        for name, group in groups.items():
+            db.executemany(sql.format(name=name), group)
+        return list(groups)
+
+    def delete_through(self, db, cutoff_us: int) -> int:
+        """
+        Remove every row with ts_us <= cutoff_us. Partitions that end at or
+        before the cutoff are dropped whole; only the partition straddling the
+        cutoff (at most one window of data) needs a ranged DELETE.
+        """
+        self.refresh(db)
+        deleted = 0
+        for start, end, name in self.partitions(to_us=cutoff_us):
+            if end - 1 <= cutoff_us:
+                deleted += db.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+                self._drop(db, name)
+            else:
+                n = db.execute(f"DELETE FROM {name} WHERE ts_us <= ?", (cutoff_us,)).rowcount
+                if n:
+                    self._bump(db, name)
+                deleted += n
+        self.refresh(db, force=True)
+        return deleted
+
+    def drop_expired(self, db, cutoff_us: int, max_id: int) -> Optional[Tuple[str, int]]:
+        """
+        Drop the oldest partition that ends at or before cutoff_us and holds
+        no id above max_id; returns (name, rows), or None if none qualifies.
+        One partition per call, so each drop is its own short transaction.
+        """
+        self.refresh(db)
+        for start, end, name in self.partitions(to_us=cutoff_us):
+            if end > cutoff_us:
+                break
+            hi, n = db.execute(f"SELECT MAX(id), COUNT(*) FROM {name}").fetchone()
+            if hi is None or hi <= max_id:
+                self._drop(db, name)
+                self.refresh(db, force=True)
+                return name, int(n)
+        return None
+
+    def prune_through_id(self, db, max_id: int) -> int:
+        """
+        Remove every row with id <= max_id (the dump watermark). Partitions
+        whose newest id is covered are dropped whole; a partition that also
+        holds newer ids (the open window, or late device timestamps) gets a
+        ranged DELETE on its primary key.
+        """
+        self.refresh(db)
+        deleted = 0
+        for _, _, name in self.partitions():
+            lo, hi, n = db.execute(f"SELECT MIN(id), MAX(id), COUNT(*) FROM {name}").fetchone()
+            if lo is None or lo > max_id:
+                continue
+            if hi <= max_id:
+                deleted += n
+                self._drop(db, name)
+            else:
+                n = db.execute(f"DELETE FROM {name} WHERE id <= ?", (max_id,)).rowcount
+                if n:
+                    self._bump(db, name)
+                deleted += n
+        self.refresh(db, force=True)
+        return deleted
+
+    def drop_all(self, db) -> int:
+        self.refresh(db)
+        deleted = 0
+        for _, _, name in self.partitions():
+            deleted += db.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+            self._drop(db, name)
+        self.refresh(db, force=True)
+        return deleted
+
+    def _drop(self, db, name: str):
+        db.execute(f"DROP TABLE IF EXISTS {name}")
+        db.execute("DELETE FROM partitions WHERE name=?", (name,))
+
+    def reclaim(self, db, pages: int = 0):
+        """Return freed pages to the filesystem (auto_vacuum=INCREMENTAL databases only)."""
+        if db.in_transaction:
+            db.commit()
+        db.execute(f"PRAGMA incremental_vacuum({int(pages)})" if pages else "PRAGMA incremental_vacuum").fetchall()
+
+    # ---------- reads ----------
+    def scan(self, db, from_us: Optional[int] = None, to_us: Optional[int] = None,
+             after_us: Optional[int] = None, desc: bool = False, limit: Optional[int] = None,
+             batch: int = 1000, device: Optional[str] = None) -> Iterator:
+        """Yield rows ordered by (ts_us, id) across partitions, fetched `batch` rows at a time."""
+        self.refresh(db)
+        lo = after_us if after_us is not None else from_us
+        parts = self.partitions(lo, to_us)
+        if desc:
+            parts.reverse()
+        conds, params = [], []
+        if device is not None:
+            conds.append("device = ?"); params.append(device)
+        if from_us is not None:
+            conds.append("ts_us >= ?"); params.append(int(from_us))
+        if after_us is not None:
+            conds.append("ts_us > ?"); params.append(int(after_us))
+        if to_us is not None:
+            conds.append("ts_us <= ?"); params.append(int(to_us))
+        where = (" WHERE " + " AND ".join(conds)) if conds else ""
+        order = " ORDER BY ts_us DESC, id DESC" if desc else " ORDER BY ts_us ASC, id ASC"
+        left = limit
+        for _, _, name in parts:
+            sql = f"SELECT * FROM {name}{where}{order}"
+            args = list(params)
+            if left is not None:
+                sql += " LIMIT ?"; args.append(int(left))
+            cur = _execute_if_exists(db, sql, args)
+            while cur is not None:
+                chunk = cur.fetchmany(batch)
+                if not chunk:
+                    break
+                yield from chunk
+                if left is not None:
+                    left -= len(chunk)
+            if left is not None and left <= 0:
+                return
+
+    def last_id(self, db) -> int:
+        return int(db.execute("SELECT value FROM meta WHERE key='last_id'").fetchone()[0])
+
+    def scan_ids(self, db, after_id: int, upto_id: int, limit: Optional[int] = None,
+                 batch: int = 1000, device: Optional[str] = None) -> Iterator:
+        """
+        Yield rows with after_id < id <= upto_id in id order, merging the
+        per-partition primary-key range scans. Rows are pulled with fetchmany,
+        so memory stays flat however large the range is.
+        """
+        self.refresh(db)
+        dev_sql, dev_args = (" AND device = ?", (device,)) if device is not None else ("", ())
+
+        def _rows(name):
+            cur = _execute_if_exists(db, f"SELECT * FROM {name} WHERE id > ? AND id <= ?{dev_sql} ORDER BY id",
+                                     (int(after_id), int(upto_id), *dev_args))
+            while cur is not None:
+                chunk = cur.fetchmany(batch)
+                if not chunk:
+                    return
+                yield from chunk
+
+        merged = heapq.merge(*[_rows(name) for _, _, name in self.partitions()], key=lambda r: r["id"])
+        for i, r in enumerate(merged):
+            if limit is not None and i >= limit:
+                return
+            yield r
+
+    def scan_partition(self, db, name: str, upto_id: int, batch: int = 5000) -> Iterator:
+        """Rows of one partition with id <= upto_id, in no particular order (e.g. to recount it)."""
+        cur = _execute_if_exists(db, f"SELECT * FROM {name} WHERE id <= ?", (int(upto_id),))
+        while cur is not None:
+            chunk = cur.fetchmany(batch)
+            if not chunk:
+                return
+            yield from chunk
+
+    def count_ids(self, db, after_id: int, upto_id: int) -> int:
+        self.refresh(db)
+        total = 0
+        for _, _, name in self.partitions():
+            cur = _execute_if_exists(db, f"SELECT COUNT(*) FROM {name} WHERE id > ? AND id <= ?",
+                                     (int(after_id), int(upto_id)))
+            total += cur.fetchone()[0] if cur is not None else 0
+        return total
+
+    def id_at(self, db, after_id: int, n: int) -> Optional[int]:
+        """The n-th id above after_id (primary-key walk only), or None if there are fewer."""
+        self.refresh(db)
+
+        def _ids(name):
+            cur = _execute_if_exists(db, f"SELECT id FROM {name} WHERE id > ? ORDER BY id LIMIT ?",
+                                     (int(after_id), int(n)))
+            while cur is not None:
+                chunk = cur.fetchmany(5000)
+                if not chunk:
+                    return
+                yield from (r[0] for r in chunk)
+
+        for i, v in enumerate(heapq.merge(*[_ids(name) for _, _, name in self.partitions()])):
+            if i == n - 1:
+                return v
+        return None
+
+    def device_counts(self, db, after_id: int, upto_id: int) -> dict:
+        """{device: rows} for after_id < id <= upto_id."""
+        self.refresh(db)
+        out = {}
+        for _, _, name in self.partitions():
+            cur = _execute_if_exists(db, f"SELECT device, COUNT(*) FROM {name} WHERE id > ? AND id <= ? GROUP BY device",
+                                     (int(after_id), int(upto_id)))
+            for dev, n in (cur.fetchall() if cur is not None else ()):
+                out[dev] = out.get(dev, 0) + n
+        return out
+
+    def latest(self, db, limit: int = 1, device: Optional[str] = None) -> List:
+        return list(self.scan(db, desc=True, limit=limit, device=device))
+
+    def count(self, db, after_us: Optional[int] = None) -> int:
+        self.refresh(db)
+        total = 0
+        for _, _, name in self.partitions(after_us):
+            if after_us is None:
+                cur = _execute_if_exists(db, f"SELECT COUNT(*) FROM {name}")
+            else:
+                cur = _execute_if_exists(db, f"SELECT COUNT(*) FROM {name} WHERE ts_us > ?", (after_us,))
+            total += cur.fetchone()[0] if cur is not None else 0
+        return total
+
+    def max_ts(self, db) -> Optional[int]:
+        self.refresh(db)
+        for _, _, name in reversed(self.partitions()):
+            cur = _execute_if_exists(db, f"SELECT MAX(ts_us) FROM {name}")
+            v = cur.fetchone()[0] if cur is not None else None
+            if v is not None:
+                return int(v)
+        return None
+
+    def info(self, db) -> List[dict]:
+        self.refresh(db)
+        return [{"name": name, "start_us": s, "end_us": e,
+                 "rows": db.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]}
+                for s, e, name in self.partitions()]
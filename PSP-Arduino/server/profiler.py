@@ -0,0 +1,148 @@
+# server/profiler.py
+"""
+On-demand statistical profiler for GET /api/debug/profile.
+
+While a profile runs, the requesting thread wakes every interval and reads
+every other thread's stack (sys._current_frames()), counting each distinct
+stack once per sample. The result is the collapsed-stack format that
+flamegraph.pl, speedscope and inferno read:
+
+    <thread>;<outermost function>;...;<innermost function> <samples>
+
+Alongside it: per-thread samples and CPU seconds (from /proc on Linux),
+process CPU against wall time, and per-endpoint wall and CPU time of the
+requests that finished meanwhile. Wall time well above CPU time means
+waiting: I/O, locks or the GIL.
+
+Idle cost is one attribute check per request (Profiler.active is None).
+"""
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+# Innermost Python frames of a thread that is parked, not working (dropped with idle=False).
+# A thread blocked in C (time.sleep, flock) shows its Python caller: the scheduler and ticker loops.
+IDLE_LEAVES = {"wait", "_wait_for_tstate_lock", "select", "poll", "accept", "sleep", "get", "readinto",
+               "recv", "recv_into", "pop_all", "acquire", "_campaign", "_loop", "serve_forever"}
+
+try:
+    _CLK_TCK = os.sysconf("SC_CLK_TCK")
+except (AttributeError, ValueError, OSError):
+    _CLK_TCK = None
+
+
+class Busy(RuntimeError):
+    """Another profile is running in this process."""
+
+
+def _thread_cpu(native_id: Optional[int]) -> Optional[float]:
+    """CPU seconds (user + system) a thread has used, from /proc; None where unavailable."""
+    if not native_id or not _CLK_TCK:
+        return None
+    try:
+        with open(f"/proc/self/task/{native_id}/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / _CLK_TCK
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profile:
+    def __init__(self):
+        self.stacks: Dict[Tuple[str, ...], int] = {}
+        self.threads: Dict[str, Dict[str, Any]] = {}
+        self.endpoints: Dict[str, list] = {}   # endpoint → [count, wall_s, cpu_s]
+        self._lock = threading.Lock()
+
+    def request_done(self, endpoint: str, wall_s: float, cpu_s: float):
+        with self._lock:
+            e = self.endpoints.setdefault(endpoint, [0, 0.0, 0.0])
+            e[0] += 1
+            e[1] += wall_s
+            e[2] += cpu_s
+
+
+class Profiler:
+    def __init__(self):
+        self.active: Optional[Profile] = None
+        self._lock = threading.Lock()
+
+    # ---------- request hooks (no-ops unless a profile is running) ----------
+    def request_started(self) -> Optional[Tuple[float, float]]:
+        if self.active is None:
+            return None
+        return time.perf_counter(), time.thread_time()
+
+    def request_finished(self, endpoint: str, started: Optional[Tuple[float, float]]):
+        prof = self.active
+        if prof is not None and started is not None:
+            prof.request_done(endpoint, time.perf_counter() - started[0], time.thread_time() - started[1])
+
+    # ---------- sampling ----------
+    def run(self, seconds: float, interval_s: float = 0.01, idle: bool = True) -> Dict[str, Any]:
+        """Sample every thread but this one for `seconds`; raises Busy if a profile is already running."""
+        if not self._lock.acquire(blocking=False):
+            raise Busy("a profile is already running")
+        try:
+            prof = self.active = Profile()
+            me = threading.get_ident()
+            names: Dict[int, threading.Thread] = {}
+            cpu0: Dict[int, Optional[float]] = {}
+            wall0, pcpu0 = time.perf_counter(), time.process_time()
+            end = wall0 + seconds
+            samples = dropped = 0
+            while True:
+                now = time.perf_counter()
+                if now >= end:
+                    break
+                frames = sys._current_frames()
+                names = {t.ident: t for t in threading.enumerate()}
+                for tid, t in names.items():
+                    if tid not in cpu0:
+                        cpu0[tid] = _thread_cpu(t.native_id)
+                for tid, frame in frames.items():
+                    if tid == me:
+                        continue
+                    if not idle and frame.f_code.co_name in IDLE_LEAVES:
+                        dropped += 1
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(_frame_label(frame.f_code))
+                        frame = frame.f_back
+                    t = names.get(tid)
+                    tname = t.name if t is not None else f"thread-{tid}"
+                    key = (tname,) + tuple(reversed(stack))
+                    prof.stacks[key] = prof.stacks.get(key, 0) + 1
+                    prof.threads.setdefault(tname, {"samples": 0, "cpu_s": None, "_ids": set()})
+                    prof.threads[tname]["samples"] += 1
+                    prof.threads[tname]["_ids"].add(tid)
+                samples += 1
+                time.sleep(max(0.0, min(interval_s, end - time.perf_counter())))
+            wall, pcpu = time.perf_counter() - wall0, time.process_time() - pcpu0
+        finally:
+            self.active = None
+            self._lock.release()
+
+        # Threads alive at the end: CPU used since they were first seen
+        alive = {t.ident: t for t in threading.enumerate()}
+        for tname, info in prof.threads.items():
+            used = [(_thread_cpu(alive[i].native_id) or 0) - cpu0[i] for i in info.pop("_ids")
+                    if i in alive and cpu0.get(i) is not None]
+            info["cpu_s"] = round(sum(used), 3) if used else None
+        return {
+            "pid": os.getpid(), "seconds": round(wall, 3), "interval_ms": round(interval_s * 1000, 3),
+            "samples": samples, "idle_dropped": dropped,
+            "process_cpu_s": round(pcpu, 3), "cpu_per_wall": round(pcpu / wall, 3) if wall else 0,
+            "threads": dict(sorted(prof.threads.items(), key=lambda kv: -kv[1]["samples"])),
+            "endpoints": {ep: {"requests": n, "wall_s": round(w, 4), "cpu_s": round(c, 4),
+                               "wall_ms_avg": round(w / n * 1000, 3), "cpu_ms_avg": round(c / n * 1000, 3)}
+                          for ep, (n, w, c) in sorted(prof.endpoints.items(), key=lambda kv: -kv[1][1])},
+            "collapsed": "".join(f"{';'.join(k)} {n}\n" for k, n in sorted(prof.stacks.items())),
+        }
@@ -0,0 +1,222 @@
+# server/rollups.py
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from schema import DEFAULT_DEVICE, FSR_COUNT, us_to_iso
+
+# --- Configuration via environment variables ---
+ROLLUP_GRACE_S = float(os.getenv("ROLLUP_GRACE_S", "5"))   # wait this long after a bucket closes
+
+# resolution → bucket width in µs (buckets are aligned to the epoch, so 30 s buckets are sleep-scoring epochs)
+RESOLUTIONS = {"30s": 30 * 1_000_000, "1m": 60 * 1_000_000}
+# long-range tiers, merged batch by batch instead of waiting for their buckets to close
+COARSE = {"1h": 3600 * 1_000_000, "1d": 86400 * 1_000_000}
+WIDTHS = {**RESOLUTIONS, **COARSE}
+SERIES = ("t1_c", "t2_c", "volume") + tuple(f"fsr{i}" for i in range(1, FSR_COUNT + 1))
+AGGS = ("sum", "min", "max", "p95")
+_COLS = [f"{k}_{a}" for k in SERIES for a in AGGS]
+
+ROLLUP_DDL = ("CREATE TABLE IF NOT EXISTS {name} (device TEXT NOT NULL, bucket_us INTEGER NOT NULL, n INTEGER NOT NULL, "
+              + ", ".join(f"{c} REAL NOT NULL" for c in _COLS) + ", PRIMARY KEY (device, bucket_us))")
+
+# count/sum/min/max merge exactly; p95 of a merged bucket is the n-weighted mean of the parts
+_UPSERT_SQL = ("INSERT INTO {name} (device, bucket_us, n, " + ", ".join(_COLS) + ") VALUES ("
+               + ",".join("?" * (3 + len(_COLS))) + ") ON CONFLICT(device, bucket_us) DO UPDATE SET n = n + excluded.n, "
+               + ", ".join(f"{k}_sum = {k}_sum + excluded.{k}_sum, "
+                           f"{k}_min = MIN({k}_min, excluded.{k}_min), "
+                           f"{k}_max = MAX({k}_max, excluded.{k}_max), "
+                           f"{k}_p95 = ({k}_p95 * n + excluded.{k}_p95 * excluded.n) / (n + excluded.n)"
+                           for k in SERIES))
+
+# A new coarse table starts from the 1 min buckets already kept, with the same merge rules
+_SEED_SQL = ("INSERT INTO {dst} (device, bucket_us, n, " + ", ".join(_COLS) + ") "
+             "SELECT device, bucket_us / {w} * {w}, SUM(n), "
+             + ", ".join(f"SUM({k}_sum), MIN({k}_min), MAX({k}_max), SUM({k}_p95 * n) / SUM(n)" for k in SERIES)
+             + " FROM rollup_1m GROUP BY device, bucket_us / {w}")
+
+
+def table(res: str) -> str:
+    return f"rollup_{res}"
+
+
+def _matrix(rows: Sequence) -> np.ndarray:
+    # Rows are positional (id, ts_us, fsr, t1_c, t2_c, volume, device): partition rows or legacy_rows() tuples
+    m = np.empty((len(rows), len(SERIES)), dtype=np.float64)
+    m[:, 0] = [r[3] for r in rows]
+    m[:, 1] = [r[4] for r in rows]
+    m[:, 2] = [r[5] for r in rows]
+    m[:, 3:] = np.frombuffer(b"".join(r[2] for r in rows), dtype=np.uint8).reshape(-1, FSR_COUNT)
+    return m
+
+
+class Rollups:
+    """
+    Continuous per-device, per-bucket aggregates (count, sum, min, max, p95
+    for every series) at each resolution in WIDTHS, kept in `rollup_<res>`
+    tables.
+
+    run() folds new raw rows in by id, using the watermark in
+    meta.rollup_last_id. It stops at the first row whose bucket is still
+    open, so each bucket is normally computed once, from complete data, with
+    an exact p95. Rows that arrive late for a finished bucket, and buckets
+    forced out before a prune, are merged in. The merge is exact for
+    count/sum/min/max and approximate for p95. Rollups outlive the raw rows
+    that dumps prune. The COARSE tiers (1h, 1d) take every folded batch
+    without waiting for their bucket to close, so their p95 is a merge too.
+    expire() trims a tier to its retention in small batches.
+    """
+
+    def __init__(self, grace_s: float = ROLLUP_GRACE_S):
+        self.grace_us = int(grace_s * 1_000_000)
+        self.span_us = max(RESOLUTIONS.values())
+
+    def ensure(self, db):
+        for res in WIDTHS:
+            name = table(res)
+            cols = [c[1] for c in db.execute(f"PRAGMA table_info({name})").fetchall()]
+            if cols and "device" not in cols:
+                # Pre-device rollups keyed by bucket only: re-key them under the default device
+                db.execute(f"ALTER TABLE {name} RENAME TO {name}_old")
+                db.execute(ROLLUP_DDL.format(name=name))
+                db.execute(f"INSERT INTO {name} SELECT ?, * FROM {name}_old", (DEFAULT_DEVICE,))
+                db.execute(f"DROP TABLE {name}_old")
+            db.execute(ROLLUP_DDL.format(name=name))
+            db.execute(f"CREATE INDEX IF NOT EXISTS {name}_bucket ON {name} (bucket_us)")
+            if not cols and res in COARSE:
+                db.execute(_SEED_SQL.format(dst=name, w=COARSE[res]))
+        db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('rollup_last_id', 0)")
+
+    def watermark(self, db) -> int:
+        row = db.execute("SELECT value FROM meta WHERE key='rollup_last_id'").fetchone()
+        return int(row[0]) if row else 0
+
+    def run(self, db, parts, upto_id: Optional[int] = None, force: bool = False,
+            max_rows: int = 50000, now_us: Optional[int] = None) -> int:
+        """
+        Fold raw rows with watermark < id <= upto_id (default: newest) into the
+        rollups. Unless force, stop at the first row whose bucket has not closed
+        yet. Call inside the write transaction. Returns the number of rows folded;
+        a return of max_rows means there is more to do.
+        """
+        self.ensure(db)
+        wm = self.watermark(db)
+        upto = parts.last_id(db) if upto_id is None else int(upto_id)
+        if upto <= wm:
+            return 0
+        now_us = int(time.time() * 1_000_000) if now_us is None else int(now_us)
+        cutoff = (now_us - self.grace_us) // self.span_us * self.span_us
+        rows, stop = [], None
+        for r in parts.scan_ids(db, wm, upto, limit=max_rows, batch=5000):
+            # Timestamps beyond the wall clock (device clock skew) would stall the pass; fold them now
+            if not force and cutoff <= r["ts_us"] <= now_us + self.grace_us:
+                stop = r["id"]
+                break
+            rows.append(r)
+        if rows:
+            self.fold(db, rows)
+        new_wm = (stop - 1) if stop is not None else (rows[-1]["id"] if len(rows) >= max_rows else upto)
+        if new_wm > wm:
+            db.execute("UPDATE meta SET value=? WHERE key='rollup_last_id'", (new_wm,))
+        return len(rows)
+
+    def fold(self, db, rows: Sequence):
+        """Aggregate rows per (device, bucket) at every resolution and upsert the results."""
+        m = _matrix(rows)
+        ts = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+        names, dev = np.unique(np.array([r[6] for r in rows], dtype=object), return_inverse=True)
+        for res, width in WIDTHS.items():
+            # One sort on (device, bucket) so reduceat sees each group as a contiguous run
+            key = ts // width
+            order = np.lexsort((key, dev))
+            k, d, v = key[order], dev[order], m[order]
+            starts = np.flatnonzero(np.r_[True, (k[1:] != k[:-1]) | (d[1:] != d[:-1])])
+            ends = np.r_[starts[1:], len(k)]
+            sums = np.add.reduceat(v, starts)
+            mins = np.minimum.reduceat(v, starts)
+            maxs = np.maximum.reduceat(v, starts)
+            out = []
+            for i, (s, e) in enumerate(zip(starts, ends)):
+                p95 = np.percentile(v[s:e], 95, axis=0)
+                aggs = np.stack([sums[i], mins[i], maxs[i], p95], axis=1).ravel()
+                out.append((names[d[s]], int(k[s] * width), int(e - s), *aggs.tolist()))
+            db.executemany(_UPSERT_SQL.format(name=table(res)), out)
+
+    def expire(self, db, res: str, before_us: int, max_rows: int = 5000) -> int:
+        """Delete up to max_rows `res` buckets that start before before_us; returns how many."""
+        self.ensure(db)
+        return db.execute(f"DELETE FROM {table(res)} WHERE rowid IN (SELECT rowid FROM {table(res)} "
+                          f"WHERE bucket_us < ? LIMIT ?)", (int(before_us), int(max_rows))).rowcount
+
+    def info(self, db) -> Dict[str, Dict[str, Any]]:
+        """Per tier: buckets held and the oldest and newest bucket."""
+        out = {}
+        for res in WIDTHS:
+            n, lo, hi = db.execute(f"SELECT COUNT(*), MIN(bucket_us), MAX(bucket_us) FROM {table(res)}").fetchone()
+            out[res] = {"buckets": int(n), "oldest": us_to_iso(lo) if lo is not None else None,
+                        "newest": us_to_iso(hi) if hi is not None else None}
+        return out
+
+    def pick(self, db, from_us: Optional[int], to_us: Optional[int], max_buckets: int = 1000) -> str:
+        """
+        The finest tier that still holds from_us and answers [from_us, to_us]
+        in at most max_buckets buckets per device (res=auto).
+        """
+        hi = int(time.time() * 1_000_000) if to_us is None else int(to_us)
+        for res, width in sorted(WIDTHS.items(), key=lambda kv: kv[1]):
+            lo = db.execute(f"SELECT MIN(bucket_us) FROM {table(res)}").fetchone()[0]
+            if lo is None:
+                continue
+            start = int(lo) if from_us is None else int(from_us)
+            if (hi - start) // width <= max_buckets and (from_us is None or lo <= from_us):
+                return res
+        return max(WIDTHS, key=WIDTHS.get)
+
+    def skip_to(self, db, last_id: int):
+        """Never fold ids <= last_id in run() (they are folded elsewhere, e.g. by the migration)."""
+        self.ensure(db)
+        db.execute("UPDATE meta SET value=MAX(value, ?) WHERE key='rollup_last_id'", (int(last_id),))
+
+    def clear(self, db, last_id: int):
+        self.ensure(db)
+        for res in WIDTHS:
+            db.execute(f"DELETE FROM {table(res)}")
+        db.execute("UPDATE meta SET value=? WHERE key='rollup_last_id'", (int(last_id),))
+
+    def query(self, db, res: str, from_us: Optional[int] = None, to_us: Optional[int] = None,
+              limit: Optional[int] = None, device: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Buckets in ascending time order, shaped like the API items (mean instead of sum)."""
+        if res not in WIDTHS:
+            raise ValueError(f"res must be one of {', '.join(WIDTHS)}")
+        conds, params = [], []
+        if device is not None:
+            conds.append("device = ?"); params.append(device)
+        if from_us is not None:
+            conds.append("bucket_us >= ?"); params.append(int(from_us) // WIDTHS[res] * WIDTHS[res])
+        if to_us is not None:
+            conds.append("bucket_us <= ?"); params.append(int(to_us))
+        sql = f"SELECT * FROM {table(res)}" + ((" WHERE " + " AND ".join(conds)) if conds else "") + " ORDER BY bucket_us, device"
+        if limit is not None:
+            sql += " LIMIT ?"; params.append(int(limit))
+        try:
+            rows = db.execute(sql, params).fetchall()
+        except Exception as e:
+            if "no such table" in str(e):
+                return []
+            raise
+        return [self._item(r) for r in rows]
+
+    @staticmethod
+    def _item(r) -> Dict[str, Any]:
+        n = int(r["n"])
+        item = {"ts": us_to_iso(r["bucket_us"]), "device": r["device"], "n": n}
+        for k in SERIES[:3]:
+            item[k] = {"mean": round(r[f"{k}_sum"] / n, 3), "min": r[f"{k}_min"],
+                       "max": r[f"{k}_max"], "p95": round(r[f"{k}_p95"], 3)}
+        fsr = [f"fsr{i}" for i in range(1, FSR_COUNT + 1)]
+        item["fsr"] = {"mean": [round(r[f"{k}_sum"] / n, 2) for k in fsr],
+                       "min": [int(r[f"{k}_min"]) for k in fsr], "max": [int(r[f"{k}_max"]) for k in fsr],
+                       "p95": [round(r[f"{k}_p95"], 2) for k in fsr]}
+        return item
@@ -0,0 +1,140 @@
+# server/scheduler.py
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, single-process only
+    fcntl = None
+
+
+class FileLock:
+    """
+    Exclusive flock(2) on a file. Every acquire() opens its own descriptor,
+    so it excludes other threads as well as other processes. The kernel drops
+    the lock when its holder exits or dies, so there is no lease to expire
+    and no clock to trust. Without fcntl it falls back to an in-process lock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._mutex = threading.Lock()
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if fcntl is None:
+            return self._mutex.acquire(blocking)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._local.fd = fd
+        return True
+
+    def release(self):
+        if fcntl is None:
+            self._mutex.release()
+            return
+        fd, self._local.fd = self._local.fd, None
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def note(self, text: str):
+        """Record who holds the lock in the lock file itself (call while holding it)."""
+        fd = getattr(self._local, "fd", None)
+        if fd is not None:
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, text.encode("utf-8"), 0)
+
+    def read_note(self) -> Optional[str]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def _iso(t: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(t, timezone.utc).isoformat() if t else None
+
+
+class Scheduler:
+    """
+    Background jobs that must run in exactly one process. Every process that
+    serves the app (each gunicorn worker, the dev server) starts one on the
+    same lock file. The process that takes the lock is the leader and runs the
+    jobs. The others block on the lock and take over the moment the leader
+    exits or dies.
+    """
+
+    def __init__(self, lock_path: str):
+        self.lock = FileLock(lock_path)
+        self.jobs: List[Dict[str, Any]] = []
+        self._elected: List[Callable[[bool], None]] = []
+        self._thread: Optional[threading.Thread] = None
+        self.leader_since: Optional[float] = None
+
+    def every(self, name: str, interval_s: Union[float, Callable[[], float]], fn: Callable[[], None]):
+        """Run fn now and then every interval_s (a number, or a callable read before each sleep) while leader."""
+        self.jobs.append({"name": name, "interval": interval_s, "fn": fn,
+                          "runs": 0, "errors": 0, "last_error": None, "last_run": None})
+
+    def on_elected(self, fn: Callable[[bool], None]):
+        """fn(first_try) runs once, before the jobs start; first_try is False after a takeover."""
+        self._elected.append(fn)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._campaign, name="scheduler", daemon=True)
+            self._thread.start()
+
+    @property
+    def is_leader(self) -> bool:
+        return self.leader_since is not None
+
+    def _campaign(self):
+        first_try = self.lock.acquire(blocking=False)
+        if not first_try:
+            self.lock.acquire()
+        self.lock.note(f"{socket.gethostname()} pid={os.getpid()}")
+        self.leader_since = time.time()
+        print(f"[scheduler] pid {os.getpid()} is the leader ({'startup' if first_try else 'takeover'})", flush=True)
+        for fn in self._elected:
+            try:
+                fn(first_try)
+            except Exception as e:
+                print(f"[scheduler] on_elected failed: {e}", flush=True)
+        for job in self.jobs:
+            threading.Thread(target=self._loop, args=(job,), name=f"job-{job['name']}", daemon=True).start()
+
+    def _loop(self, job: Dict[str, Any]):
+        while True:
+            try:
+                job["fn"]()
+                job["runs"] += 1
+            except Exception as e:
+                job["errors"] += 1
+                job["last_error"] = str(e)
+                print(f"[scheduler] {job['name']} failed: {e}", flush=True)
+            job["last_run"] = time.time()
+            interval = job["interval"]() if callable(job["interval"]) else job["interval"]
+            time.sleep(max(0.1, float(interval)))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"leader": self.is_leader, "pid": os.getpid(), "holder": self.lock.read_note(),
+                "leader_since": _iso(self.leader_since),
+                "jobs": {j["name"]: {"runs": j["runs"], "errors": j["errors"], "last_error": j["last_error"],
+                                     "last_run": _iso(j["last_run"])} for j in self.jobs}}
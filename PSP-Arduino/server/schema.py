@@ -0,0 +1,169 @@
+# server/schema.py
+import re
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List
+
+# Sample layout (v2 row format, v3 = time-partitioned, v4 = per-device):
+#   id     INTEGER  global, monotonic across partitions (allocated from meta.last_id)
+#   ts_us  INTEGER  epoch microseconds (UTC), indexed
+#   fsr    BLOB     FSR_COUNT bytes, one uint8 (0..100) per channel
+#   t1_c, t2_c REAL, volume INTEGER
+#   device TEXT     pillow id, indexed with ts_us; older rows are DEFAULT_DEVICE
+# Rows live in per-window tables (samples_YYYYMMDDHH / samples_YYYYMMDD)
+# registered in the `partitions` catalog; see partitions.py.
+SCHEMA_VERSION = 4
+FSR_COUNT = 8
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+DEFAULT_DEVICE = "default"
+# Device ids end up in dump paths, so keep them filename-safe
+DEVICE_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+PARTITION_DDL = (
+    """
+CREATE TABLE IF NOT EXISTS {name} (
+  id INTEGER PRIMARY KEY,
+  ts_us INTEGER NOT NULL,
+  fsr BLOB NOT NULL,
+  t1_c REAL NOT NULL,
+  t2_c REAL NOT NULL,
+  volume INTEGER NOT NULL,
+  device TEXT NOT NULL DEFAULT 'default'
+)""",
+    "CREATE INDEX IF NOT EXISTS idx_{name}_ts ON {name}(ts_us)",
+    "CREATE INDEX IF NOT EXISTS idx_{name}_dev_ts ON {name}(device, ts_us)",
+)
+
+CATALOG_DDL = (
+    """
+CREATE TABLE IF NOT EXISTS partitions (
+  name TEXT PRIMARY KEY,
+  start_us INTEGER NOT NULL,
+  end_us INTEGER NOT NULL,
+  gen INTEGER NOT NULL DEFAULT 0
+)""",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+)
+
+INSERT_SQL = "INSERT INTO {name} (id, ts_us, fsr, t1_c, t2_c, volume, device) VALUES (?,?,?,?,?,?,?)"
+INSERT_OR_IGNORE_SQL = "INSERT OR IGNORE INTO {name} (id, ts_us, fsr, t1_c, t2_c, volume, device) VALUES (?,?,?,?,?,?,?)"
+
+# Pre-partitioning tables, renamed out of the way on startup:
+#   samples_v1  ISO TEXT ts, fsr1..fsr8 INTEGER columns
+#   samples_v2  single `samples` table in the v2 row format
+LEGACY_TABLES = ("samples_v1", "samples_v2")
+
+
+def iso_to_us(ts_iso: str) -> int:
+    dt = datetime.fromisoformat(str(ts_iso).replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    d = dt - EPOCH
+    return (d.days * 86400 + d.seconds) * 1_000_000 + d.microseconds
+
+
+def us_to_iso(ts_us: int) -> str:
+    return (EPOCH + timedelta(microseconds=int(ts_us))).isoformat(timespec="microseconds")
+
+
+def us_to_dt(ts_us: int) -> datetime:
+    return EPOCH + timedelta(microseconds=int(ts_us))
+
+
+def pack_fsr(fsr: List[int]) -> bytes:
+    return bytes(fsr)
+
+
+def unpack_fsr(blob: bytes) -> List[int]:
+    return list(blob)
+
+
+def parse_device(v) -> str:
+    """Device id from a payload/query value; missing → DEFAULT_DEVICE."""
+    if v is None or v == "":
+        return DEFAULT_DEVICE
+    v = str(v).strip()
+    if not DEVICE_RE.match(v):
+        raise ValueError(f"bad device id {v!r} (letters, digits, _ . - ; max 64)")
+    return v
+
+
+def sample_row(ts_iso: str, fsr: List[int], t1_c: float, t2_c: float, vol: int,
+               device: str = DEFAULT_DEVICE) -> tuple:
+    """Validated sample → (ts_us, fsr, t1_c, t2_c, volume, device) row values (no id yet)."""
+    return (iso_to_us(ts_iso), pack_fsr(fsr), float(t1_c), float(t2_c), int(vol), device)
+
+
+def row_to_item(r) -> Dict[str, Any]:
+    """Stored row → the JSON item shape the API has always emitted."""
+    return {"ts": us_to_iso(r["ts_us"]), "fsr": unpack_fsr(r["fsr"]),
+            "t1_c": float(r["t1_c"]), "t2_c": float(r["t2_c"]), "volume": int(r["volume"]),
+            "device": r["device"]}
+
+
+def _columns(conn, table: str) -> List[str]:
+    return [c[1] for c in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def pending_legacy(conn) -> List[str]:
+    return [t for t in LEGACY_TABLES if _columns(conn, t)]
+
+
+def legacy_rows(conn, table: str, after_id: int, limit: int) -> List[tuple]:
+    """Next chunk of a legacy table as (id, ts_us, fsr, t1_c, t2_c, volume, device) tuples."""
+    if table == "samples_v1":
+        cols = ", ".join(f"fsr{i}" for i in range(1, FSR_COUNT + 1))
+        rows = conn.execute(f"SELECT id, ts, {cols}, t1_c, t2_c, volume FROM {table} "
+                            "WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)).fetchall()
+        out = []
+        for r in rows:
+            fsr = [max(0, min(100, int(r[2 + i]))) for i in range(FSR_COUNT)]
+            out.append((r[0], *sample_row(r[1], fsr, r[-3], r[-2], r[-1])))
+        return out
+    return [(*r, DEFAULT_DEVICE) for r in conn.execute(
+        f"SELECT id, ts_us, fsr, t1_c, t2_c, volume FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+        (after_id, limit)).fetchall()]
+
+
+def ensure_schema(conn) -> List[str]:
+    """
+    Create the partition catalog and bring existing partitions up to the
+    current row layout. An un-partitioned `samples` table (v1 or v2
+    layout) is renamed to samples_v1/samples_v2 so ingest can switch over
+    immediately; its rows are copied across later by migrate_db.migrate().
+    New ids continue after the old ones. Returns legacy tables still pending.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    fresh = not conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0]
+    if fresh:
+        # Lets partition drops hand pages back to the OS without a full VACUUM
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cols = _columns(conn, "samples")
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for stmt in CATALOG_DDL:
+            conn.execute(stmt)
+        if cols:
+            legacy = "samples_v1" if "fsr1" in cols else "samples_v2"
+            seq = conn.execute("SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name='samples'), 0), "
+                               "COALESCE((SELECT MAX(id) FROM samples), 0))").fetchone()[0]
+            conn.execute(f"ALTER TABLE samples RENAME TO {legacy}")
+            conn.execute("INSERT INTO meta (key, value) VALUES ('last_id', ?) "
+                         "ON CONFLICT(key) DO UPDATE SET value=MAX(value, excluded.value)", (seq,))
+            print(f"[schema] un-partitioned samples table renamed to {legacy} (max id {seq})", flush=True)
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('last_id', 0)")
+        # Partition generations (partitions.py) move on every ranged delete, so caches re-read only those
+        if "gen" not in _columns(conn, "partitions"):
+            conn.execute("ALTER TABLE partitions ADD COLUMN gen INTEGER NOT NULL DEFAULT 0")
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('partition_gen', 0)")
+        # v3 → v4: partitions gain a device column (constant default, so no table rewrite)
+        for (name,) in conn.execute("SELECT name FROM partitions").fetchall():
+            if "device" not in _columns(conn, name):
+                conn.execute(f"ALTER TABLE {name} ADD COLUMN device TEXT NOT NULL DEFAULT '{DEFAULT_DEVICE}'")
+                conn.execute(PARTITION_DDL[2].format(name=name))
+        conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return pending_legacy(conn)
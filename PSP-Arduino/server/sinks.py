@@ -0,0 +1,428 @@
+# server/sinks.py
+"""
+Where dumps go. A dump is serialized once into a local outbox batch and then
+handed to every configured sink in parallel:
+
+  github  the GitHub repo (Git Data API; one commit per batch)
+  local   a directory on this machine, rotated after N days
+  s3      a prefix in an S3-compatible bucket (AWS, MinIO, fake_s3.py)
+
+Each sink has its own single-thread queue, lock, failure count and backoff,
+so a slow or failing remote holds back only itself. The rows of a batch can
+be pruned from SQLite once a quorum of sinks acknowledged it (quorum_id);
+the batch files stay in the outbox until the remaining sinks have them too.
+
+All sinks write the same layout under their root: the dump files at their
+dump-folder path plus the day manifest (manifests/YYYY-MM-DD.json).
+"""
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import threading
+import time
+import urllib.parse
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Sequence, Union
+
+import requests
+
+from dump_format import file_sha256, merge_manifest
+from scheduler import FileLock
+
+SINK_NAMES = ("github", "local", "s3")
+
+
+def _iso(t: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(t, timezone.utc).isoformat() if t else None
+
+
+def _read_all(body: Union[bytes, BinaryIO]) -> bytes:
+    if isinstance(body, bytes):
+        return body
+    body.seek(0)
+    return body.read()
+
+
+def _sha256(body: Union[bytes, BinaryIO]) -> str:
+    return hashlib.sha256(body).hexdigest() if isinstance(body, bytes) else file_sha256(body)
+
+
+def _refuse_overwrite(writes: Dict[str, Union[bytes, BinaryIO]], fresh: Sequence[str],
+                     existing: Callable[[str], Optional[str]]) -> None:
+    """
+    Raise if a path in `fresh` already exists (existing(rel) → its sha256, or
+    None) with other content. The same content is a re-delivery and passes.
+    Called before anything is written, so a refused batch changes nothing.
+    """
+    clash = [rel for rel in fresh if existing(rel) not in (None, _sha256(writes[rel]))]
+    if clash:
+        raise RuntimeError(f"refusing to overwrite {', '.join(sorted(clash))}: already there with other content")
+
+
+# ---------- folders: list / read / replace under one root ----------
+
+class LocalFolder:
+    """A directory, e.g. a checkout of the dump folder. keep_days > 0 deletes files older than that on each write."""
+
+    def __init__(self, root: str, keep_days: float = 0):
+        self.root, self.keep_days = root, float(keep_days)
+
+    def list(self) -> List[str]:
+        out = []
+        for d, _, names in os.walk(self.root):
+            rel = os.path.relpath(d, self.root)
+            out += [n if rel == "." else f"{rel.replace(os.sep, '/')}/{n}" for n in names]
+        return out
+
+    def read(self, rel: str) -> Optional[bytes]:
+        try:
+            with open(os.path.join(self.root, rel), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _existing_sha256(self, rel: str) -> Optional[str]:
+        try:
+            with open(os.path.join(self.root, rel), "rb") as f:
+                return file_sha256(f)
+        except FileNotFoundError:
+            return None
+
+    def replace(self, writes: Dict[str, Union[bytes, BinaryIO]], drops: Sequence[str], message: str,
+                fresh: Sequence[str] = ()) -> None:
+        _refuse_overwrite(writes, fresh, self._existing_sha256)
+        for rel, body in writes.items():
+            path = os.path.join(self.root, rel)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                if isinstance(body, bytes):
+                    f.write(body)
+                else:
+                    body.seek(0)
+                    shutil.copyfileobj(body, f, 1 << 16)
+            os.replace(path + ".tmp", path)
+        for rel in drops:
+            os.remove(os.path.join(self.root, rel))
+        if self.keep_days > 0:
+            self.rotate(time.time() - self.keep_days * 86400)
+
+    def rotate(self, cutoff: float) -> int:
+        removed = 0
+        for rel in self.list():
+            path = os.path.join(self.root, rel)
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        return removed
+
+
+class RepoFolder:
+    """A folder on the GitHub branch; replace() is a single commit."""
+
+    def __init__(self, gh, folder: str):
+        self.gh, self.folder = gh, folder.strip("/")
+        self._shas: Dict[str, str] = {}
+
+    def list(self) -> List[str]:
+        prefix = self.folder + "/"
+        self._shas = {e["path"][len(prefix):]: e["sha"] for e in self.gh.tree(self.gh.commit_tree(self.gh.head()))
+                      if e.get("type") == "blob" and e.get("path", "").startswith(prefix)}
+        return list(self._shas)
+
+    def read(self, rel: str) -> Optional[bytes]:
+        # Listed files are read by blob sha, from the listed snapshot; anything else at the branch head
+        sha = self._shas.get(rel)
+        return self.gh.read_blob(sha) if sha else self.gh.read_file(f"{self.folder}/{rel}")
+
+    def replace(self, writes: Dict[str, Union[bytes, BinaryIO]], drops: Sequence[str], message: str,
+                fresh: Sequence[str] = ()) -> str:
+        changes = [(f"{self.folder}/{rel}", self.gh.blob(body)) for rel, body in writes.items()]
+        changes += [(f"{self.folder}/{rel}", None) for rel in drops]
+        return self.gh.commit_changes(changes, message, fresh=[f"{self.folder}/{rel}" for rel in fresh])
+
+
+def sigv4_headers(method: str, url: str, headers: Dict[str, str], payload_sha256: str, access_key: str,
+                  secret_key: str, region: str, service: str = "s3", now: Optional[datetime] = None) -> Dict[str, str]:
+    """AWS Signature Version 4: headers plus x-amz-date, x-amz-content-sha256 and Authorization, all signed."""
+    now = now or datetime.now(timezone.utc)
+    amz_date, day = now.strftime("%Y%m%dT%H%M%SZ"), now.strftime("%Y%m%d")
+    u = urllib.parse.urlsplit(url)
+    headers = {**headers, "host": u.netloc, "x-amz-date": amz_date, "x-amz-content-sha256": payload_sha256}
+    canon = {k.lower(): " ".join(str(v).split()) for k, v in headers.items()}
+    signed = ";".join(sorted(canon))
+    query = "&".join(f"{urllib.parse.quote(k, safe='-_.~')}={urllib.parse.quote(v, safe='-_.~')}"
+                     for k, v in sorted(urllib.parse.parse_qsl(u.query, keep_blank_values=True)))
+    request = "\n".join([method, urllib.parse.quote(u.path or "/", safe="/-_.~"), query,
+                         "".join(f"{k}:{canon[k]}\n" for k in sorted(canon)), signed, payload_sha256])
+    scope = f"{day}/{region}/{service}/aws4_request"
+    to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(request.encode()).hexdigest()])
+    key = ("AWS4" + secret_key).encode()
+    for part in (day, region, service, "aws4_request"):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    signature = hmac.new(key, to_sign.encode(), hashlib.sha256).hexdigest()
+    headers["Authorization"] = f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, SignedHeaders={signed}, Signature={signature}"
+    return headers
+
+
+class S3Folder:
+    """A key prefix in an S3-compatible bucket: path-style URLs, SigV4, one pooled session."""
+
+    def __init__(self, endpoint: str, bucket: str, prefix: str, access_key: str, secret_key: str,
+                 region: str = "us-east-1", timeout_s: float = 30):
+        self.endpoint, self.bucket, self.prefix = endpoint.rstrip("/"), bucket, prefix.strip("/")
+        self.access_key, self.secret_key, self.region, self.timeout_s = access_key, secret_key, region, float(timeout_s)
+        self.session = requests.Session()
+
+    def _url(self, rel: str) -> str:
+        key = f"{self.prefix}/{rel}" if self.prefix else rel
+        return f"{self.endpoint}/{self.bucket}/{urllib.parse.quote(key, safe='/-_.~')}"
+
+    def _request(self, method: str, rel: str, body: bytes = b"", ok=(200,)) -> requests.Response:
+        url = self._url(rel)
+        headers = sigv4_headers(method, url, {}, hashlib.sha256(body).hexdigest(), self.access_key,
+                                self.secret_key, self.region)
+        r = self.session.request(method, url, data=body or None, headers=headers, timeout=self.timeout_s)
+        if r.status_code not in ok:
+            raise RuntimeError(f"S3 {method} {rel} failed {r.status_code}: {r.text[:300]}")
+        return r
+
+    def read(self, rel: str) -> Optional[bytes]:
+        r = self._request("GET", rel, ok=(200, 404))
+        return r.content if r.status_code == 200 else None
+
+    def _existing_sha256(self, rel: str) -> Optional[str]:
+        body = self.read(rel)
+        return None if body is None else _sha256(body)
+
+    def replace(self, writes: Dict[str, Union[bytes, BinaryIO]], drops: Sequence[str], message: str,
+                fresh: Sequence[str] = ()) -> None:
+        _refuse_overwrite(writes, fresh, self._existing_sha256)
+        # In the given order: the caller puts the manifest last, so it never lists a missing object
+        for rel, body in writes.items():
+            self._request("PUT", rel, _read_all(body))
+        for rel in drops:
+            self._request("DELETE", rel, ok=(200, 204))
+
+
+# ---------- outbox ----------
+
+def _write_json(path: str, obj: Any):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+class Outbox:
+    """
+    Sealed dump batches on local disk until every sink has them. A batch is a
+    directory named by its last row id, holding the dump files (at their
+    paths under the dump folder) and batch.json:
+      {"from_id", "upto", "rows", "label", "message", "manifest", "files": {path: entry}, "acked": [sink, ...]}
+    Batches are written under a .tmp- name and renamed when complete, so a
+    crash mid-dump leaves nothing a sink would pick up.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = FileLock(os.path.join(root, ".lock"))   # batch.json updates come from any worker
+
+    def begin(self) -> str:
+        path = os.path.join(self.root, f".tmp-{os.getpid()}-{time.time_ns()}")
+        os.makedirs(path)
+        return path
+
+    def create(self, tmp: str, rel: str) -> BinaryIO:
+        path = os.path.join(tmp, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return open(path, "w+b")
+
+    def discard_unsealed(self):
+        """Drop half-written batches (call while holding the dump lock, so none is being written)."""
+        for name in os.listdir(self.root):
+            if name.startswith(".tmp-"):
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+    def seal(self, tmp: str, meta: Dict[str, Any]) -> str:
+        name = "%015d" % int(meta["upto"])
+        _write_json(os.path.join(tmp, "batch.json"), {**meta, "acked": []})
+        os.rename(tmp, os.path.join(self.root, name))
+        return name
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def load(self, name: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.root, name, "batch.json"), "r", encoding="utf-8") as f:
+                return {**json.load(f), "name": name}
+        except FileNotFoundError:
+            return None
+
+    def names(self) -> List[str]:
+        return sorted(n for n in os.listdir(self.root) if not n.startswith("."))
+
+    def batches(self) -> List[Dict[str, Any]]:
+        return [b for b in (self.load(n) for n in self.names()) if b is not None]
+
+    def last_upto(self) -> int:
+        names = self.names()
+        return int(names[-1]) if names else 0
+
+    def ack(self, name: str, sink: str, sinks: Sequence[str]):
+        """Record that sink has the batch; drop the batch once every configured sink has it."""
+        with self._lock:
+            meta = self.load(name)
+            if meta is None:
+                return
+            meta["acked"] = sorted(set(meta["acked"]) | {sink})
+            if set(sinks) <= set(meta["acked"]):
+                shutil.rmtree(self.path(name), ignore_errors=True)
+            else:
+                _write_json(os.path.join(self.path(name), "batch.json"), {k: v for k, v in meta.items() if k != "name"})
+
+    def gc(self, sinks: Sequence[str]):
+        """Drop batches nothing is waiting for any more (a sink was removed from the config)."""
+        for b in self.batches():
+            if set(sinks) <= set(b["acked"]):
+                with self._lock:
+                    shutil.rmtree(self.path(b["name"]), ignore_errors=True)
+
+    def quorum_id(self, sinks: Sequence[str], quorum: int, watermark: int) -> int:
+        """Highest row id such that every batch at or below it was acked by at least quorum of sinks."""
+        for b in self.batches():
+            if len(set(b["acked"]) & set(sinks)) < quorum:
+                return int(b["from_id"])
+        return watermark
+
+
+# ---------- sinks ----------
+
+class Sink:
+    """
+    One destination with its own queue (a single worker thread, so batches
+    arrive in order), a cross-process lock (one delivery at a time, and a
+    batch another worker already delivered is skipped) and backoff.
+    """
+
+    def __init__(self, name: str, folder: Callable[[], Any], lock_path: str, ready: Callable[[], bool] = lambda: True,
+                 backoff_s: float = 5, backoff_max_s: float = 600):
+        self.name, self.folder, self.ready = name, folder, ready
+        self.lock = FileLock(lock_path)
+        self.backoff_s, self.backoff_max_s = float(backoff_s), float(backoff_max_s)
+        self.queue = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"sink-{name}")
+        self.inflight: set = set()
+        self._mutex = threading.Lock()
+        self.delivered = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_ok: Optional[float] = None
+        self.next_try = 0.0
+
+    def put(self, outbox: Outbox, batch: Dict[str, Any]):
+        """Batch files, then the merged day manifest last, through the sink's folder."""
+        folder = self.folder()
+        writes: Dict[str, Any] = {}
+        try:
+            for rel in batch["files"]:
+                writes[rel] = open(os.path.join(outbox.path(batch["name"]), rel), "rb")
+            writes[batch["manifest"]] = merge_manifest(folder.read(batch["manifest"]), batch["files"])
+            # Dump files are never overwritten; only the manifest is merged and replaced
+            folder.replace(writes, [], batch["message"], fresh=list(batch["files"]))
+        finally:
+            for body in writes.values():
+                if hasattr(body, "close"):
+                    body.close()
+
+    def submit(self, outbox: Outbox, name: str, sinks: Sequence[str],
+               on_ack: Optional[Callable[[], None]] = None) -> Optional[Future]:
+        """Queue one delivery; None if this batch is already queued here."""
+        with self._mutex:
+            if name in self.inflight:
+                return None
+            self.inflight.add(name)
+        return self.queue.submit(self._deliver, outbox, name, sinks, on_ack)
+
+    def _deliver(self, outbox: Outbox, name: str, sinks: Sequence[str], on_ack) -> bool:
+        try:
+            if not self.ready():
+                raise RuntimeError("not configured")
+            with self.lock:
+                batch = outbox.load(name)
+                if batch is None or self.name in batch["acked"]:
+                    return True
+                self.put(outbox, batch)
+                outbox.ack(name, self.name, sinks)
+            self.delivered += 1
+            self.failures, self.last_error, self.last_ok, self.next_try = 0, None, time.time(), 0.0
+            print(f"[sink] {self.name}: batch {name} delivered ({len(batch['files'])} file(s), {batch['rows']} rows)", flush=True)
+            if on_ack is not None:
+                on_ack()
+            return True
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            self.next_try = time.time() + min(self.backoff_max_s, self.backoff_s * 2 ** (self.failures - 1))
+            print(f"[sink] {self.name}: batch {name} failed ({self.failures} in a row): {e}", flush=True)
+            return False
+        finally:
+            with self._mutex:
+                self.inflight.discard(name)
+
+    def backing_off(self) -> bool:
+        return self.failures > 0 and time.time() < self.next_try
+
+
+class Sinks:
+    """The configured sinks, delivering batches from one outbox."""
+
+    def __init__(self, outbox: Outbox, sinks: Sequence[Sink], quorum: int):
+        self.outbox, self.sinks = outbox, list(sinks)
+        self.quorum = max(1, min(int(quorum), len(self.sinks))) if self.sinks else 0
+
+    @property
+    def names(self) -> List[str]:
+        return [s.name for s in self.sinks]
+
+    def ready(self) -> bool:
+        return sum(1 for s in self.sinks if s.ready()) >= self.quorum > 0
+
+    def publish(self, name: str) -> int:
+        """
+        Send a sealed batch to every sink that is not backing off, in
+        parallel. Returns as soon as a quorum acknowledged it (or every
+        attempt finished); slower sinks keep going on their own threads.
+        Returns the number of acknowledgements seen.
+        """
+        pending = {f for f in (s.submit(self.outbox, name, self.names) for s in self.sinks if not s.backing_off()) if f}
+        acks = 0
+        while pending and acks < self.quorum:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            acks += sum(1 for f in done if f.result())
+        return acks
+
+    def retry(self, on_ack: Optional[Callable[[], None]] = None) -> int:
+        """Queue every batch a sink is missing (sinks past their backoff only). Returns deliveries queued."""
+        queued = 0
+        batches = self.outbox.batches()
+        for s in self.sinks:
+            if s.backing_off():
+                continue
+            for b in batches:
+                if s.name not in b["acked"] and s.submit(self.outbox, b["name"], self.names, on_ack) is not None:
+                    queued += 1
+        self.outbox.gc(self.names)
+        return queued
+
+    def stats(self) -> Dict[str, Any]:
+        batches = self.outbox.batches()
+        return {"quorum": self.quorum, "outbox_batches": len(batches),
+                "sinks": {s.name: {"ready": s.ready(), "pending": sum(1 for b in batches if s.name not in b["acked"]),
+                                   "delivered": s.delivered, "failures": s.failures, "last_error": s.last_error,
+                                   "last_ok": _iso(s.last_ok), "next_try": _iso(s.next_try) if s.backing_off() else None}
+                          for s in self.sinks}}
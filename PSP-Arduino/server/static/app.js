@@ -2,45 +2,46 @@
 function clamp(x,min,max){return Math.max(min,Math.min(max,x));}
 const FSR_COUNT = 8;
 const POS_KEY = 'fsr_positions_v2_8chs';
+// One dashboard per pillow: /?device=bed-12 (no parameter = newest sample from any device)
+const DEVICE = new URLSearchParams(location.search).get('device') || '';
+const DEV_Q = DEVICE ? 'device='+encodeURIComponent(DEVICE) : '';
 
 let dumpingNow = false;
-let autoRowsLastTriggered = 0;
-
-function getRowsThreshold(){
-  const v = parseInt(document.getElementById('dump-interval').value || '10', 10);
-  return Math.max(1, v);
-}
 
 async function fetchLatest(){
   try{
-    const r = await fetch('/api/latest?t='+Date.now());
-    const d = await r.json();
-    if(!d.ready){
-      document.getElementById('status').textContent='Waiting for data…';
-      return;
-    }
-    document.getElementById('timestamp').textContent=new Date(d.ts||d.ts).toLocaleString();
-    const a = Array.isArray(d.fsr_pct)&&d.fsr_pct.length===FSR_COUNT?d.fsr_pct:Array(FSR_COUNT).fill(0);
-    for(let i=0;i<FSR_COUNT;i++){
-      const el = document.getElementById('fsr'+i);
-      if(!el) continue;
-      const v = clamp(Math.round(a[i]), 0, 100);
-      const valEl = el.querySelector('.fsr-value') || el;
-      valEl.textContent = String(v);
-      setFSRVisual(el, v);
-    }
-    let vol=Number(d.volume);
-    if(!Number.isFinite(vol)) vol=0;
-    vol=clamp(Math.round(vol),0,100);
-    document.getElementById('volume-bar').style.width=vol+'%';
-    document.getElementById('volume-label').textContent=String(vol);
-    document.getElementById('t1').textContent=(typeof d.t1_c==='number')?d.t1_c:'--';
-    document.getElementById('t2').textContent=(typeof d.t2_c==='number')?d.t2_c:'--';
+    // no-cache → the browser revalidates with If-None-Match and gets a 304 when nothing changed
+    const r = await fetch('/api/latest'+(DEV_Q?'?'+DEV_Q:''), {cache:'no-cache'});
+    renderLatest(await r.json());
   }catch(e){
     document.getElementById('status').textContent='Disconnected…';
   }
 }
 
+function renderLatest(d){
+  if(!d.ready){
+    document.getElementById('status').textContent='Waiting for data…';
+    return;
+  }
+  document.getElementById('timestamp').textContent=new Date(d.ts||d.ts).toLocaleString();
+  const a = Array.isArray(d.fsr_pct)&&d.fsr_pct.length===FSR_COUNT?d.fsr_pct:Array(FSR_COUNT).fill(0);
+  for(let i=0;i<FSR_COUNT;i++){
+    const el = document.getElementById('fsr'+i);
+    if(!el) continue;
+    const v = clamp(Math.round(a[i]), 0, 100);
+    const valEl = el.querySelector('.fsr-value') || el;
+    valEl.textContent = String(v);
+    setFSRVisual(el, v);
+  }
+  let vol=Number(d.volume);
+  if(!Number.isFinite(vol)) vol=0;
+  vol=clamp(Math.round(vol),0,100);
+  document.getElementById('volume-bar').style.width=vol+'%';
+  document.getElementById('volume-label').textContent=String(vol);
+  document.getElementById('t1').textContent=(typeof d.t1_c==='number')?d.t1_c:'--';
+  document.getElementById('t2').textContent=(typeof d.t2_c==='number')?d.t2_c:'--';
+}
+
 function setFSRVisual(el, value){
   const v = clamp(Number(value)||0, 0, 100);
   const f = v / 100;
@@ -146,26 +147,34 @@ function renderTempChart(items){
 
 async function fetchHistoryAndRender(){
   try{
-    const r=await fetch('/api/history?limit=3600&t='+Date.now());
+    // Server downsamples to roughly the chart's pixel width
+    const r=await fetch('/api/history?limit=3600&points=800&series=t1_c,t2_c'+(DEV_Q?'&'+DEV_Q:''), {cache:'no-cache'});
     const d=await r.json();
-    if(d&&Array.isArray(d.items)) renderTempChart(d.items);
+    if(d&&Array.isArray(d.items)){
+      // Without ?device the server downsamples each pillow separately; chart the one that reported last
+      const dev = DEVICE || (d.items[0]||{}).device;
+      renderTempChart(d.items.filter(it=>it.device===dev).map(it=>Object.assign({},it,{ts:Date.parse(it.ts)})));
+    }
   }catch(e){}
 }
 
 async function fetchStats(){
   try{
-    const r=await fetch('/api/stats?t='+Date.now());
-    const d=await r.json();
-    const total=(typeof d.total==='number')?d.total:0;
-    const last=d.last_ts?new Date(d.last_ts).toLocaleString():'n/a';
-    document.getElementById('status').textContent=`Receiving data — rows: ${total} (last: ${last})`;
-    const enabled = !!document.getElementById('dump-enabled').checked;
-    if(enabled) maybeTriggerThresholdDump(total);
+    const r=await fetch('/api/stats?t='+Date.now()+(DEV_Q?'&'+DEV_Q:''));
+    renderStats(await r.json());
   }catch(e){
     document.getElementById('status').textContent='Disconnected…';
   }
 }
 
+function renderStats(d){
+  // Stream stats events cover the whole ward; pick this pillow's counters out of them
+  if(DEVICE && d.devices) d = d.devices[DEVICE] || {total:0, last_ts:null};
+  const total=(typeof d.total==='number')?d.total:0;
+  const last=d.last_ts?new Date(d.last_ts).toLocaleString():'n/a';
+  document.getElementById('status').textContent=`Receiving data — rows: ${total} (last: ${last})`;
+}
+
 async function clearDataUI(){
   const svg=document.getElementById('temp-chart'); if(svg) svg.innerHTML='';
   for(let i=0;i<FSR_COUNT;i++){
@@ -269,7 +278,8 @@ async function loadDumpConfig(){
     const res=await fetch('/api/dump-config');
     const data=await res.json();
     document.getElementById('dump-enabled').checked=!!data.enabled;
-    document.getElementById('dump-interval').value = data.interval_seconds || 10;
+    // The server dumps when this many rows are pending (or after interval_seconds), once for all tabs
+    document.getElementById('dump-interval').value = data.max_rows || '';
     document.getElementById('dump-path').value = data.path || 'PSP-Arduino/Data';
     document.getElementById('dump-info').textContent =
       `Repo: ${data.repo} | Branch: ${data.branch} | Token set: ${data.has_token ? 'yes' : 'no'}`;
@@ -281,47 +291,135 @@ async function loadDumpConfig(){
 async function loadDumpStatus(){
   try{
     const res=await fetch('/api/dump-status?t='+Date.now());
-    const data=await res.json();
-    const last=data.last||{};
-    const when=last.when?new Date(last.when).toLocaleString():'never';
-    const ok=last.ok===true?'success':(last.ok===false?'failed':'n/a');
-    const hint=last.message?` — ${last.message}`:'';
-    const file=last.filename?` — ${last.filename}`:'';
-    document.getElementById('dump-last').textContent=
-      `Last attempt: ${when} (${last.type||'n/a'} → ${ok})${file}${hint}`;
+    renderDumpStatus(await res.json());
   }catch(e){
     document.getElementById('dump-last').textContent='No dump status available.';
   }
 }
 
+function renderDumpStatus(data){
+  const last=data.last||{};
+  const when=last.when?new Date(last.when).toLocaleString():'never';
+  const ok=last.ok===true?'success':(last.ok===false?'failed':'n/a');
+  const hint=last.message?` — ${last.message}`:'';
+  const file=last.filename?` — ${last.filename}`:'';
+  document.getElementById('dump-last').textContent=
+    `Last attempt: ${when} (${last.type||'n/a'} → ${ok})${file}${hint}`;
+}
+
+// Live updates: one /api/stream connection replaces the 1 s polls. Polling is
+// only used when EventSource is unavailable or the stream keeps failing.
+let pollTimers = [];
+let historyTimer = null;
+
+function startPolling(){
+  if(pollTimers.length) return;
+  pollTimers = [
+    setInterval(fetchLatest, 1000),
+    setInterval(fetchHistoryAndRender, 5000),
+    setInterval(fetchStats, 1000),
+    setInterval(loadDumpStatus, 5000),
+  ];
+}
+
+function stopPolling(){
+  pollTimers.forEach(clearInterval);
+  pollTimers = [];
+}
+
+function scheduleHistory(){
+  // Coalesce bursts of sample events into one downsampled chart refresh
+  if(historyTimer) return;
+  historyTimer = setTimeout(()=>{ historyTimer = null; fetchHistoryAndRender(); }, 5000);
+}
+
+function connectStream(){
+  if(!window.EventSource){ startPolling(); return; }
+  const es = new EventSource('/api/stream'+(DEV_Q?'?'+DEV_Q:''));
+  let failures = 0;
+  const on = (name, fn)=>es.addEventListener(name, ev=>{
+    failures = 0; stopPolling();
+    try{ fn(JSON.parse(ev.data)); }catch(e){}
+  });
+  on('latest', renderLatest);
+  on('stats', renderStats);
+  on('dump', renderDumpStatus);
+  on('samples', d=>{
+    const items = (d.items||[]).filter(it=>!DEVICE || it.device===DEVICE);
+    if(!items.length) return;
+    const it = items[items.length-1];
+    renderLatest({ready:true, ts:it.ts, fsr_pct:it.fsr, t1_c:it.t1_c, t2_c:it.t2_c, volume:it.volume});
+    scheduleHistory();
+  });
+  on('resync', ()=>{ fetchLatest(); fetchStats(); loadDumpStatus(); fetchHistoryAndRender(); });
+  es.onerror = ()=>{
+    // EventSource reconnects by itself; fall back to polling while it is down
+    document.getElementById('status').textContent='Reconnecting…';
+    if(++failures >= 3) startPolling();
+  };
+}
+
 async function saveDumpConfig(){
   const enabled=document.getElementById('dump-enabled').checked;
-  const interval_seconds=Math.max(1,parseInt(document.getElementById('dump-interval').value||'10',10));
+  const max_rows=Math.max(0,parseInt(document.getElementById('dump-interval').value||'0',10));
   const path=document.getElementById('dump-path').value.trim();
   await fetch('/api/dump-config',{
     method:'POST',
     headers:{'Content-Type':'application/json'},
-    body:JSON.stringify({enabled,interval_seconds,path})
+    body:JSON.stringify({enabled,max_rows,path})
   });
   await loadDumpConfig();
 }
 
+// dump-now and delete-all answer 202 with a job id; poll it until it finishes
+const activeJobs = {};
+
+async function runJob(url, kind, onProgress){
+  const res=await fetch(url,{method:'POST'});
+  const data=await res.json().catch(()=>null);
+  if(!res.ok || !data || !data.job){
+    throw new Error((data&&data.message)?data.message:`Server error (${res.status})`);
+  }
+  activeJobs[kind]=data.job;
+  try{
+    for(;;){
+      await new Promise(r=>setTimeout(r,1000));
+      const job=await (await fetch(`/api/jobs/${data.job}?t=${Date.now()}`)).json();
+      if(onProgress) onProgress(job.progress||{});
+      if(['done','failed','cancelled'].includes(job.state)) return job;
+    }
+  }finally{
+    delete activeJobs[kind];
+  }
+}
+
+async function cancelJob(kind){
+  if(activeJobs[kind]) await fetch(`/api/jobs/${activeJobs[kind]}/cancel`,{method:'POST'});
+}
+
+function jobMessage(job, fallback){
+  if(job.state==='cancelled') return 'Cancelled.';
+  if(job.state==='failed') return job.error||'failed';
+  return (job.result&&job.result.message)?job.result.message:fallback;
+}
+
 async function dumpNow(opts={}){
   const silent = !!opts.silent;
   const btn=document.getElementById('dump-now');
 
   if(dumpingNow){
-    if(!silent) alert('A dump is already in progress.');
+    if(!silent && confirm('A dump is already in progress. Cancel it?')) await cancelJob('dump');
     return;
   }
   dumpingNow = true;
 
   try{
-    if(!silent && btn){ btn.disabled=true; btn.textContent='Dumping…'; }
-    const res=await fetch('/api/dump-now',{method:'POST'});
-    const data=await res.json().catch(()=>null);
-    if(!res.ok){
-      const msg=(data&&data.message)?data.message:`Server error (${res.status})`;
+    if(!silent && btn){ btn.textContent='Dumping…'; }
+    const job=await runJob('/api/dump-now','dump',p=>{
+      if(!silent && btn) btn.textContent=`Dumping… ${p.rows||0} rows`;
+    });
+    if(job.state!=='done'){
+      const msg=jobMessage(job);
       if(!silent) alert('Dump failed: '+msg);
       console.warn('[clientDump] dump failed:', msg);
       return;
@@ -329,58 +427,42 @@ async function dumpNow(opts={}){
     if(!silent){ await clearDataUI(); }
     await fetchLatest(); await fetchHistoryAndRender(); await fetchStats(); await loadDumpStatus();
     if(!silent){
-      alert((data&&data.message)?data.message:'Dump completed.');
+      alert(jobMessage(job,'Dump completed.'));
     }else{
-      console.log('[clientDump] dump success:', (data&&data.message)?data.message:'ok');
+      console.log('[clientDump] dump success:', jobMessage(job,'ok'));
     }
   }catch(err){
     if(!silent) alert('Dump failed: '+(err&&err.message?err.message:String(err)));
     console.warn('[clientDump] dump error:', err);
   }finally{
-    if(!silent && btn){ btn.disabled=false; btn.textContent='Dump Now'; }
+    if(!silent && btn){ btn.textContent='Dump Now'; }
     dumpingNow = false;
   }
 }
 
 async function dumpDeleteAll(){
   console.log('[ui] dump-delete clicked');
+  if(activeJobs.delete){
+    if(confirm('A delete is in progress. Cancel it?')) await cancelJob('delete');
+    return;
+  }
   if(!confirm('Delete ALL JSON files in the configured GitHub path? This cannot be undone.')) return;
   const btn=document.getElementById('dump-delete');
   try{
-    if(btn){ btn.disabled=true; btn.textContent='Deleting…'; }
-    const res=await fetch('/api/dump-delete-all',{method:'POST'});
-    const data=await res.json().catch(()=>null);
-    if(!res.ok){
-      const errs = (data && data.errors) ? '\n' + data.errors.map(e=>`- ${e.path}: ${e.error}`).join('\n') : '';
-      const msg=(data&&data.message)?data.message:`Server error (${res.status})`;
-      alert('Delete failed: '+msg+errs);
+    if(btn){ btn.textContent='Deleting…'; }
+    const job=await runJob('/api/dump-delete-all','delete',p=>{
+      if(btn && p.total) btn.textContent=`Deleting… ${p.deleted||0}/${p.total}`;
+    });
+    if(job.state!=='done'){
+      alert('Delete failed: '+jobMessage(job));
       return;
     }
-    alert((data&&data.message)?data.message:'Delete completed.');
+    alert(jobMessage(job,'Delete completed.'));
     await loadDumpStatus();
   }catch(err){
     alert('Delete failed: '+(err&&err.message?err.message:String(err)));
   }finally{
-    if(btn){ btn.disabled=false; btn.textContent='Delete Repo Data'; }
-  }
-}
-
-function maybeTriggerThresholdDump(totalRows){
-  const enabled = !!document.getElementById('dump-enabled').checked;
-  if(!enabled) return;
-  const threshold = getRowsThreshold();
-  const now = Date.now();
-  const cooldownOk = (now - autoRowsLastTriggered) > 5000;
-  if(!dumpingNow && totalRows >= threshold && cooldownOk){
-    autoRowsLastTriggered = now;
-    const btn = document.getElementById('dump-now');
-    if(btn){
-      console.log(`[clientDump] threshold ${threshold} reached (rows=${totalRows}) → clicking Dump Now`);
-      btn.dataset.autoclick = '1';
-      btn.click();
-    }else{
-      dumpNow({silent:true});
-    }
+    if(btn){ btn.textContent='Delete Repo Data'; }
   }
 }
 
@@ -389,11 +471,7 @@ function init(){
   if (clearBtn) clearBtn.addEventListener('click', clearData);
 
   const dumpNowBtn = document.getElementById('dump-now');
-  if (dumpNowBtn) dumpNowBtn.addEventListener('click', (e)=>{
-    const silent = e.currentTarget.dataset.autoclick === '1';
-    e.currentTarget.dataset.autoclick = '';
-    dumpNow({silent});
-  });
+  if (dumpNowBtn) dumpNowBtn.addEventListener('click', ()=>dumpNow());
 
   const dumpSaveBtn = document.getElementById('dump-save');
   if (dumpSaveBtn) dumpSaveBtn.addEventListener('click', saveDumpConfig);
@@ -404,10 +482,7 @@ function init(){
   initDraggables();
   fetchLatest(); fetchHistoryAndRender(); fetchStats(); loadDumpConfig(); loadDumpStatus();
 
-  setInterval(fetchLatest, 1000);
-  setInterval(fetchHistoryAndRender, 5000);
-  setInterval(fetchStats, 1000);
-  setInterval(loadDumpStatus, 5000);
+  connectStream();
 }
 
 document.addEventListener('DOMContentLoaded', init);
@@ -0,0 +1,142 @@
+# server/storage.py
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+# --- Configuration via environment variables ---
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL").upper()
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+SQLITE_CACHE_SIZE = _env_int("SQLITE_CACHE_SIZE", -16000)          # negative = KiB
+SQLITE_MMAP_SIZE = _env_int("SQLITE_MMAP_SIZE", 64 * 1024 * 1024)
+SQLITE_BUSY_TIMEOUT_MS = _env_int("SQLITE_BUSY_TIMEOUT_MS", 5000)
+SQLITE_READERS = _env_int("SQLITE_READERS", 4)
+SQLITE_STMT_CACHE = _env_int("SQLITE_STMT_CACHE", 256)
+
+
+class Storage:
+    """
+    Long-lived SQLite connections: one writer (serialised by a lock) and a
+    small pool of read-only connections. In WAL mode readers never block the
+    writer, and the per-request connect/close cost goes away. sqlite3 keeps a
+    per-connection cache of prepared statements (`cached_statements`), so the
+    same SQL strings are compiled once per connection, not once per request.
+    """
+
+    def __init__(self, path: str, *, readers: int = SQLITE_READERS,
+                 journal_mode: str = SQLITE_JOURNAL_MODE, synchronous: str = SQLITE_SYNCHRONOUS,
+                 cache_size: int = SQLITE_CACHE_SIZE, mmap_size: int = SQLITE_MMAP_SIZE,
+                 busy_timeout_ms: int = SQLITE_BUSY_TIMEOUT_MS, cached_statements: int = SQLITE_STMT_CACHE):
+        self.path = path
+        self.max_readers = max(1, int(readers))
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.cache_size = int(cache_size)
+        self.mmap_size = int(mmap_size)
+        self.busy_timeout_ms = int(busy_timeout_ms)
+        self.cached_statements = int(cached_statements)
+
+        self._write_lock = threading.RLock()
+        self._writer: Optional[sqlite3.Connection] = None
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._readers_open = 0
+        self._readers_lock = threading.Lock()
+
+    # ---------- connections ----------
+    def _connect(self, read_only: bool) -> sqlite3.Connection:
+        if read_only:
+            uri = "file:" + os.path.abspath(self.path) + "?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                                   timeout=self.busy_timeout_ms / 1000.0,
+                                   cached_statements=self.cached_statements)
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread=False,
+                                   timeout=self.busy_timeout_ms / 1000.0,
+                                   cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        if not read_only:
+            conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA cache_size={self.cache_size}")
+        conn.execute(f"PRAGMA mmap_size={self.mmap_size}")
+        conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _writer_conn(self) -> sqlite3.Connection:
+        if self._writer is None:
+            self._writer = self._connect(read_only=False)
+        return self._writer
+
+    @contextmanager
+    def write(self) -> Iterator[sqlite3.Connection]:
+        """Exclusive use of the writer connection inside one transaction."""
+        with self._write_lock:
+            conn = self._writer_conn()
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    @contextmanager
+    def read(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a read-only connection from the pool."""
+        conn = self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    def _acquire_reader(self) -> sqlite3.Connection:
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._readers_lock:
+            if self._readers_open < self.max_readers:
+                # Readers need the file to exist; the writer creates it
+                if not os.path.exists(self.path):
+                    with self._write_lock:
+                        self._writer_conn()
+                conn = self._connect(read_only=True)
+                self._readers_open += 1
+                return conn
+        return self._readers.get(timeout=self.busy_timeout_ms / 1000.0)
+
+    def close(self):
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._readers_lock:
+            while True:
+                try:
+                    self._readers.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._readers_open = 0
+
+    def info(self) -> Dict[str, object]:
+        return {
+            "path": self.path,
+            "journal_mode": self.journal_mode,
+            "synchronous": self.synchronous,
+            "cache_size": self.cache_size,
+            "mmap_size": self.mmap_size,
+            "readers_open": self._readers_open,
+            "readers_max": self.max_readers,
+        }
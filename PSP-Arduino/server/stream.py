@@ -0,0 +1,137 @@
+# server/stream.py
+import json
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, Optional
+
+_RESYNC = b"event: resync\ndata: {}\n\n"
+
+
+def encode_event(event: str, data: Any) -> bytes:
+    """One Server-Sent Events frame."""
+    body = json.dumps(data, separators=(",", ":"))
+    return f"event: {event}\ndata: {body}\n\n".encode("utf-8")
+
+
+class Subscriber:
+    """One connected client: a bounded buffer of already-encoded frames, and its ?device filter."""
+
+    def __init__(self, maxlen: int, device: Optional[str] = None):
+        self.device = device
+        self.buf: deque = deque(maxlen=maxlen)
+        self.cond = threading.Condition()
+        self.overflowed = False
+        self.dropped = 0
+        self.closed = False
+
+    def push(self, frame: bytes):
+        with self.cond:
+            if len(self.buf) == self.buf.maxlen:
+                # Slow client: drop its oldest frame instead of blocking everyone
+                self.overflowed = True
+                self.dropped += 1
+            self.buf.append(frame)
+            self.cond.notify()
+
+    def pop_all(self, timeout: float) -> Optional[list]:
+        with self.cond:
+            if not self.buf and not self.closed:
+                self.cond.wait(timeout)
+            frames = list(self.buf)
+            self.buf.clear()
+            if self.overflowed:
+                # Tell the client it missed frames so it can refetch a snapshot
+                frames.insert(0, _RESYNC)
+                self.overflowed = False
+            return frames
+
+
+class EventBroker:
+    """
+    Fan-out hub for live updates. publish() encodes an event once and appends
+    the same bytes to every subscriber's bounded buffer, so server work is
+    proportional to the event rate, not to clients × poll frequency.
+    """
+
+    def __init__(self, max_clients: int = 100, client_buffer: int = 256, heartbeat_s: float = 15.0):
+        self.max_clients = max(1, int(max_clients))
+        self.client_buffer = max(1, int(client_buffer))
+        self.heartbeat_s = float(heartbeat_s)
+        self._subs: set = set()
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def has_subscribers(self) -> bool:
+        return bool(self._subs)
+
+    def subscribe(self, device: Optional[str] = None) -> Optional[Subscriber]:
+        with self._lock:
+            if len(self._subs) >= self.max_clients:
+                return None
+            sub = Subscriber(self.client_buffer, device)
+            self._subs.add(sub)
+            return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        with self._lock:
+            self._subs.discard(sub)
+        with sub.cond:
+            sub.closed = True
+            sub.cond.notify_all()
+
+    def publish(self, event: str, data: Any):
+        if not self._subs:
+            return
+        frame = encode_event(event, data)
+        with self._lock:
+            subs = list(self._subs)
+        for sub in subs:
+            sub.push(frame)
+        self.published += 1
+
+    def publish_each(self, event: str, payload: Callable[[Optional[str]], Any]):
+        """Like publish(), for data that depends on the client's device filter: payload(device) once per distinct filter."""
+        with self._lock:
+            subs = list(self._subs)
+        frames: Dict[Optional[str], bytes] = {}
+        for sub in subs:
+            if sub.device not in frames:
+                frames[sub.device] = encode_event(event, payload(sub.device))
+            sub.push(frames[sub.device])
+        self.published += 1
+
+    def stream(self, sub: Subscriber, initial: Optional[list] = None) -> Iterator[bytes]:
+        """Generator for the HTTP response body; unsubscribes when the client goes away."""
+        try:
+            yield b"retry: 3000\n\n"
+            for frame in initial or ():
+                yield frame
+            while not sub.closed:
+                frames = sub.pop_all(self.heartbeat_s)
+                if frames:
+                    yield b"".join(frames)
+                else:
+                    yield b": ping\n\n"
+        finally:
+            self.unsubscribe(sub)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            subs = list(self._subs)
+        return {"clients": len(subs), "max_clients": self.max_clients, "client_buffer": self.client_buffer,
+                "published": self.published, "dropped": sum(s.dropped for s in subs)}
+
+
+def ticker(interval_s: float, fn, name: str = "stream-ticker"):
+    """Run fn every interval_s on a daemon thread (errors are logged, not fatal)."""
+    def _loop():
+        while True:
+            time.sleep(interval_s)
+            try:
+                fn()
+            except Exception as e:
+                print(f"[stream] ticker error: {e}", flush=True)
+    t = threading.Thread(target=_loop, name=name, daemon=True)
+    t.start()
+    return t
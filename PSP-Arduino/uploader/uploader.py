@@ -10,13 +10,15 @@ POST body to /api/data:
   "fsr": [8 values 0..100],
   "t1_c": float,
   "t2_c": float,
-  "volume": 0..100
+  "volume": 0..100,
+  "device": DEVICE_ID
 }
 
 Env overrides:
   API_URL      (default http://localhost:5000/api/data)
   BAUD_RATE    (default 115200)
   SERIAL_PORT  (skip auto-scan and force a port)
+  DEVICE_ID    (pillow id sent with every sample; default "default")
 """
 
 import os
@@ -28,6 +30,7 @@ from serial.tools import list_ports
 API_URL   = os.environ.get("API_URL", "http://localhost:5000/api/data")
 BAUD      = int(os.environ.get("BAUD_RATE", "115200"))
 PORT_ENV  = os.environ.get("SERIAL_PORT")
+DEVICE_ID = os.environ.get("DEVICE_ID", "default")
 
 
 def find_port():
@@ -73,7 +76,7 @@ def parse_csv_line(line):
     t1  = float(parts[8])
     t2  = float(parts[9])
     vol = scale_to_100(parts[10])
-    return {"fsr": fsr, "t1_c": t1, "t2_c": t2, "volume": vol}
+    return {"fsr": fsr, "t1_c": t1, "t2_c": t2, "volume": vol, "device": DEVICE_ID}
 
 
 def main():
@@ -15,7 +15,11 @@ Install:  pip install scikit-learn pandas numpy scipy
 """
 
 from __future__ import annotations
+import glob
+import gzip
+import hashlib
 import json
+import os
 from dataclasses import dataclass
 from typing import Dict, List, Tuple, Optional
 
@@ -189,16 +193,40 @@ def generate_synthetic_dataset(cfg: DataConfig = DataConfig(), *, label_flip: fl
 # ================================
 
 
+def _read_dump_file(path: str):
+    """
+    Raw JSON object of one stream/dump file, whatever its version:
+      - v1 dumps / plain JSON: {"count":N,"items":[...]} or a list
+      - v2 dumps (*.ndjson.gz): gzip'd NDJSON, first line {"format":"psp-dump","version":2,...}
+      - plain NDJSON (*.ndjson / *.jsonl, optionally .gz)
+    NDJSON is returned as {"items": [...]} so it normalizes like v1.
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    if raw[:2] == b"\x1f\x8b":
+        raw = gzip.decompress(raw)
+    text = raw.decode("utf-8")
+    first = text.lstrip()[:1]
+    if first == "[" or (first == "{" and not path.endswith((".ndjson", ".jsonl", ".ndjson.gz", ".jsonl.gz"))):
+        return json.loads(text)
+    items = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if items and items[0].get("format") == "psp-dump":
+        header, items = items[0], items[1:]
+        if header.get("count") is not None and header["count"] != len(items):
+            raise ValueError(f"{path}: header says {header['count']} rows, file has {len(items)}")
+    return {"items": items}
+
+
 def load_json_stream(path: str) -> pd.DataFrame:
     """
     Read stream JSON and normalize schema:
       - Accepts top-level list OR dict with 'data'/'records'/'rows'/'items'
+      - Also reads v2 server dumps (.ndjson.gz) and NDJSON (see _read_dump_file)
       - Renames timestamp column to 'ts' (accepts ts/timestamp/time/datetime/date)
       - Parses 'ts' to UTC datetime (handles ISO strings or numeric epoch s/ms)
     Expected fields after normalization: ts (datetime), fsr (list), t1_c, t2_c, volume in [0,1]
     """
-    with open(path, "r") as f:
-        obj = json.load(f)
+    obj = _read_dump_file(path)
 
     # 1) Extract the array of records
     if isinstance(obj, list):
@@ -239,6 +267,65 @@ def load_json_stream(path: str) -> pd.DataFrame:
     return df
 
 
+def _utc(t) -> Optional[pd.Timestamp]:
+    if t is None:
+        return None
+    t = pd.Timestamp(t)
+    return t.tz_localize("UTC") if t.tzinfo is None else t.tz_convert("UTC")
+
+
+def load_dump_folder(folder: str, device: Optional[str] = None, start=None, end=None,
+                     verify: bool = True) -> pd.DataFrame:
+    """
+    Load every server dump under folder (e.g. PSP-Arduino/Data) into one frame.
+      - With manifests (folder/manifests/*.json), only files whose device and
+        [ts_from, ts_to] match are opened, and each is checked against its sha256
+      - Files the manifests do not list (older v1 dumps) are read too, then
+        filtered by ts/device after loading
+      - Daily archives written by server/compact.py are read like any other dump
+      - Rows without a device (v1 dumps) get device 'default'
+    """
+    start, end = _utc(start), _utc(end)
+    listed: Dict[str, dict] = {}
+    for mpath in sorted(glob.glob(os.path.join(folder, "manifests", "*.json"))):
+        with open(mpath, "r") as f:
+            listed.update(json.load(f).get("files", {}))
+    paths = []
+    for rel, entry in listed.items():
+        if device is not None and entry.get("device") != device:
+            continue
+        if start is not None and entry.get("ts_to") and pd.Timestamp(entry["ts_to"]) < start:
+            continue
+        if end is not None and entry.get("ts_from") and pd.Timestamp(entry["ts_from"]) > end:
+            continue
+        path = os.path.join(folder, rel)
+        if verify:
+            with open(path, "rb") as f:
+                if hashlib.sha256(f.read()).hexdigest() != entry.get("sha256"):
+                    raise ValueError(f"{path}: sha256 does not match its manifest entry")
+        paths.append(path)
+    listed_abs = {os.path.normpath(os.path.join(folder, rel)) for rel in listed}
+    unlisted = glob.glob(os.path.join(folder, "**", "dump_*"), recursive=True)
+    unlisted += glob.glob(os.path.join(folder, "**", "daily_*"), recursive=True)   # compact.py archives
+    for path in sorted(unlisted):
+        if os.path.normpath(path) not in listed_abs and path.endswith((".json", ".ndjson.gz")):
+            paths.append(path)
+
+    frames = [load_json_stream(p) for p in paths]
+    frames = [f for f in frames if len(f)]
+    if not frames:
+        return pd.DataFrame(columns=["ts", "fsr", "t1_c", "t2_c", "volume", "device"])
+    df = pd.concat(frames, ignore_index=True)
+    df["device"] = df["device"].fillna("default") if "device" in df.columns else "default"
+    if device is not None:
+        df = df[df["device"] == device]
+    if start is not None:
+        df = df[df["ts"] >= start]
+    if end is not None:
+        df = df[df["ts"] <= end]
+    return df.sort_values("ts").reset_index(drop=True)
+
+
 
 def _epoch_groups(df: pd.DataFrame, epoch_s: int = 30):
     t = pd.to_datetime(df["ts"]).view("int64")